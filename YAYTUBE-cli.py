@@ -1,197 +1,3719 @@
-import os
-from youtubesearchpython import VideosSearch
-import yt_dlp
-from rich.console import Console
-from rich.text import Text
-from rich.table import Table
-import time
-import re
-import vlc  # For audio playback
-
-# Initialize console for rich text
-console = Console()
-
-def display_banner():
-    """Display an ASCII art banner."""
-    banner = """
-██╗   ██╗ █████╗ ██╗   ██╗████████╗██╗   ██╗██████╗ ███████╗
-╚██╗ ██╔╝██╔══██╗╚██╗ ██╔╝╚══██╔══╝██║   ██║██╔══██╗██╔════╝
- ╚████╔╝ ███████║ ╚████╔╝    ██║   ██║   ██║██████╔╝█████╗  
-  ╚██╔╝  ██╔══██║  ╚██╔╝     ██║   ██║   ██║██╔══██╗██╔══╝  
-   ██║   ██║  ██║   ██║      ██║   ╚██████╔╝██████╔╝███████╗
-   ╚═╝   ╚═╝  ╚═╝   ╚═╝      ╚═╝    ╚═════╝ ╚═════╝ ╚══════╝                                                       
-    """
-    console.print(Text.from_markup(banner, style="bold beige"))
-
-def search_youtube(query, max_results=5):
-    """Search for videos on YouTube."""
-    search = VideosSearch(query, limit=max_results)
-    results = search.result()['result']
-    videos = [(video['title'], video['link'], video['publishedTime'], video['duration']) for video in results]
-    return videos
-
-def download_video(url, output_path, format='bestaudio', quality=None):
-    """Download video or audio from YouTube."""
-    ydl_opts = {
-        'format': format,
-        'outtmpl': output_path,
-        'postprocessors': []
-    }
-
-    if format == 'bestaudio' and quality:
-        ydl_opts['format'] = f'bestaudio[ext=m4a]/bestaudio[ext=webm]/bestaudio/best'
-        ydl_opts['postprocessors'].append({
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'mp3',
-            'preferredquality': quality,
-        })
-
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        ydl.download([url])
-
-def format_search_results(videos):
-    """Format search results into a table."""
-    table = Table(title="Search Results", header_style="bold blue")
-    table.add_column("No.", style="bold cyan")
-    table.add_column("Title", style="bold magenta")
-    table.add_column("URL", style="dim")
-    table.add_column("Published Time", style="italic")
-    table.add_column("Duration", style="italic")
-    
-    for idx, (title, url, published_time, duration) in enumerate(videos, 1):
-        table.add_row(str(idx), title, url, published_time, duration)
-
-    return table
-
-def list_downloaded_songs():
-    """List downloaded songs in a tabular form."""
-    songs = [f for f in os.listdir() if f.endswith('.mp3') or f.endswith('.mp4')]
-    table = Table(title="Downloaded Songs", header_style="bold blue")
-    table.add_column("No.", style="bold cyan")
-    table.add_column("Title", style="bold magenta")
-    
-    for idx, song in enumerate(songs, 1):
-        table.add_row(str(idx), song)
-
-    return table
-
-def play_song(file_path):
-    """Play a song using VLC."""
-    player = vlc.MediaPlayer(file_path)
-    player.play()
-    return player
-def clear_screen():
-    """Clear the terminal screen."""
-    time.sleep(2)
-    os.system('cls' if os.name == 'nt' else 'clear')
-
-def main():
-    player = None
-
-    while True:
-        clear_screen()  # Clear screen while keeping the banner
-        display_banner()
-        console.print("\n[bold green]Welcome to the YaYtube CLI[/bold green]")
-        console.print("[cyan]1. Search for a song by name[/cyan]")
-        console.print("[cyan]2. Search for songs by artist[/cyan]")
-        console.print("[cyan]3. Paste a YouTube URL to download[/cyan]")
-        console.print("[cyan]4. List downloaded songs[/cyan]")
-        console.print("[cyan]5. Exit[/cyan]")
-        
-        choice = input("Enter your choice (1-5): ").strip()
-
-        if choice == '1':
-            query = input("Enter the song name: ").strip()
-            start_time = time.time()
-            videos = search_youtube(query)
-            runtime = time.time() - start_time
-            if videos:
-                console.print(format_search_results(videos))
-                console.print(f"\n[bold green]Search completed in {runtime:.2f} seconds.[/bold green]")
-                video_choice = input("\nEnter the number of the video to download (or 'c' to cancel): ").strip()
-                if video_choice.isdigit() and 1 <= int(video_choice) <= len(videos):
-                    title, url, _, _ = videos[int(video_choice) - 1]
-                else:
-                    continue
-            else:
-                console.print("[red]No results found.[/red]")
-                continue
-
-        elif choice == '2':
-            artist_name = input("Enter the artist name: ").strip()
-            start_time = time.time()
-            videos = search_youtube(artist_name)
-            runtime = time.time() - start_time
-            if videos:
-                console.print(format_search_results(videos))
-                console.print(f"\n[bold green]Search completed in {runtime:.2f} seconds.[/bold green]")
-                video_choice = input("\nEnter the number of the video to download (or 'c' to cancel): ").strip()
-                if video_choice.isdigit() and 1 <= int(video_choice) <= len(videos):
-                    title, url, _, _ = videos[int(video_choice) - 1]
-                else:
-                    continue
-            else:
-                console.print("[red]No results found.[/red]")
-                continue
-
-        elif choice == '3':
-            url = input("Paste the YouTube URL: ").strip()
-            video_info = search_youtube(url.split('/')[-1], max_results=1)
-            if video_info:
-                title = video_info[0][0]
-            else:
-                console.print("[red]Could not retrieve video title. Please try again.[/red]")
-                continue
-        elif choice == '4':
-            clear_screen()
-            display_banner()
-            console.print("[bold green]List of Downloaded Songs:[/bold green]")
-            console.print(list_downloaded_songs())
-            song_choice = input("Enter the number of the song to play (or 'c' to cancel): ").strip()
-            if song_choice.isdigit() and 1 <= int(song_choice):
-                songs = [f for f in os.listdir() if f.endswith('.mp3') or f.endswith('.mp4')]
-                song_file = songs[int(song_choice) - 1]
-                if player:
-                    player.stop()
-                player = play_song(song_file)
-                console.print("[bold yellow]Playing... Press 'p' to pause, 'r' to resume, 'n' to move to the next song, or 'q' to quit.[/bold yellow]")
-                while True:
-                    control = input("Enter your choice (p/r/n/q): ").strip().lower()
-                    if control == 'p':
-                        player.pause()
-                        console.print("[bold yellow]Paused. Press 'r' to resume, 'n' to move to the next song, or 'q' to quit.[/bold yellow]")
-                    elif control == 'r':
-                        player.play()
-                        console.print("[bold yellow]Resumed. Press 'p' to pause, 'n' to move to the next song, or 'q' to quit.[/bold yellow]")
-                    elif control == 'n':
-                        player.stop()
-                        break
-                    elif control == 'q':
-                        player.stop()
-                        break
-                    else:
-                        console.print("[red]Invalid option. Please try again.[/red]")
-            continue
-
-        elif choice == '5':
-            console.print("[bold yellow]Goodbye![/bold yellow]")
-            break
-        else:
-            console.print("[red]Invalid choice. Please try again.[/red]")
-            continue
-
-        output_format = input("Choose output format (mp3/mp4): ").strip().lower()
-        sanitized_title = re.sub(r'[\/:*?"<>|]', "", title)
-        output_path = os.path.join(os.getcwd(), sanitized_title)
-
-        if output_format == 'mp3':
-            quality = input("Choose audio quality (e.g., 128, 192, 320): ").strip()
-            download_video(url, f"{output_path}.mp3", format='bestaudio', quality=quality)
-        elif output_format == 'mp4':
-            download_video(url, f"{output_path}.mp4", format='bestvideo+bestaudio')
-
-        clear_screen()
-        console.print(f"[bold green]Download complete! File saved at {output_path}.{output_format}[/bold green]")
-
-if __name__ == "__main__":
-    main()
+import os
+import sys
+import json
+import heapq
+import itertools
+import threading
+import sqlite3
+import importlib
+import argparse
+import subprocess
+import statistics
+import functools
+import contextlib
+import atexit
+import random
+import bisect
+from collections import deque
+from queue import SimpleQueue
+import copy
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import Counter, OrderedDict
+import time
+import re
+from urllib.parse import quote, unquote, urlparse, parse_qs
+
+class Lazy:
+    """Proxy that builds the wrapped object the first time it is used, so heavy imports stay off startup."""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._target = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._target is None:
+            with self._lock:
+                if self._target is None:
+                    self._target = self._factory()
+        return self._target
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __call__(self, *args, **kwargs):
+        return self._load()(*args, **kwargs)
+
+def lazy_import(module, attribute=None):
+    """Import a module (or one attribute of it) on first use."""
+    if attribute is None:
+        return Lazy(lambda: importlib.import_module(module))
+    return Lazy(lambda: getattr(importlib.import_module(module), attribute))
+
+VideosSearch = lazy_import('youtubesearchpython', 'VideosSearch')
+yt_dlp = lazy_import('yt_dlp')
+Text = lazy_import('rich.text', 'Text')
+Table = lazy_import('rich.table', 'Table')
+Live = lazy_import('rich.live', 'Live')
+vlc = lazy_import('vlc')  # For audio playback
+np = lazy_import('numpy')  # Only needed for library analysis
+ProcessPoolExecutor = lazy_import('concurrent.futures', 'ProcessPoolExecutor')  # Pulls in multiprocessing
+http_server = lazy_import('http.server')  # Local proxy for playing songs that are still downloading
+
+# Initialize console for rich text
+console = Lazy(lambda: importlib.import_module('rich.console').Console())
+# Batch mode keeps stdout for the JSON summary and reports progress here
+err_console = Lazy(lambda: importlib.import_module('rich.console').Console(stderr=True))
+
+# Set whenever something is printed that the user should read before the screen is cleared
+unread_output = threading.Event()
+
+def notify(message):
+    """Print a message and keep it on screen until the user has seen it."""
+    console.print(message)
+    unread_output.set()
+
+CONFIG_FILE = "config.json"
+CACHE_DB = "yaytube_cache.db"  # SQLite database shared by the caches and indexes
+PLAYLIST_DB = "playlists.db"
+PLAYLIST_FILE = "playlists.json"  # Older releases kept playlists here; it is imported into PLAYLIST_DB once
+NO_RESUME_ENV = "YAYTUBE_NO_RESUME"  # Set to start without resuming unfinished downloads (used by --benchmark-startup)
+
+DEFAULT_SETTINGS = {
+    "download_workers": 3,  # Number of downloads that run at the same time
+    "search_cache_ttl": 24 * 60 * 60,  # Seconds before a cached search result goes stale
+    "search_cache_size": 500,  # Maximum number of cached searches kept on disk
+    "metadata_cache_ttl": 7 * 24 * 60 * 60,  # Seconds before cached video metadata is fetched again
+    "resolve_workers": 4,  # Searches / metadata lookups that run at the same time in batch mode
+    "sync_stop_after": 50,  # Stop listing a channel after this many already-downloaded videos in a row
+    "source_cache_dir": "source_cache",  # Raw downloaded streams, reused for later transcodes
+    "source_cache_size_mb": 2048,  # Least recently used streams are evicted past this size
+    "ffmpeg_path": "ffmpeg",
+    "search_hedge_after": None,  # Seconds before a duplicate search is sent (None: use the observed p95)
+    "search_retries": 3,  # Attempts per search before giving up
+    "search_timeout": 15,  # Seconds to wait for any single search
+    "search_breaker_threshold": 5,  # Consecutive failures that open the circuit breaker
+    "search_breaker_reset": 30,  # Seconds the breaker stays open before one trial request
+    "prefetch_lookahead": 3,  # Upcoming playlist songs downloaded in the background while one plays
+    "prefetch_rate_limit_kb": 512,  # Download speed cap for those background downloads, in KB/s (0: no cap)
+    "stream_start_kb": 256,  # Audio that must have arrived before play-while-downloading starts
+    "daemon_port": 8765,  # Localhost port of the --daemon API
+    "bandwidth_limit_kb": 0,  # Total download speed shared by all jobs, in KB/s (0: no cap)
+    "per_host_downloads": 2,  # Streams fetched from the same host at the same time
+    "preempt_priority": 20,  # Jobs below this priority pause running jobs at or above it (background work)
+}
+
+# Stream URLs inside extracted metadata expire after roughly six hours, so only
+# reuse extracted info for a download while it is comfortably younger than that
+STREAM_URL_TTL = 3 * 60 * 60
+
+def load_settings():
+    """Load settings from a config file."""
+    if os.path.exists(CONFIG_FILE):
+        with open(CONFIG_FILE, "r") as file:
+            settings = json.load(file)
+            # Merge the loaded settings with DEFAULT_SETTINGS to ensure all keys are present
+            return {**DEFAULT_SETTINGS, **settings}
+    return dict(DEFAULT_SETTINGS)
+
+settings = load_settings()
+
+def open_database(path=CACHE_DB):
+    """Open the SQLite database used for caches and indexes."""
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+class SqliteStore:
+    """Base for the stores kept in SQLite. The database is opened, and `schema` created, on first use
+    so startup stays cheap."""
+
+    schema = ()  # Statements run once the database is open: pragmas and CREATE ... IF NOT EXISTS
+
+    def __init__(self, path=CACHE_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+
+    @property
+    def db(self):
+        if self._conn is None:
+            conn = open_database(self.path)
+            for statement in self.schema:
+                conn.execute(statement)
+            self._conn = conn
+            self._setup()
+        return self._conn
+
+    def _setup(self):
+        """Extra work once the database is open, such as migrations."""
+
+class SearchCache(SqliteStore):
+    """Search results cached on disk with a TTL and LRU eviction, fronted by an in-memory LRU."""
+
+    schema = (
+        'CREATE TABLE IF NOT EXISTS search_cache ('
+        'key TEXT PRIMARY KEY, results TEXT NOT NULL, stored_at REAL NOT NULL, last_used REAL NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS search_cache_last_used ON search_cache (last_used)',
+    )
+
+    def __init__(self, path=CACHE_DB, ttl=24 * 60 * 60, max_entries=500, memory_entries=64):
+        super().__init__(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._touched = {}  # Key -> time of memory hits whose last_used is not on disk yet
+        self._flushed_at = time.time()
+        self.flush_interval = 60.0
+
+    @staticmethod
+    def make_key(query, limit):
+        """Normalize a query so that trivially different spellings share an entry."""
+        return f"{' '.join(query.lower().split())}|{limit}"
+
+    def get(self, query, limit):
+        """Return cached results for a query, or None on a miss."""
+        key = self.make_key(query, limit)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry and now - entry[0] < self.ttl:
+                self._memory.move_to_end(key)
+                self._touched[key] = now
+                if now - self._flushed_at >= self.flush_interval:
+                    self._flush_touched()
+                self.hits += 1
+                return entry[1]
+            row = self.db.execute('SELECT results, stored_at FROM search_cache WHERE key = ?', (key,)).fetchone()
+            if row and now - row[1] < self.ttl:
+                videos = [tuple(video) for video in json.loads(row[0])]
+                with self.db:
+                    self.db.execute('UPDATE search_cache SET last_used = ? WHERE key = ?', (now, key))
+                self._remember(key, row[1], videos)
+                self.hits += 1
+                return videos
+            self.misses += 1
+            return None
+
+    def put(self, query, limit, videos):
+        """Store search results and evict the least recently used entries past the size cap."""
+        key = self.make_key(query, limit)
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, videos)
+            # Eviction below goes by last_used, so it has to see the memory hits first
+            self._flush_touched()
+            with self.db:
+                self.db.execute('INSERT OR REPLACE INTO search_cache VALUES (?, ?, ?, ?)',
+                                (key, json.dumps(videos), now, now))
+                self.db.execute(
+                    'DELETE FROM search_cache WHERE key IN ('
+                    'SELECT key FROM search_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)',
+                    (self.max_entries,)
+                )
+
+    def _flush_touched(self):
+        """Write the last_used times of memory hits to disk in one transaction."""
+        if self._touched:
+            with self.db:
+                self.db.executemany('UPDATE search_cache SET last_used = ? WHERE key = ?',
+                                    [(used, key) for key, used in self._touched.items()])
+            self._touched.clear()
+        self._flushed_at = time.time()
+
+    def _remember(self, key, stored_at, videos):
+        """Put an entry in the in-memory layer, dropping the oldest one if it is full."""
+        self._memory[key] = (stored_at, videos)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+search_cache = SearchCache(ttl=settings['search_cache_ttl'], max_entries=settings['search_cache_size'])
+
+def display_banner():
+    """Display an ASCII art banner."""
+    banner = """
+██╗   ██╗ █████╗ ██╗   ██╗████████╗██╗   ██╗██████╗ ███████╗
+╚██╗ ██╔╝██╔══██╗╚██╗ ██╔╝╚══██╔══╝██║   ██║██╔══██╗██╔════╝
+ ╚████╔╝ ███████║ ╚████╔╝    ██║   ██║   ██║██████╔╝█████╗  
+  ╚██╔╝  ██╔══██║  ╚██╔╝     ██║   ██║   ██║██╔══██╗██╔══╝  
+   ██║   ██║  ██║   ██║      ██║   ╚██████╔╝██████╔╝███████╗
+   ╚═╝   ╚═╝  ╚═╝   ╚═╝      ╚═╝    ╚═════╝ ╚═════╝ ╚══════╝                                                       
+    """
+    console.print(Text.from_markup(banner, style="bold beige"))
+
+def fetch_search_page(query, max_results=5, page=1):
+    """Fetch one page of search results straight from YouTube."""
+    search = VideosSearch(query, limit=max_results)
+    for _ in range(page - 1):
+        search.next()
+    results = search.result()['result']
+    return [(video['title'], video['link'], video['publishedTime'], video['duration']) for video in results]
+
+class SearchUnavailable(Exception):
+    """Raised when the search backend keeps failing or the circuit breaker is open."""
+
+class LatencyHistogram:
+    """Request latencies in fixed buckets, plus a window of recent samples for percentiles."""
+
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, float('inf'))  # Upper bounds in seconds
+
+    def __init__(self, window=200):
+        self.counts = [0] * len(self.BUCKETS)
+        self.errors = 0
+        self._recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.BUCKETS, seconds)] += 1
+            self._recent.append(seconds)
+
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def percentile(self, pct):
+        """Latency percentile over the recent window, or None before any request finished."""
+        with self._lock:
+            samples = sorted(self._recent)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+    def total(self):
+        return sum(self.counts)
+
+class ResilientSearchClient:
+    """Wraps the search backend with hedged requests, jittered retries and a circuit breaker."""
+
+    def __init__(self, backend=fetch_search_page, hedge_after=None, attempts=3, timeout=15,
+                 breaker_threshold=5, breaker_reset=30, backoff=0.25):
+        self.backend = backend
+        self.hedge_after = hedge_after
+        self.attempts = max(1, attempts)
+        self.timeout = timeout
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset = breaker_reset
+        self.backoff = backoff
+        self.histogram = LatencyHistogram()
+        self.hedges = 0
+        self.retries = 0
+        self.state = 'closed'  # closed -> open after repeated failures -> half-open trial -> closed
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def search(self, query, max_results=5, page=1):
+        """Fetch one page of search results through the backend."""
+        return self.call(self.backend, query, max_results, page)
+
+    def call(self, fn, *args, hedge=True):
+        """Run fn(*args) with retries and the breaker. Stateful calls (like VideosSearch.next) pass hedge=False."""
+        self._before_request()
+        error = None
+        for attempt in range(self.attempts):
+            if attempt:
+                self.retries += 1
+                # Exponential backoff with full jitter so many clients do not retry in lockstep
+                time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+            try:
+                result = self._hedged(fn, args) if hedge else self._timed(fn, args)
+            except Exception as e:
+                error = e
+                if self._after_failure():
+                    break
+                continue
+            self._after_success()
+            return result
+        raise SearchUnavailable(f"Search failed: {error}") from error
+
+    def hedge_delay(self):
+        """How long to wait for the first request before sending a duplicate."""
+        if self.hedge_after is not None:
+            return self.hedge_after
+        p95 = self.histogram.percentile(95) if self.histogram.total() >= 20 else None
+        return max(0.05, p95) if p95 is not None else 1.0
+
+    def stats(self):
+        """Latency percentiles and resilience counters."""
+        return {
+            'requests': self.histogram.total(),
+            'errors': self.histogram.errors,
+            'p50': self.histogram.percentile(50),
+            'p95': self.histogram.percentile(95),
+            'hedges': self.hedges,
+            'retries': self.retries,
+            'state': self.state,
+        }
+
+    def _timed(self, fn, args):
+        start_time = time.perf_counter()
+        try:
+            result = fn(*args)
+        except Exception:
+            self.histogram.record_error()
+            raise
+        self.histogram.record(time.perf_counter() - start_time)
+        return result
+
+    def _hedged(self, fn, args):
+        """Send the request, and a duplicate if it is slower than the hedge delay; the first answer wins."""
+        cond = threading.Condition()
+        outcome = {'launched': 0, 'errors': [], 'done': False, 'value': None}
+
+        def attempt():
+            try:
+                value = self._timed(fn, args)
+            except Exception as e:
+                with cond:
+                    outcome['errors'].append(e)
+                    cond.notify_all()
+                return
+            with cond:
+                if not outcome['done']:
+                    outcome['done'], outcome['value'] = True, value
+                cond.notify_all()
+
+        def launch():
+            outcome['launched'] += 1
+            threading.Thread(target=attempt, name="search-request", daemon=True).start()
+
+        settled = lambda: outcome['done'] or len(outcome['errors']) >= outcome['launched']
+        deadline = time.time() + self.timeout
+        with cond:
+            launch()
+            if not cond.wait_for(settled, timeout=min(self.hedge_delay(), self.timeout)):
+                self.hedges += 1
+                launch()
+            cond.wait_for(settled, timeout=max(0, deadline - time.time()))
+            if outcome['done']:
+                return outcome['value']
+            if outcome['errors']:
+                raise outcome['errors'][-1]
+            raise TimeoutError(f"no answer within {self.timeout} seconds")
+
+    def _before_request(self):
+        with self._lock:
+            if self.state == 'open':
+                if time.time() - self._opened_at < self.breaker_reset:
+                    raise SearchUnavailable("Search is temporarily unavailable (circuit breaker open)")
+                self.state = 'half-open'
+
+    def _after_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self._failures = 0
+
+    def _after_failure(self):
+        """Count a failure. Returns True once the breaker has opened and retrying is pointless."""
+        with self._lock:
+            self._failures += 1
+            if self.state == 'half-open' or self._failures >= self.breaker_threshold:
+                self.state = 'open'
+                self._opened_at = time.time()
+            return self.state == 'open'
+
+class StubSearchBackend:
+    """Local stand-in for the search backend that injects latency and errors."""
+
+    def __init__(self, delay=0.05, slow_delay=1.0, slow_rate=0.05, error_rate=0.05):
+        self.delay = delay
+        self.slow_delay = slow_delay
+        self.slow_rate = slow_rate
+        self.error_rate = error_rate
+
+    def __call__(self, query, max_results=5, page=1):
+        if random.random() < self.error_rate:
+            raise ConnectionError("injected backend error")
+        time.sleep(self.slow_delay if random.random() < self.slow_rate else self.delay)
+        return [(f"{query} result {idx}", f"https://www.youtube.com/watch?v=stub{idx:07d}", "1 day ago", "3:00")
+                for idx in range(max_results)]
+
+search_client = ResilientSearchClient(
+    hedge_after=settings['search_hedge_after'],
+    attempts=settings['search_retries'],
+    timeout=settings['search_timeout'],
+    breaker_threshold=settings['search_breaker_threshold'],
+    breaker_reset=settings['search_breaker_reset'],
+)
+
+def search_youtube(query, max_results=5, use_cache=True, page=1):
+    """Search for videos on YouTube."""
+    # Later pages get their own cache entries next to the first one
+    cache_limit = max_results if page == 1 else f"{max_results}p{page}"
+    if use_cache:
+        videos = search_cache.get(query, cache_limit)
+        if videos is not None:
+            return videos
+    videos = search_client.search(query, max_results, page)
+    if use_cache and videos:
+        search_cache.put(query, cache_limit, videos)
+    return videos
+
+YOUTUBE_ID_PATTERN = re.compile(
+    r'(?:youtube(?:-nocookie)?\.com/(?:watch\?(?:.*&)?v=|embed/|shorts/|live/|v/|e/)|youtu\.be/)'
+    r'([A-Za-z0-9_-]{11})'
+)
+
+def extract_video_id(url, allow_bare=False):
+    """Pull the 11 character video ID out of any YouTube URL form.
+
+    A bare ID is only accepted with allow_bare, since plenty of search queries
+    ("TaylorSwift", "Linkin-Park") have the same shape."""
+    url = url.strip()
+    if allow_bare and re.fullmatch(r'[A-Za-z0-9_-]{11}', url):
+        return url
+    match = YOUTUBE_ID_PATTERN.search(url)
+    return match.group(1) if match else None
+
+def stream_search(query, page_size=10):
+    """Yield search results one at a time, fetching the next page only when the caller asks for more."""
+    search = None
+    search_page = 0  # Page the VideosSearch object currently holds
+    for page in itertools.count(1):
+        cache_limit = page_size if page == 1 else f"{page_size}p{page}"
+        videos = search_cache.get(query, cache_limit)
+        if videos is None:
+            if search is None:
+                search = search_client.call(VideosSearch, query, page_size)
+                search_page = 1
+            while search_page < page:
+                # Paging mutates the search object, so it is retried but never hedged
+                search_client.call(search.next, hedge=False)
+                search_page += 1
+            results = search.result()['result']
+            videos = [(video['title'], video['link'], video['publishedTime'], video['duration']) for video in results]
+            if videos:
+                search_cache.put(query, cache_limit, videos)
+        if not videos:
+            return
+        yield from videos
+
+def artist_search(artist, max_results=15, per_query=10):
+    """Search several artist queries at once and merge them into one ranked, de-duplicated list.
+
+    Returns the videos and the number of queries that answered."""
+    searches = [
+        (artist, 2),  # The plain artist search also brings its follow-up page
+        (f"{artist} official audio", 1),
+        (f"{artist} live", 1),
+    ]
+
+    def first_pages(query, pages):
+        # Later pages come from the same search object, right after page 1, so page 1 is fetched once
+        results = []
+        try:
+            for video in stream_search(query, per_query):
+                results.append(video)
+                if len(results) >= pages * per_query:
+                    break
+        except Exception:
+            if not results:
+                raise
+        return results
+
+    with ThreadPoolExecutor(len(searches), thread_name_prefix='artist-search') as pool:
+        futures = [pool.submit(first_pages, query, pages) for query, pages in searches]
+    scores = {}
+    videos = {}
+    answered = 0
+    artist_words = set(artist.lower().split())
+    for future in futures:
+        try:
+            results = future.result()
+        except Exception:
+            continue  # One failed query should not sink the whole search
+        answered += 1
+        for position, video in enumerate(results):
+            key = extract_video_id(video[1]) or video[1]
+            videos.setdefault(key, video)
+            # Results near the top, on the first page, and found by several queries rank higher
+            scores[key] = scores.get(key, 0) + 1 / (position + 1)
+    for key, video in videos.items():
+        if artist_words and artist_words <= set(video[0].lower().split()):
+            scores[key] += 0.5
+    ranked = sorted(videos, key=lambda key: scores[key], reverse=True)
+    return [videos[key] for key in ranked[:max_results]], answered
+
+class DownloaderPool:
+    """Long-lived YoutubeDL sessions, one set per option profile, lent out to one job at a time.
+
+    Reusing a session keeps yt-dlp's extractor setup, HTTP connections and cookies between jobs.
+    Per-job options are applied on checkout and undone on return; a session that saw an error is
+    closed instead of being reused."""
+
+    def __init__(self, max_idle=4):
+        self.max_idle = max_idle  # Idle sessions kept per profile
+        self.created = 0
+        self.reused = 0
+        self.setup_seconds = 0.0
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def session(self, profile, **job_options):
+        """Check out a session for `profile` with `job_options` (format, outtmpl, progress_hooks, ...) applied."""
+        key = json.dumps(profile, sort_keys=True)
+        start_time = time.perf_counter()
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            ydl = idle.pop() if idle else None
+        if ydl is None:
+            ydl = yt_dlp.YoutubeDL(dict(profile))
+            self.created += 1
+        else:
+            self.reused += 1
+        saved = self._apply(ydl, job_options)
+        self.setup_seconds += time.perf_counter() - start_time
+        try:
+            yield ydl
+        except BaseException:
+            ydl.close()
+            raise
+        self._reset(ydl, saved)
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(ydl)
+                return
+        ydl.close()
+
+    def stats(self):
+        with self._lock:
+            idle = sum(len(sessions) for sessions in self._idle.values())
+        jobs = self.created + self.reused
+        return {'created': self.created, 'reused': self.reused, 'idle': idle,
+                'setup_ms_per_job': self.setup_seconds * 1000 / jobs if jobs else 0.0}
+
+    def close(self):
+        with self._lock:
+            sessions = [ydl for idle in self._idle.values() for ydl in idle]
+            self._idle.clear()
+        for ydl in sessions:
+            ydl.close()
+
+    @staticmethod
+    def _apply(ydl, job_options):
+        """Set per-job options, returning what is needed to undo them."""
+        saved = {'params': {}, 'hooks': len(ydl._progress_hooks), 'format_selector': ydl.format_selector,
+                 'outtmpl': ydl.params['outtmpl'].get('default')}
+        for name, value in job_options.items():
+            if name == 'progress_hooks':
+                for hook in value:
+                    ydl.add_progress_hook(hook)
+            elif name == 'outtmpl':
+                ydl.params['outtmpl']['default'] = value
+            else:
+                saved['params'].setdefault(name, ydl.params.get(name))
+                ydl.params[name] = value
+                if name == 'format':
+                    # The selector is compiled once in YoutubeDL.__init__
+                    ydl.format_selector = ydl.build_format_selector(value)
+        return saved
+
+    @staticmethod
+    def _reset(ydl, saved):
+        for name, value in saved['params'].items():
+            ydl.params[name] = value
+        del ydl._progress_hooks[saved['hooks']:]
+        ydl.format_selector = saved['format_selector']
+        ydl.params['outtmpl']['default'] = saved['outtmpl']
+        ydl._num_downloads = 0
+        ydl._download_retcode = 0
+
+downloader_pool = DownloaderPool()
+
+# Option profiles for the pooled sessions; anything that changes per job is passed at checkout
+METADATA_PROFILE = {'quiet': True, 'no_warnings': True, 'noplaylist': True}
+LISTING_PROFILE = {'extract_flat': 'in_playlist', 'lazy_playlist': True, 'quiet': True, 'no_warnings': True}
+SELECT_PROFILE = {'quiet': True, 'no_warnings': True}
+
+class MetadataCache(SqliteStore):
+    """Extracted video metadata cached by video ID."""
+
+    schema = (
+        'CREATE TABLE IF NOT EXISTS video_metadata ('
+        'video_id TEXT PRIMARY KEY, info TEXT NOT NULL, fetched_at REAL NOT NULL)',
+    )
+
+    def __init__(self, path=CACHE_DB, ttl=7 * 24 * 60 * 60):
+        super().__init__(path)
+        self.ttl = ttl
+        self._memory = {}
+
+    def get(self, video_id):
+        """Return cached metadata for a video, or None if it is missing or stale."""
+        with self._lock:
+            info = self._memory.get(video_id)
+            if info is None:
+                row = self.db.execute('SELECT info FROM video_metadata WHERE video_id = ?', (video_id,)).fetchone()
+                if row is None:
+                    return None
+                info = json.loads(row[0])
+                self._memory[video_id] = info
+            if time.time() - info.get('epoch', 0) >= self.ttl:
+                return None
+            return info
+
+    def put(self, info):
+        """Store metadata returned by extract_info."""
+        with self._lock:
+            self._memory[info['id']] = info
+            with self.db:
+                self.db.execute('INSERT OR REPLACE INTO video_metadata VALUES (?, ?, ?)',
+                                (info['id'], json.dumps(info), info.get('epoch', time.time())))
+
+metadata_cache = MetadataCache(ttl=settings['metadata_cache_ttl'])
+
+def resolve_video(url, max_age=None):
+    """Get title, duration and formats for a video URL with a single extract_info call.
+
+    Cached metadata is reused unless it is older than max_age seconds."""
+    video_id = extract_video_id(url)
+    if video_id is None:
+        return None
+    info = metadata_cache.get(video_id)
+    if info is None or (max_age is not None and time.time() - info.get('epoch', 0) >= max_age):
+        with downloader_pool.session(METADATA_PROFILE) as ydl:
+            info = ydl.sanitize_info(ydl.extract_info(f"https://www.youtube.com/watch?v={video_id}", download=False))
+        metadata_cache.put(info)
+    return info
+
+COLLECTION_PATTERN = re.compile(
+    r'youtube\.com/(?:playlist\?(?:.*&)?list=|@[^/?#]+|channel/|c/|user/)'
+)
+
+def is_channel_url(url):
+    """True for channel URLs, whose listings are newest-first."""
+    return is_collection_url(url) and 'playlist?' not in url
+
+def is_collection_url(url):
+    """True for playlist and channel URLs (a watch URL that also carries a list= is treated as one video)."""
+    return bool(COLLECTION_PATTERN.search(url)) and not re.search(r'[?&]v=', url)
+
+def iter_collection_entries(url):
+    """Lazily yield the videos of a playlist or channel, one listing page at a time."""
+    with downloader_pool.session(LISTING_PROFILE) as ydl:
+        # process=False keeps `entries` as the extractor's page-by-page generator
+        result = ydl.extract_info(url, download=False, process=False)
+        while result.get('_type') in ('url', 'url_transparent'):
+            result = ydl.extract_info(result['url'], download=False, process=False)
+        for entry in result.get('entries') or ():
+            if entry is None:
+                continue
+            if entry.get('ie_key') == 'YoutubeTab' or entry.get('_type') == 'playlist':
+                # A channel without a tab expands into its Videos / Shorts / Live tabs
+                yield from iter_collection_entries(entry.get('url') or entry['webpage_url'])
+                continue
+            video_id = entry.get('id') or extract_video_id(entry.get('url', ''), allow_bare=True)
+            if video_id is None:
+                continue
+            yield {
+                'id': video_id,
+                'title': entry.get('title') or video_id,
+                'url': f"https://www.youtube.com/watch?v={video_id}",
+                'duration': entry.get('duration'),
+            }
+
+class DownloadArchive(SqliteStore):
+    """Persistent record of finished downloads, so syncs can skip them without any network call."""
+
+    schema = (
+        'CREATE TABLE IF NOT EXISTS download_archive ('
+        'video_id TEXT NOT NULL, format TEXT NOT NULL, quality TEXT NOT NULL, path TEXT, '
+        'completed_at REAL NOT NULL, PRIMARY KEY (video_id, format, quality))',
+    )
+
+    def contains(self, video_id, output_format, quality=None):
+        """True if this video was already downloaded in this format and quality."""
+        with self._lock:
+            row = self.db.execute(
+                'SELECT 1 FROM download_archive WHERE video_id = ? AND format = ? AND quality = ?',
+                (video_id, output_format, quality or '')
+            ).fetchone()
+        return row is not None
+
+    def add(self, video_id, output_format, quality=None, path=None):
+        """Record a finished download."""
+        with self._lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO download_archive VALUES (?, ?, ?, ?, ?)',
+                            (video_id, output_format, quality or '', path, time.time()))
+
+archive = DownloadArchive()
+
+def job_targets(job):
+    """The (format, quality) pairs a download job produces."""
+    return [[os.path.splitext(path)[1].lstrip('.').lower(), quality]
+            for path, quality in [(job.output_path, job.quality), *job.extra_targets]]
+
+class JobJournal(SqliteStore):
+    """Crash-safe record of queued downloads: the stage each one reached, how many bytes it had
+    fetched and which of its outputs are finished.
+
+    Jobs move through queued -> fetching -> post-processing -> done (or failed / cancelled) and
+    are keyed by their output path. After a crash, unfinished jobs are queued again; the fetch
+    continues from the partial file and finished outputs are not encoded twice.
+
+    Each row names the process that owns it, and owners keep a heartbeat, so a process only
+    takes over jobs whose owner has exited or stopped beating."""
+
+    UNFINISHED = ('queued', 'fetching', 'post-processing')
+
+    schema = (
+        'CREATE TABLE IF NOT EXISTS job_journal ('
+        'output_path TEXT PRIMARY KEY, query TEXT, url TEXT NOT NULL, title TEXT, format TEXT, '
+        'quality TEXT, extra_targets TEXT NOT NULL, targets TEXT NOT NULL, priority INTEGER NOT NULL, '
+        'state TEXT NOT NULL, bytes INTEGER NOT NULL, outputs TEXT NOT NULL, error TEXT, '
+        'updated_at REAL NOT NULL, owner TEXT)',
+        'CREATE INDEX IF NOT EXISTS job_journal_query ON job_journal (query)',
+        'CREATE INDEX IF NOT EXISTS job_journal_state ON job_journal (state)',
+        'CREATE TABLE IF NOT EXISTS journal_owners (owner TEXT PRIMARY KEY, pid INTEGER NOT NULL, heartbeat REAL NOT NULL)',
+    )
+
+    def __init__(self, path=CACHE_DB, flush_interval=1.0, heartbeat_interval=10.0):
+        super().__init__(path)
+        self.flush_interval = flush_interval  # Seconds between byte-offset writes for one job
+        self.heartbeat_interval = heartbeat_interval  # An owner silent for three of these is taken as dead
+        self.owner = f"{os.getpid()}-{time.time():.6f}"
+        self._flushed = {}
+        self._heartbeat = None
+
+    def _setup(self):
+        columns = [row[1] for row in self._conn.execute('PRAGMA table_info(job_journal)')]
+        if 'owner' not in columns:
+            # Journals written before jobs had owners; their rows count as orphaned
+            self._conn.execute('ALTER TABLE job_journal ADD COLUMN owner TEXT')
+
+    def queued(self, job):
+        """Record a newly queued job. Returns (bytes, outputs) left by an unfinished earlier run of it."""
+        key = os.path.abspath(job.output_path)
+        with self._lock, self.db:
+            row = self.db.execute('SELECT url, state, bytes, outputs FROM job_journal WHERE output_path = ?',
+                                  (key,)).fetchone()
+            resumed = (row[2], json.loads(row[3])) if row and row[0] == job.url and row[1] != 'done' else (0, [])
+            self.db.execute(
+                'INSERT OR REPLACE INTO job_journal VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, NULL, ?, ?)',
+                (key, job.query, job.url, job.title, job.format, job.quality, json.dumps(job.extra_targets),
+                 json.dumps(job_targets(job)), job.priority, 'queued', resumed[0], json.dumps(resumed[1]), time.time(),
+                 self.owner)
+            )
+        self._start_heartbeat()
+        return resumed
+
+    def stage(self, job, state):
+        """Record that a job moved on to `state`."""
+        self._update(job, 'state = ?, bytes = ?', (state, job.bytes_downloaded))
+
+    def output_done(self, job, path):
+        """Record one finished output of a job."""
+        self._update(job, 'outputs = json_insert(outputs, \'$[#]\', ?)', (path,))
+
+    def progress(self, job, status):
+        """Progress listener: save the job's byte offset, at most once per flush_interval."""
+        now = time.monotonic()
+        if now - self._flushed.get(job.id, 0) >= self.flush_interval:
+            self._flushed[job.id] = now
+            self._update(job, 'bytes = ?', (job.bytes_downloaded,))
+
+    def finish(self, job):
+        """Record how a job ended."""
+        self._flushed.pop(job.id, None)
+        self._update(job, 'state = ?, error = ?', (job.state, job.error))
+
+    def claim_unfinished(self):
+        """Take over the unfinished jobs of processes that are gone, most urgent first.
+
+        Jobs owned by a process that is still running (a batch, the daemon) are left alone."""
+        self._start_heartbeat()
+        with self._lock:
+            # IMMEDIATE takes the write lock up front, so two processes starting together cannot claim the same jobs
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                owners = self.db.execute('SELECT owner, pid, heartbeat FROM journal_owners').fetchall()
+                live = {owner for owner, pid, heartbeat in owners if self._alive(pid, heartbeat)}
+                self.db.executemany('DELETE FROM journal_owners WHERE owner = ?',
+                                    [(owner,) for owner, _, _ in owners if owner not in live])
+                rows = [row for row in self.db.execute(
+                    f'SELECT * FROM job_journal WHERE state IN ({",".join("?" * len(self.UNFINISHED))}) '
+                    'ORDER BY priority, updated_at', self.UNFINISHED
+                ) if row[-1] not in live]
+                self.db.executemany('UPDATE job_journal SET owner = ? WHERE output_path = ?',
+                                    [(self.owner, row[0]) for row in rows])
+                self.db.commit()
+            except BaseException:
+                self.db.rollback()
+                raise
+        return [{**self._entry(row), 'owner': self.owner} for row in rows]
+
+    def release(self):
+        """Give up this process's jobs at exit, so the next start resumes them without waiting for the heartbeat to expire."""
+        if self._heartbeat is None:
+            return
+        with self._lock, self.db:
+            self.db.execute('DELETE FROM journal_owners WHERE owner = ?', (self.owner,))
+
+    def _alive(self, pid, heartbeat):
+        """True if an owner's heartbeat is recent and, where that can be checked safely, its process exists."""
+        if time.time() - heartbeat > 3 * self.heartbeat_interval:
+            return False
+        if os.name == 'nt':
+            return True  # os.kill would terminate the process rather than probe it
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def _start_heartbeat(self):
+        with self._lock:
+            if self._heartbeat is not None:
+                return
+            self._beat()
+            self._heartbeat = threading.Thread(target=self._beat_forever, name="journal-heartbeat", daemon=True)
+            self._heartbeat.start()
+        atexit.register(self.release)
+
+    def _beat(self):
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO journal_owners VALUES (?, ?, ?)',
+                            (self.owner, os.getpid(), time.time()))
+
+    def _beat_forever(self):
+        while True:
+            time.sleep(self.heartbeat_interval)
+            with self._lock:
+                self._beat()
+
+    def lookup(self, query, targets, directory=None):
+        """The latest job recorded for a batch line with the same outputs and directory, or None."""
+        directory = os.path.abspath(directory or os.getcwd())
+        targets = [[target_format, target_quality] for target_format, target_quality in targets]
+        with self._lock:
+            rows = self.db.execute('SELECT * FROM job_journal WHERE query = ? ORDER BY updated_at DESC',
+                                   (query,)).fetchall()
+        for entry in map(self._entry, rows):
+            if entry['targets'] == targets and os.path.dirname(entry['output_path']) == directory:
+                return entry
+        return None
+
+    def job(self, entry):
+        """Rebuild a download job from a journal entry."""
+        job = DownloadJob(entry['url'], entry['output_path'], format=entry['format'], quality=entry['quality'],
+                          title=entry['title'], priority=entry['priority'],
+                          extra_targets=[tuple(target) for target in entry['extra_targets']])
+        job.query = entry['query']
+        return job
+
+    def _update(self, job, assignments, params):
+        with self._lock, self.db:
+            self.db.execute(f'UPDATE job_journal SET {assignments}, updated_at = ? WHERE output_path = ?',
+                            (*params, time.time(), os.path.abspath(job.output_path)))
+
+    @staticmethod
+    def _entry(row):
+        keys = ('output_path', 'query', 'url', 'title', 'format', 'quality', 'extra_targets', 'targets',
+                'priority', 'state', 'bytes', 'outputs', 'error', 'updated_at', 'owner')
+        entry = dict(zip(keys, row))
+        for key in ('extra_targets', 'targets', 'outputs'):
+            entry[key] = json.loads(entry[key])
+        return entry
+
+journal = JobJournal()
+
+class ScanCache(SqliteStore):
+    """Integrity results and audio fingerprints per file, valid while the file's size and mtime are unchanged."""
+
+    schema = (
+        'CREATE TABLE IF NOT EXISTS media_scan ('
+        'path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime REAL NOT NULL, status TEXT NOT NULL, '
+        'problem TEXT, seconds REAL, profile BLOB, bits BLOB)',
+    )
+
+    def stale(self, tracks):
+        """The tracks whose cached scan is missing or out of date."""
+        with self._lock:
+            known = {path: (size, mtime) for path, size, mtime in self.db.execute('SELECT path, size, mtime FROM media_scan')}
+        return [track for track in tracks if known.get(track['path']) != (track['size'], track['mtime'])]
+
+    def put(self, track, result):
+        with self._lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO media_scan VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                            (track['path'], track['size'], track['mtime'], result['status'], result['problem'],
+                             result['seconds'], result['profile'], result['bits']))
+
+    def results(self, paths):
+        """Status, problem and profile for each of these paths, read in one pass."""
+        with self._lock:
+            rows = self.db.execute('SELECT path, status, problem, profile FROM media_scan').fetchall()
+        return {path: (status, problem, profile) for path, status, problem, profile in rows if path in paths}
+
+    def bits(self, path):
+        with self._lock:
+            return self.db.execute('SELECT bits FROM media_scan WHERE path = ?', (path,)).fetchone()[0]
+
+scan_cache = ScanCache()
+
+class SourceCache(SqliteStore):
+    """Content-addressed cache of raw source streams, looked up by video ID and format ID, with LRU eviction."""
+
+    schema = (
+        'CREATE TABLE IF NOT EXISTS source_cache ('
+        'video_id TEXT NOT NULL, format_id TEXT NOT NULL, blob TEXT NOT NULL, size INTEGER NOT NULL, '
+        'last_used REAL NOT NULL, PRIMARY KEY (video_id, format_id))',
+        'CREATE INDEX IF NOT EXISTS source_cache_last_used ON source_cache (last_used)',
+    )
+
+    def __init__(self, directory, max_bytes, path=CACHE_DB):
+        super().__init__(path)
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._key_locks = {}  # (video_id, format_id) -> [lock, number of fetches holding or waiting for it]
+        self._pins = Counter()  # Blob -> number of running jobs that still have to encode from it
+
+    @contextlib.contextmanager
+    def key_lock(self, video_id, format_id):
+        """Lock held while a stream is fetched, so concurrent jobs for the same stream fetch it once.
+
+        The lock is forgotten once no fetch needs it any more."""
+        key = (video_id, format_id)
+        with self._lock:
+            entry = self._key_locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._key_locks[key]
+
+    def partial_path(self, video_id, format_id, ext):
+        """Where a stream is downloaded to before it is added to the cache."""
+        return os.path.join(self.directory, 'partial', f"{video_id}.{format_id}.{ext}")
+
+    def peek(self, video_id, format_id):
+        """The cached file for a stream, without counting a hit or refreshing its LRU position."""
+        with self._lock:
+            row = self.db.execute('SELECT blob FROM source_cache WHERE video_id = ? AND format_id = ?',
+                                  (video_id, format_id)).fetchone()
+        return row[0] if row else None
+
+    def get(self, video_id, format_id, pin=False):
+        """Return the cached file for a stream, or None on a miss.
+
+        With pin, the file is not evicted until it is passed to unpin()."""
+        with self._lock:
+            row = self.db.execute('SELECT blob FROM source_cache WHERE video_id = ? AND format_id = ?',
+                                  (video_id, format_id)).fetchone()
+            if row and os.path.exists(row[0]):
+                with self.db:
+                    self.db.execute('UPDATE source_cache SET last_used = ? WHERE video_id = ? AND format_id = ?',
+                                    (time.time(), video_id, format_id))
+                if pin:
+                    self._pins[row[0]] += 1
+                self.hits += 1
+                return row[0]
+            if row:
+                # The file was removed behind our back
+                with self.db:
+                    self.db.execute('DELETE FROM source_cache WHERE video_id = ? AND format_id = ?',
+                                    (video_id, format_id))
+            self.misses += 1
+            return None
+
+    def put(self, video_id, format_id, file_path, pin=False):
+        """Move a freshly downloaded stream into the cache and return its cached path.
+
+        With pin, the file is not evicted until it is passed to unpin()."""
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b''):
+                digest.update(chunk)
+        digest = digest.hexdigest()
+        blob = os.path.join(self.directory, digest[:2], digest + os.path.splitext(file_path)[1])
+        with self._lock:
+            if os.path.exists(blob):
+                os.remove(file_path)  # Identical content is already cached under another key
+            else:
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                os.replace(file_path, blob)
+            if pin:
+                self._pins[blob] += 1
+            with self.db:
+                self.db.execute('INSERT OR REPLACE INTO source_cache VALUES (?, ?, ?, ?, ?)',
+                                (video_id, format_id, blob, os.path.getsize(blob), time.time()))
+                self._evict(keep=blob)
+        return blob
+
+    def unpin(self, blob):
+        """Let a pinned file be evicted again once the cache is over its size cap."""
+        with self._lock:
+            self._pins[blob] -= 1
+            if self._pins[blob] <= 0:
+                del self._pins[blob]
+
+    def stats(self):
+        """Entry count, total size and hit/miss counters."""
+        with self._lock:
+            entries, size = self.db.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM (SELECT DISTINCT blob, size FROM source_cache)'
+            ).fetchone()
+        return {'entries': entries, 'bytes': size, 'max_bytes': self.max_bytes, 'hits': self.hits, 'misses': self.misses}
+
+    def _evict(self, keep=None):
+        """Drop least recently used streams until the cache fits in max_bytes, skipping pinned ones."""
+        total = self.db.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT blob, size FROM source_cache)'
+        ).fetchone()[0]
+        rows = self.db.execute('SELECT video_id, format_id, blob, size FROM source_cache ORDER BY last_used').fetchall()
+        for video_id, format_id, blob, size in rows:
+            if total <= self.max_bytes:
+                break
+            if blob == keep or blob in self._pins:
+                continue
+            self.db.execute('DELETE FROM source_cache WHERE video_id = ? AND format_id = ?', (video_id, format_id))
+            if self.db.execute('SELECT 1 FROM source_cache WHERE blob = ?', (blob,)).fetchone() is None:
+                if os.path.exists(blob):
+                    os.remove(blob)
+                total -= size
+
+source_cache = SourceCache(settings['source_cache_dir'], settings['source_cache_size_mb'] * 1024 * 1024)
+
+def select_source_formats(info, format_spec):
+    """Let yt-dlp's format selector pick the streams for a format spec, without downloading anything."""
+    with downloader_pool.session(SELECT_PROFILE, format=format_spec) as ydl:
+        selected = ydl.process_ie_result(copy.deepcopy(info), download=False)
+    return selected.get('requested_formats') or [selected]
+
+class HostLimiter:
+    """Caps how many streams are fetched from one host at the same time."""
+
+    def __init__(self, limit):
+        self.limit = max(1, int(limit))
+        self._slots = {}
+        self._lock = threading.Lock()
+        self._held = threading.local()  # The slot the calling thread holds, if any
+
+    @contextlib.contextmanager
+    def slot(self, host):
+        """Hold one of the host's download slots, waiting for a free one first."""
+        with self._lock:
+            semaphore = self._slots.setdefault(host, threading.Semaphore(self.limit))
+        with semaphore:
+            self._held.semaphore = semaphore
+            try:
+                yield
+            finally:
+                self._held.semaphore = None
+
+    @contextlib.contextmanager
+    def released(self):
+        """Give up the calling thread's slot while a paused download waits, and take it back after."""
+        semaphore = getattr(self._held, 'semaphore', None)
+        if semaphore is None:
+            yield
+            return
+        semaphore.release()
+        try:
+            yield
+        finally:
+            semaphore.acquire()
+
+def stream_host(url):
+    """The registrable domain of a stream URL, so every CDN node of a site (rr1---sn-….googlevideo.com,
+    rr5---sn-….googlevideo.com) shares the same download slots."""
+    host = urlparse(url).hostname or ''
+    return '.'.join(host.split('.')[-2:])
+
+host_limiter = HostLimiter(settings['per_host_downloads'])
+
+def fetch_source(url, info, fmt, progress_hook=None, quiet=False, rate_limit=None):
+    """Return a local file for one source stream, downloading it only if it is not cached yet.
+
+    The file is pinned in the cache; pass it to source_cache.unpin() once it has been encoded.
+    rate_limit caps the transfer speed in bytes per second."""
+    video_id, format_id = info['id'], fmt['format_id']
+    with source_cache.key_lock(video_id, format_id):
+        cached = source_cache.get(video_id, format_id, pin=True)
+        if cached:
+            return cached
+        if time.time() - info.get('epoch', 0) >= STREAM_URL_TTL:
+            # The stream URLs in old metadata have expired
+            info = resolve_video(url, max_age=STREAM_URL_TTL)
+        partial = source_cache.partial_path(video_id, format_id, fmt['ext'])
+        os.makedirs(os.path.dirname(partial), exist_ok=True)
+        # yt-dlp keeps the unfinished bytes in partial + '.part' and continues it with a range
+        # request next time, so a fetch cut off by a crash or a dropped connection resumes there
+        profile = {'quiet': quiet, 'noprogress': quiet, 'continuedl': True}
+        hooks = [progress_hook] if progress_hook else []
+        with host_limiter.slot(stream_host(fmt.get('url') or url)):
+            with downloader_pool.session(profile, format=format_id, outtmpl=partial, ratelimit=rate_limit,
+                                         progress_hooks=hooks) as ydl:
+                ydl.process_ie_result(copy.deepcopy(info), download=True)
+        return source_cache.put(video_id, format_id, partial, pin=True)
+
+def run_ffmpeg(args, output_path, index=None):
+    """Run ffmpeg writing to a temporary file, then move the result into place.
+
+    The new file is recorded in `index` if one is given. Worker processes must leave it out: they
+    would write through a SQLite connection opened before the fork."""
+    temp_path = f"{output_path}.part"
+    command = [settings['ffmpeg_path'], '-y', '-v', 'error', *args, temp_path]
+    with index.writing(output_path) if index else contextlib.nullcontext():
+        result = subprocess.run(command, capture_output=True, text=True)
+        if result.returncode != 0:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise RuntimeError(f"ffmpeg failed: {result.stderr.strip()[-500:]}")
+        os.replace(temp_path, output_path)
+
+# For each output container: the source codecs it can take as-is by stream copy, the encoder
+# used when a real transcode is needed, and the ffmpeg muxer that writes it
+OUTPUT_FORMATS = {
+    'mp3': {'kind': 'audio', 'codecs': ('mp3',), 'encoder': ['-c:a', 'libmp3lame'], 'muxer': 'mp3'},
+    'm4a': {'kind': 'audio', 'codecs': ('mp4a', 'aac'), 'encoder': ['-c:a', 'aac'], 'muxer': 'ipod'},
+    'opus': {'kind': 'audio', 'codecs': ('opus',), 'encoder': ['-c:a', 'libopus'], 'muxer': 'opus'},
+    'mp4': {'kind': 'video', 'codecs': ('avc1', 'h264', 'vp09', 'vp9', 'av01', 'mp4a', 'aac', 'opus'),
+            'encoder': ['-c:v', 'libx264', '-c:a', 'aac'], 'muxer': 'mp4'},
+}
+
+def codec_matches(codec, accepted):
+    """True if a yt-dlp codec string such as 'mp4a.40.2' belongs to one of the accepted codec families."""
+    return bool(codec) and codec.split('.')[0].lower() in accepted
+
+def plan_target(info, output_format, quality=None):
+    """Pick source formats for one output and decide between stream copy and transcode.
+
+    Returns None when the metadata has no usable format list."""
+    spec = OUTPUT_FORMATS[output_format]
+    formats = info.get('formats') or []
+    audio = [f for f in formats if f.get('vcodec') == 'none' and f.get('acodec') not in (None, 'none')]
+    if not audio:
+        return None
+    # Prefer higher bitrates, then m4a like the old 'bestaudio[ext=m4a]/...' spec did
+    audio_rank = lambda f: (f.get('abr') or f.get('tbr') or 0, f.get('ext') == 'm4a')
+    if spec['kind'] == 'audio':
+        compatible = [f for f in audio if codec_matches(f['acodec'], spec['codecs'])]
+        source = max(compatible, key=audio_rank, default=None)
+        # Copying is fine when the best compatible source is not above the requested bitrate; copying a
+        # lower-bitrate stream next to it (139 at 48k beside 140 at 129k) would lose quality for nothing
+        if source and (not quality or (source.get('abr') or 0) <= float(quality)):
+            return {'action': 'copy', 'formats': [source],
+                    'reason': f"{source['acodec']} source at {source.get('abr') or '?'}k fits {output_format}"}
+        source = max(audio, key=audio_rank)
+        return {'action': 'transcode', 'formats': [source],
+                'reason': f"no {output_format}-compatible source at or below {quality or 'any'}k "
+                          f"(best is {source['acodec']} at {source.get('abr') or '?'}k)"}
+
+    video = [f for f in formats if f.get('vcodec') not in (None, 'none') and f.get('acodec') == 'none']
+    if not video:
+        return None
+    # At equal resolution, H.264 + AAC plays in more places than VP9/AV1 + Opus
+    video_rank = lambda f: (f.get('height') or 0, codec_matches(f['vcodec'], ('avc1', 'h264')),
+                            f.get('fps') or 0, f.get('tbr') or 0)
+    mp4_audio_rank = lambda f: (codec_matches(f['acodec'], ('mp4a', 'aac')), audio_rank(f))
+    copy_video = [f for f in video if codec_matches(f['vcodec'], spec['codecs'])]
+    copy_audio = [f for f in audio if codec_matches(f['acodec'], spec['codecs'])]
+    if copy_video and copy_audio:
+        sources = [max(copy_video, key=video_rank), max(copy_audio, key=mp4_audio_rank)]
+        return {'action': 'copy', 'formats': sources,
+                'reason': f"{sources[0]['vcodec']} + {sources[1]['acodec']} remux into {output_format}"}
+    return {'action': 'transcode', 'formats': [max(video, key=video_rank), max(audio, key=audio_rank)],
+            'reason': f"no {output_format}-compatible video and audio pair"}
+
+def transcode(sources, output_path, quality=None, action='transcode'):
+    """Turn cached source streams into the output file, by stream copy or by re-encoding."""
+    output_format = os.path.splitext(output_path)[1].lstrip('.').lower()
+    spec = OUTPUT_FORMATS[output_format]
+    args = [arg for source in sources for arg in ('-i', source)]
+    args += [arg for idx in range(len(sources)) for arg in ('-map', str(idx))]
+    if spec['kind'] == 'audio':
+        args.append('-vn')
+    if action == 'copy':
+        args += ['-c', 'copy']
+    else:
+        args += spec['encoder']
+        if spec['kind'] == 'audio':
+            args += ['-b:a', f"{quality or 192}k"]
+    run_ffmpeg([*args, '-f', spec['muxer']], output_path, index=library)
+
+# ffmpeg encodes are CPU bound, so all download workers together run at most one per core
+transcode_slots = threading.BoundedSemaphore(os.cpu_count() or 1)
+
+def timed_transcode(sources, output_path, quality=None, target=None):
+    """Produce one output and report which path it took and how long the encode took."""
+    action = target['action'] if target else 'transcode'
+    with transcode_slots:
+        start_time = time.time()
+        transcode(sources, output_path, quality, action)
+        return {'path': output_path, 'quality': quality, 'action': action,
+                'reason': target['reason'] if target else None,
+                'encode_seconds': round(time.time() - start_time, 3)}
+
+AUDIO_FORMAT_SPEC = 'bestaudio[ext=m4a]/bestaudio[ext=webm]/bestaudio/best'
+
+def download_video(url, output_path, format='bestaudio', quality=None, progress_hook=None, info=None, quiet=False,
+                   extra_targets=(), rate_limit=None, on_stage=None, finished_outputs=()):
+    """Download video or audio from YouTube.
+
+    extra_targets holds more (output_path, quality) pairs to encode from the same fetched source.
+    on_stage(stage, path=None) hears when fetching and post-processing start and when each output is
+    finished; outputs in finished_outputs (done before a restart) are kept as they are.
+    Returns, for every output, whether it was stream-copied or transcoded and how long that took."""
+    on_stage = on_stage or (lambda stage, path=None: None)
+    targets = [(output_path, quality), *extra_targets]
+    kept = [{'path': path, 'quality': target_quality, 'action': 'kept', 'reason': "finished before a restart",
+             'encode_seconds': 0.0}
+            for path, target_quality in targets if path in finished_outputs and os.path.exists(path)]
+    if len(kept) == len(targets):
+        return kept
+    # Any metadata will do for choosing streams; fetch_source refreshes it if a stream has to be downloaded
+    info = info or resolve_video(url)
+    if info is None:
+        raise ValueError(f"Not a YouTube video URL: {url}")
+    on_stage('fetching')
+    plan = []
+    sources = {}
+
+    def encode(target):
+        output = timed_transcode(*target)
+        on_stage('output', output['path'])
+        return output
+
+    try:
+        for idx, (path, target_quality) in enumerate(targets):
+            if any(output['path'] == path for output in kept):
+                continue
+            output_format = os.path.splitext(path)[1].lstrip('.').lower()
+            target = plan_target(info, output_format, target_quality)
+            if target is None:
+                # Nothing to plan from, so let yt-dlp pick the streams and always transcode
+                spec = format if idx == 0 else ('bestvideo+bestaudio' if output_format == 'mp4' else 'bestaudio')
+                spec = AUDIO_FORMAT_SPEC if spec == 'bestaudio' else spec
+                target = {'action': 'transcode', 'formats': select_source_formats(info, spec),
+                          'reason': "no format list to plan from"}
+            for fmt in target['formats']:
+                # Each distinct source is fetched once, however many targets are encoded from it
+                if fmt['format_id'] not in sources:
+                    sources[fmt['format_id']] = fetch_source(url, info, fmt, progress_hook, quiet, rate_limit)
+            plan.append(([sources[fmt['format_id']] for fmt in target['formats']], path, target_quality, target))
+        on_stage('post-processing')
+        if len(plan) == 1:
+            return kept + [encode(plan[0])]
+        with ThreadPoolExecutor(len(plan), thread_name_prefix='transcode') as encoders:
+            return kept + list(encoders.map(encode, plan))
+    finally:
+        # The sources may be evicted once every output is encoded from them
+        for blob in sources.values():
+            source_cache.unpin(blob)
+
+class DownloadCancelled(Exception):
+    """Raised from a progress hook to abort a cancelled download."""
+
+class BandwidthBudget:
+    """Token bucket shared by every download, refilled at `rate` bytes per second.
+
+    Downloads report their progress through consume(), which sleeps once the bucket is empty.
+    Also measures the throughput actually achieved."""
+
+    def __init__(self, rate=None, burst_seconds=1.0, window=5.0):
+        self.rate = rate
+        self.capacity = rate * burst_seconds if rate else 0
+        self.window = window
+        self._tokens = self.capacity
+        self._refilled = time.monotonic()
+        self._samples = deque()  # (time, bytes) for the last `window` seconds
+        self._lock = threading.Lock()
+
+    def consume(self, nbytes):
+        """Take nbytes from the bucket, blocking the calling download while it is overdrawn."""
+        if nbytes <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._samples.append((now, nbytes))
+            while self._samples[0][0] < now - self.window:
+                self._samples.popleft()
+            if not self.rate:
+                return
+            self._tokens = min(self.capacity, self._tokens + (now - self._refilled) * self.rate)
+            self._refilled = now
+            self._tokens -= nbytes
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0
+        if delay:
+            time.sleep(delay)
+
+    def throughput(self):
+        """Bytes per second downloaded over the last few seconds."""
+        with self._lock:
+            cutoff = time.monotonic() - self.window
+            return sum(nbytes for moment, nbytes in self._samples if moment >= cutoff) / self.window
+
+bandwidth_budget = BandwidthBudget(settings['bandwidth_limit_kb'] * 1024 or None)
+
+class DownloadJob:
+    """A single download waiting in, or taken from, the download queue."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, url, output_path, format='bestaudio', quality=None, title=None, priority=10, info=None,
+                 extra_targets=(), rate_limit=None):
+        self.id = next(self._ids)
+        self.url = url
+        self.output_path = output_path
+        self.format = format
+        self.quality = quality
+        self.extra_targets = list(extra_targets)  # More (output_path, quality) pairs encoded from the same source
+        self.outputs = []  # Per-output encode times, filled in once the job is done
+        self.info = info  # Metadata from resolve_video, reused so the download skips extraction
+        self.title = title or os.path.basename(output_path)
+        self.priority = priority  # Lower numbers are downloaded first
+        self.rate_limit = rate_limit  # Bytes per second, for background work that must not hog the connection
+        self.state = 'queued'  # queued -> running -> done / failed / cancelled
+        self.paused = False  # Running but held back while interactive downloads go first
+        self.error = None
+        self.bytes_downloaded = 0
+        self.throttled_bytes = 0  # Part of bytes_downloaded already charged to the bandwidth budget
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+        self.finished_event = threading.Event()
+        self.progress_listeners = []  # Extra callables that get every yt-dlp progress status
+        self.query = None  # Batch line that produced the job, so a rerun can find it in the journal
+        self.finished_outputs = []  # Outputs an earlier, interrupted run already finished
+        self._file_bytes = {}
+
+    def progress_hook(self, status):
+        """Track downloaded bytes and abort the transfer once the job is cancelled."""
+        if self.cancel_event.is_set():
+            raise DownloadCancelled(f"Job {self.id} was cancelled")
+        if status.get('downloaded_bytes') is not None:
+            # A job can fetch more than one file (e.g. video + audio for mp4)
+            self._file_bytes[status.get('filename')] = status['downloaded_bytes']
+            self.bytes_downloaded = sum(self._file_bytes.values())
+        for listener in self.progress_listeners:
+            listener(status)
+
+    @property
+    def elapsed(self):
+        """Seconds spent running so far (or in total once finished)."""
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+class DownloadQueue:
+    """Priority-ordered, cancellable download queue drained by a pool of worker threads.
+
+    Every transfer draws from a shared bandwidth budget. Jobs with a priority below
+    `preempt_priority` are interactive: if all workers are busy with background jobs an extra
+    worker takes one at once, and background jobs pause, giving up their host slots, until the
+    interactive one has fetched its streams."""
+
+    def __init__(self, workers=3, downloader=download_video, on_finish=None, max_history=500, bandwidth=None,
+                 preempt_priority=None, journal=None, limiter=None):
+        self.workers = max(1, int(workers))
+        self.downloader = downloader
+        self.on_finish = on_finish
+        self.journal = journal  # JobJournal that makes the queue's jobs resumable after a crash
+        self.bandwidth = bandwidth or bandwidth_budget
+        self.limiter = limiter or host_limiter
+        self.preempt_priority = settings['preempt_priority'] if preempt_priority is None else preempt_priority
+        self.max_history = max_history  # Finished jobs kept for display; older ones only count in stats
+        self.jobs = {}
+        self._finished = []
+        self._pruned = {'done': 0, 'failed': 0, 'cancelled': 0, 'bytes': 0}
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._first_start = None
+        self._idle = 0  # Workers waiting for a job
+        self._extra = 0  # Extra workers running interactive jobs ahead of background ones
+        self._transferring = set()  # Interactive jobs that have started but not finished fetching their streams
+        self._waits = deque(maxlen=100)  # Queue wait of recently started jobs, in seconds
+
+    def submit(self, job):
+        """Add a job to the queue and make sure the workers are running."""
+        job.progress_listeners.append(functools.partial(self._throttle, job))
+        if self.journal:
+            resumed_bytes, job.finished_outputs = self.journal.queued(job)
+            job.throttled_bytes = resumed_bytes  # Bytes in the partial file were paid for last run
+            job.progress_listeners.append(functools.partial(self.journal.progress, job))
+        with self._cond:
+            self.jobs[job.id] = job
+            heapq.heappush(self._heap, (job.priority, next(self._seq), job))
+            self._start_workers()
+            if self._is_interactive(job):
+                background = sum(1 for other in self.jobs.values()
+                                 if other.state == 'running' and not self._is_interactive(other))
+                if not self._idle and self._extra < background:
+                    # Every worker is busy; the background jobs pause, so this one can start now
+                    self._extra += 1
+                    threading.Thread(target=self._worker, args=(True,), name="download-worker-interactive",
+                                     daemon=True).start()
+            self._cond.notify()
+        return job
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job. Returns False if the job already finished."""
+        with self._cond:
+            job = self.jobs.get(job_id)
+            if job is None or job.state in ('done', 'failed', 'cancelled'):
+                return False
+            job.cancel_event.set()
+            if job.state == 'queued':
+                # The worker that eventually pops it will simply drop it
+                job.state = 'cancelled'
+                job.finished_at = time.time()
+                job.finished_event.set()
+                self._job_left(job)
+                self._record_finished(job)
+                self._cond.notify_all()
+            if self.journal and job.state == 'cancelled':
+                self.journal.finish(job)
+            return True
+
+    def pending(self):
+        """Number of jobs that are queued or running."""
+        with self._cond:
+            return sum(1 for job in self.jobs.values() if job.state in ('queued', 'running'))
+
+    def wait_for_capacity(self, limit):
+        """Block while more than `limit` jobs are queued or running. Used to apply backpressure to producers."""
+        with self._cond:
+            while sum(1 for job in self.jobs.values() if job.state in ('queued', 'running')) >= limit:
+                self._cond.wait()
+
+    def join(self, timeout=None):
+        """Block until every submitted job has finished. Returns True if the queue drained."""
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while any(job.state in ('queued', 'running') for job in self.jobs.values()):
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def stats(self):
+        """Aggregate job counts, queue wait and throughput across the whole queue."""
+        with self._cond:
+            jobs = list(self.jobs.values())
+            counts = {state: self._pruned.get(state, 0) for state in ('queued', 'running', 'done', 'failed', 'cancelled')}
+            total_bytes = self._pruned['bytes']
+            waits = list(self._waits)
+        for job in jobs:
+            counts[job.state] += 1
+        total_bytes += sum(job.bytes_downloaded for job in jobs)
+        now = time.time()
+        wall_time = now - self._first_start if self._first_start else 0.0
+        finished = counts['done']
+        return {
+            **counts,
+            'paused': sum(1 for job in jobs if job.state == 'running' and job.paused),
+            'bytes': total_bytes,
+            'wall_time': wall_time,
+            'bytes_per_second': total_bytes / wall_time if wall_time > 0 else 0.0,
+            'current_bytes_per_second': self.bandwidth.throughput(),
+            'bandwidth_limit': self.bandwidth.rate,
+            'jobs_per_minute': finished * 60 / wall_time if wall_time > 0 else 0.0,
+            'avg_wait': statistics.fmean(waits) if waits else 0.0,
+            'oldest_wait': max((now - job.created_at for job in jobs if job.state == 'queued'), default=0.0),
+        }
+
+    def _start_workers(self):
+        """Spawn worker threads on first use."""
+        if self._threads:
+            return
+        self._first_start = time.time()
+        for idx in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"download-worker-{idx + 1}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _is_interactive(self, job):
+        return job.priority < self.preempt_priority
+
+    def _job_left(self, job):
+        """Bookkeeping for a job that finished or was cancelled. Call with the lock held."""
+        self._transferring.discard(job.id)
+
+    def _next_job(self, interactive_only=False):
+        """Pop the highest-priority job that has not been cancelled.
+
+        Extra workers get None once no interactive job is waiting, and then exit."""
+        with self._cond:
+            while True:
+                while self._heap:
+                    job = self._heap[0][2]
+                    if job.state != 'queued':
+                        heapq.heappop(self._heap)
+                        continue
+                    if interactive_only and not self._is_interactive(job):
+                        break
+                    heapq.heappop(self._heap)
+                    job.state = 'running'
+                    job.started_at = time.time()
+                    if self._is_interactive(job):
+                        # Background jobs pause before this one asks for a host slot, so it never queues behind them
+                        self._transferring.add(job.id)
+                    self._waits.append(job.started_at - job.created_at)
+                    return job
+                if interactive_only:
+                    self._extra -= 1
+                    return None
+                self._idle += 1
+                self._cond.wait()
+                self._idle -= 1
+
+    def _stage(self, job, stage, path=None):
+        """Pass the stages download_video reports on to the journal."""
+        if stage == 'post-processing' and job.id in self._transferring:
+            with self._cond:
+                # Every stream is fetched (encoding comes next), so background jobs may carry on
+                self._transferring.discard(job.id)
+                self._cond.notify_all()
+        if not self.journal:
+            return
+        if path:
+            self.journal.output_done(job, path)
+        else:
+            self.journal.stage(job, stage)
+
+    def _throttle(self, job, status):
+        """Progress listener: charge new bytes to the bandwidth budget, and hold background
+        jobs while an interactive one is fetching."""
+        if self._transferring and not self._is_interactive(job):
+            # A paused job hands its host slot over, so the interactive job never waits for it
+            with self.limiter.released(), self._cond:
+                while self._transferring and not job.cancel_event.is_set():
+                    job.paused = True
+                    self._cond.wait(1)
+                job.paused = False
+            if job.cancel_event.is_set():
+                raise DownloadCancelled(f"Job {job.id} was cancelled")
+        self.bandwidth.consume(job.bytes_downloaded - job.throttled_bytes)
+        job.throttled_bytes = job.bytes_downloaded
+
+    def _worker(self, interactive_only=False):
+        """Run jobs from the queue until the process exits (or, for an extra worker, until no
+        interactive job is waiting)."""
+        while True:
+            job = self._next_job(interactive_only)
+            if job is None:
+                return
+            try:
+                job.outputs = self.downloader(job.url, job.output_path, format=job.format, quality=job.quality,
+                                              progress_hook=job.progress_hook, info=job.info,
+                                              extra_targets=job.extra_targets, rate_limit=job.rate_limit,
+                                              on_stage=functools.partial(self._stage, job),
+                                              finished_outputs=job.finished_outputs) or []
+                state = 'done'
+            except Exception as e:
+                if job.cancel_event.is_set():
+                    state = 'cancelled'
+                else:
+                    state = 'failed'
+                    job.error = str(e)
+            with self._cond:
+                job.state = state
+                job.finished_at = time.time()
+                job.finished_event.set()
+                self._job_left(job)
+                self._record_finished(job)
+                self._cond.notify_all()
+            if self.journal:
+                self.journal.finish(job)
+            if self.on_finish:
+                self.on_finish(job)
+
+    def _record_finished(self, job):
+        """Remember a finished job, forgetting the oldest ones so long runs use constant memory."""
+        self._finished.append(job.id)
+        while len(self._finished) > self.max_history:
+            old = self.jobs.pop(self._finished.pop(0))
+            self._pruned[old.state] += 1
+            self._pruned['bytes'] += old.bytes_downloaded
+
+def parse_targets(text):
+    """Parse output targets like 'mp3:128,m4a,mp4' into (format, quality) pairs."""
+    targets = []
+    for part in text.split(','):
+        output_format, _, quality = part.strip().lower().partition(':')
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unsupported output format: {part.strip()}")
+        if output_format == 'mp4':
+            quality = None
+        elif quality and not quality.isdigit():
+            raise ValueError(f"Invalid quality: {part.strip()}")
+        elif output_format == 'mp3':
+            quality = quality or '192'
+        # m4a and opus without a quality keep the best source bitrate, usually by stream copy
+        targets.append((output_format, quality or None))
+    return targets
+
+def sanitize_title(title):
+    """Remove characters that are not allowed in file names."""
+    return re.sub(r'[\/:*?"<>|]', "", title)
+
+def make_download_job(url, title, output_format, quality=None, info=None, directory=None, priority=10,
+                      extra_targets=(), rate_limit=None):
+    """Build a download job for an output format such as mp3 or mp4, named after the video title.
+
+    extra_targets lists more (format, quality) pairs to encode from the same download."""
+    output_path = os.path.join(directory or os.getcwd(), sanitize_title(title))
+    targets = [(output_format, quality), *extra_targets]
+    paths = []
+    for target_format, target_quality in targets:
+        if target_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unsupported output format: {target_format}")
+        if sum(1 for other_format, _ in targets if other_format == target_format) > 1:
+            # Several qualities of the same format need distinct file names
+            label = f"{target_quality}k" if target_quality else "best"
+            paths.append(f"{output_path} ({label}).{target_format}")
+        else:
+            paths.append(f"{output_path}.{target_format}")
+    return DownloadJob(url, paths[0], format='bestvideo+bestaudio' if output_format == 'mp4' else 'bestaudio',
+                       quality=quality, title=title, priority=priority, info=info,
+                       extra_targets=[(path, target[1]) for path, target in zip(paths[1:], targets[1:])],
+                       rate_limit=rate_limit)
+
+def sync_collection(url, queue, output_format, quality=None, directory=None, priority=20, stop_after=None,
+                    extra_targets=()):
+    """Queue the videos of a playlist or channel that are not in the download archive yet."""
+    if stop_after is None:
+        # Channels list newest uploads first, so a run of known videos means the rest is already synced.
+        # Playlists usually grow at the end, so they are always listed in full.
+        stop_after = settings['sync_stop_after'] if is_channel_url(url) else 0
+    # Only keep a couple of pages worth of jobs waiting so channels with huge upload counts stay cheap
+    limit = queue.workers * 4
+    stats = {'listed': 0, 'skipped': 0, 'queued': 0, 'stopped_early': False}
+    known_in_a_row = 0
+    for entry in iter_collection_entries(url):
+        stats['listed'] += 1
+        if archive.contains(entry['id'], output_format, quality):
+            stats['skipped'] += 1
+            known_in_a_row += 1
+            if stop_after and known_in_a_row >= stop_after:
+                stats['stopped_early'] = True
+                break
+            continue
+        known_in_a_row = 0
+        queue.wait_for_capacity(limit)
+        queue.submit(make_download_job(entry['url'], entry['title'], output_format, quality,
+                                       directory=directory, priority=priority, extra_targets=extra_targets))
+        stats['queued'] += 1
+    return stats
+
+def queue_collection(url, queue, output_format, quality=None, directory=None, priority=20, on_error=None,
+                     extra_targets=()):
+    """Sync a playlist or channel in the background, feeding new videos into the download queue as they are listed."""
+
+    def expand():
+        try:
+            sync_collection(url, queue, output_format, quality, directory, priority, extra_targets=extra_targets)
+        except Exception as e:
+            if on_error:
+                on_error(url, e)
+
+    thread = threading.Thread(target=expand, name="collection-expander", daemon=True)
+    thread.start()
+    return thread
+
+def format_size(num_bytes):
+    """Format a byte count for display."""
+    for unit in ('B', 'KB', 'MB'):
+        if num_bytes < 1024:
+            return f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} GB"
+
+def format_download_queue(queue):
+    """Format the download queue into a table."""
+    table = Table(title="Download Queue", header_style="bold blue")
+    table.add_column("No.", style="bold cyan")
+    table.add_column("Title", style="bold magenta")
+    table.add_column("State", style="italic")
+    table.add_column("Downloaded", style="dim")
+    table.add_column("Time", style="dim")
+
+    state_styles = {'queued': 'yellow', 'running': 'cyan', 'paused': 'blue', 'done': 'green', 'failed': 'red',
+                    'cancelled': 'dim'}
+    for job in sorted(queue.jobs.values(), key=lambda job: job.id):
+        name = 'paused' if job.state == 'running' and job.paused else job.state
+        state = f"[{state_styles[name]}]{name}[/{state_styles[name]}]"
+        table.add_row(str(job.id), job.title, state, format_size(job.bytes_downloaded), f"{job.elapsed:.1f}s")
+
+    return table
+
+def record_download(job):
+    """Add a finished download to the library index and the download archive."""
+    info = job.info or {}
+    video_id = info.get('id') or extract_video_id(job.url)
+    for path, quality in [(job.output_path, job.quality), *job.extra_targets]:
+        library.add(path, video_id=video_id, duration=info.get('duration'),
+                    artist=info.get('artist') or info.get('uploader') or info.get('channel'))
+        if video_id:
+            output_format = os.path.splitext(path)[1].lstrip('.').lower()
+            archive.add(video_id, output_format, quality, path)
+
+def report_finished_download(job):
+    """Print the outcome of a finished download job."""
+    if job.state == 'done':
+        record_download(job)
+        action_labels = {'copy': 'stream copy', 'kept': 'finished before the restart'}
+        saved = ", ".join(
+            f"{output['path']} ({action_labels.get(output.get('action'), 'transcoded')}, "
+            f"{output['encode_seconds']:.1f}s)" for output in job.outputs
+        ) or job.output_path
+        notify(f"\n[bold green]Download complete! Saved {saved}[/bold green]")
+    elif job.state == 'failed':
+        notify(f"\n[red]Download of '{job.title}' failed: {job.error}[/red]")
+
+def resume_unfinished(queue):
+    """Queue again the journal's jobs that an earlier run left unfinished. Returns how many there were."""
+    entries = queue.journal.claim_unfinished()
+    if entries:
+        fetched = sum(entry['bytes'] for entry in entries)
+        notify(f"[bold green]Resuming {len(entries)} unfinished download(s) from the last run "
+               f"({format_size(fetched)} already fetched)[/bold green]")
+        for entry in entries:
+            queue.submit(queue.journal.job(entry))
+    return len(entries)
+
+def report_collection_error(url, error):
+    """Print why expanding a playlist or channel stopped early."""
+    notify(f"\n[red]Stopped listing {url}: {error}[/red]")
+
+def ask_output_targets():
+    """Ask for the output format (and quality). Returns (format, quality) pairs, or None if the answer is invalid."""
+    answer = input("Choose output format (mp3/mp4/m4a/opus, or several like mp3:128,m4a,mp4): ").strip().lower()
+    try:
+        targets = parse_targets(answer)
+    except ValueError:
+        notify("[red]Invalid format.[/red]")
+        return None
+    if answer == 'mp3':
+        while True:
+            quality = input("Choose audio quality (e.g., 128, 192, 320): ").strip() or '192'
+            if quality.isdigit():
+                return [('mp3', quality)]
+            console.print("[red]Enter the bitrate in kbps, like 192.[/red]")
+    return targets
+
+def search_results_table(title="Search Results"):
+    """Create an empty search results table."""
+    table = Table(title=title, header_style="bold blue")
+    table.add_column("No.", style="bold cyan")
+    table.add_column("Title", style="bold magenta")
+    table.add_column("URL", style="dim")
+    table.add_column("Published Time", style="italic")
+    table.add_column("Duration", style="italic")
+    return table
+
+def format_search_results(videos):
+    """Format search results into a table."""
+    table = search_results_table()
+    
+    for idx, (title, url, published_time, duration) in enumerate(videos, 1):
+        table.add_row(str(idx), title, url, published_time, duration)
+
+    return table
+
+def show_results_live(results, count, start=1, title="Search Results"):
+    """Draw up to `count` results from an iterator, redrawing the table as each row arrives."""
+    table = search_results_table(title)
+    shown = []
+    with Live(table, console=console._load(), refresh_per_second=20) as live:
+        for title, url, published_time, duration in itertools.islice(results, count):
+            table.add_row(str(start + len(shown)), title, url, published_time, duration)
+            shown.append((title, url, published_time, duration))
+            live.refresh()
+    return shown
+
+MEDIA_EXTENSIONS = ('.mp3', '.mp4', '.m4a', '.opus')
+
+class LibraryIndex(SqliteStore):
+    """Persistent index of downloaded media, updated incrementally instead of rescanning the directory."""
+
+    schema = (
+        'CREATE TABLE IF NOT EXISTS library ('
+        'path TEXT PRIMARY KEY, directory TEXT NOT NULL, name TEXT NOT NULL, size INTEGER NOT NULL, '
+        'mtime REAL NOT NULL, duration REAL, video_id TEXT, format TEXT, artist TEXT)',
+        'CREATE INDEX IF NOT EXISTS library_directory ON library (directory, name)',
+        'CREATE TABLE IF NOT EXISTS library_dirs (directory TEXT PRIMARY KEY, mtime REAL NOT NULL)',
+    )
+    track_columns = ('path', 'name', 'size', 'mtime', 'duration', 'video_id', 'format', 'artist', 'loudness', 'peak')
+
+    def __init__(self, directory='.', path=CACHE_DB):
+        super().__init__(path)
+        self.directory = os.path.abspath(directory)
+        self.rescans = 0  # Bumped whenever refresh() walks the directory and finds changes
+        self.listeners = []  # Callables that get each track dict recorded by add(), writing() or set_loudness()
+        self._tracks = None  # In-memory copy of the listing, dropped whenever the index changes
+
+    def _setup(self):
+        columns = [row[1] for row in self._conn.execute('PRAGMA table_info(library)')]
+        # Columns added after the first release
+        for column in ('artist TEXT', 'loudness REAL', 'peak REAL'):
+            if column.split()[0] not in columns:
+                self._conn.execute(f'ALTER TABLE library ADD COLUMN {column}')
+
+    def refresh(self):
+        """Bring the index up to date. The directory is only walked when its mtime has changed."""
+        with self._lock:
+            dir_mtime = os.stat(self.directory).st_mtime
+            row = self.db.execute('SELECT mtime FROM library_dirs WHERE directory = ?', (self.directory,)).fetchone()
+            if row and row[0] == dir_mtime:
+                return False
+            known = {
+                path: (size, mtime) for path, size, mtime in
+                self.db.execute('SELECT path, size, mtime FROM library WHERE directory = ?', (self.directory,))
+            }
+            seen = set()
+            with self.db:
+                for entry in os.scandir(self.directory):
+                    if not entry.is_file() or not entry.name.lower().endswith(MEDIA_EXTENSIONS):
+                        continue
+                    stat = entry.stat()
+                    seen.add(entry.path)
+                    if known.get(entry.path) != (stat.st_size, stat.st_mtime):
+                        self._upsert(entry.path, stat)
+                self.db.executemany('DELETE FROM library WHERE path = ?', [(path,) for path in known.keys() - seen])
+                self.db.execute('INSERT OR REPLACE INTO library_dirs VALUES (?, ?)', (self.directory, dir_mtime))
+            self._tracks = None
+            self.rescans += 1
+            return True
+
+    def add(self, path, video_id=None, duration=None, artist=None):
+        """Record a finished download without rescanning the directory."""
+        path = os.path.abspath(path)
+        if not os.path.exists(path):
+            return
+        with self._lock, self.db:
+            self._upsert(path, os.stat(path), video_id, duration, artist)
+            self._tracks = None
+        self._changed(path)
+
+    @contextlib.contextmanager
+    def writing(self, path):
+        """Wrap writing one file into the library directory, so the directory mtime change it causes
+        does not make the next listing walk the whole directory again.
+
+        The stored mtime only moves forward if the index was current when the write started."""
+        path = os.path.abspath(path)
+        directory = os.path.dirname(path)
+        if directory != self.directory:
+            yield
+            return
+        before = os.stat(directory).st_mtime
+        try:
+            yield
+        finally:
+            with self._lock, self.db:
+                if os.path.exists(path):
+                    self._upsert(path, os.stat(path))
+                self.db.execute('UPDATE library_dirs SET mtime = ? WHERE directory = ? AND mtime = ?',
+                                (os.stat(directory).st_mtime, directory, before))
+                self._tracks = None
+            self._changed(path)
+
+    def set_loudness(self, path, loudness, peak):
+        """Store a loudness measurement, along with the file's current size and mtime (tagging rewrites it)."""
+        stat = os.stat(path)
+        with self._lock, self.db:
+            self.db.execute('UPDATE library SET loudness = ?, peak = ?, size = ?, mtime = ? WHERE path = ?',
+                            (loudness, peak, stat.st_size, stat.st_mtime, path))
+            self._tracks = None
+        self._changed(path)
+
+    def tracks(self):
+        """Return indexed tracks as dicts in a stable, name-sorted order."""
+        self.refresh()
+        with self._lock:
+            if self._tracks is None:
+                cursor = self.db.execute(
+                    f"SELECT {', '.join(self.track_columns)} FROM library "
+                    'WHERE directory = ? ORDER BY name COLLATE NOCASE', (self.directory,)
+                )
+                self._tracks = [dict(zip(self.track_columns, row)) for row in cursor]
+            return self._tracks
+
+    def _changed(self, path):
+        """Hand the stored row for one file to the listeners. Call without the lock held."""
+        if not self.listeners or os.path.dirname(path) != self.directory:
+            return
+        with self._lock:
+            row = self.db.execute(f"SELECT {', '.join(self.track_columns)} FROM library WHERE path = ?",
+                                  (path,)).fetchone()
+        if row:
+            track = dict(zip(self.track_columns, row))
+            for listener in self.listeners:
+                listener(track)
+
+    def _upsert(self, path, stat, video_id=None, duration=None, artist=None):
+        """Insert or update one file, keeping metadata we already know about it."""
+        self.db.execute(
+            'INSERT INTO library (path, directory, name, size, mtime, duration, video_id, format, artist) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT(path) DO UPDATE SET size = excluded.size, mtime = excluded.mtime, '
+            'duration = COALESCE(excluded.duration, duration), video_id = COALESCE(excluded.video_id, video_id), '
+            'artist = COALESCE(excluded.artist, artist), '
+            # A file that changed on disk has to be measured again
+            'loudness = CASE WHEN excluded.size = size AND excluded.mtime = mtime THEN loudness END, '
+            'peak = CASE WHEN excluded.size = size AND excluded.mtime = mtime THEN peak END',
+            (path, os.path.dirname(path), os.path.basename(path), stat.st_size, stat.st_mtime,
+             duration, video_id, os.path.splitext(path)[1].lstrip('.').lower(), artist)
+        )
+
+library = LibraryIndex()
+
+def format_duration(seconds):
+    """Format a duration in seconds as m:ss."""
+    if not seconds:
+        return ""
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes}:{seconds:02d}"
+
+def list_downloaded_songs(songs=None):
+    """List downloaded songs in a tabular form."""
+    if songs is None:
+        songs = library.tracks()
+    table = Table(title="Downloaded Songs", header_style="bold blue")
+    table.add_column("No.", style="bold cyan")
+    table.add_column("Title", style="bold magenta")
+    table.add_column("Duration", style="italic")
+    
+    for idx, song in enumerate(songs, 1):
+        table.add_row(str(idx), song['name'], format_duration(song['duration']))
+
+    return table
+
+def trigrams(text):
+    """Character trigrams of a title, ignoring case and punctuation."""
+    words = re.findall(r'[^\W_]+', text.lower())
+    text = f"  {' '.join(words)} "
+    return {text[idx:idx + 3] for idx in range(len(text) - 2)}
+
+class LocalSearchIndex:
+    """In-memory trigram index over the titles and artists in the library, for instant typo-tolerant lookups.
+
+    Downloads and tag updates are fed in one track at a time as the library records them; the
+    whole listing is only diffed after a rescan of the directory found changes."""
+
+    def __init__(self, library, min_overlap=0.5):
+        self.library = library
+        self.min_overlap = min_overlap  # Fraction of the query's trigrams a match must share
+        self.postings = {}  # Trigram -> set of paths
+        self.documents = {}  # Path -> (track, trigrams)
+        self._rescans = None  # library.rescans as of the last full diff
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()  # Held for a whole full diff, which can take seconds
+        library.listeners.append(self.update)
+
+    def update(self, track):
+        """(Re)index one track the library just recorded."""
+        with self._lock:
+            known = self.documents.get(track['path'])
+            if known is None or known[0] != track:
+                if known is not None:
+                    self._remove(track['path'])
+                self._add(track)
+
+    def sync(self, wait=True):
+        """Catch up with a rescan of the library. Returns False, without waiting, if another thread is
+        already doing it and wait is False."""
+        if not self._sync_lock.acquire(blocking=wait):
+            return False
+        try:
+            self.library.refresh()
+            if self.library.rescans == self._rescans:
+                return True
+            rescans = self.library.rescans
+            tracks = self.library.tracks()
+            with self._lock:
+                current = {track['path']: track for track in tracks}
+                for path in self.documents.keys() - current.keys():
+                    self._remove(path)
+                for track in current.values():
+                    known = self.documents.get(track['path'])
+                    if known is None or known[0] != track:
+                        if known is not None:
+                            self._remove(track['path'])
+                        self._add(track)
+                self._rescans = rescans
+            return True
+        finally:
+            self._sync_lock.release()
+
+    def search(self, query, limit=5):
+        """Best library matches for a query, as track dicts with a 'score' between 0 and 1.
+
+        Nothing is found while the first build is still running in another thread."""
+        if not self.sync(wait=False) and self._rescans is None:
+            return []
+        grams = trigrams(query)
+        if not grams:
+            return []
+        with self._lock:
+            # A track sharing at least `needed` trigrams must contain one of the rarest len - needed + 1,
+            # so only their (short) posting lists have to be read
+            needed = max(1, int(len(grams) * self.min_overlap + 0.999))
+            rarest = sorted(grams, key=lambda gram: len(self.postings.get(gram, ())))[:len(grams) - needed + 1]
+            candidates = set().union(*(self.postings.get(gram, ()) for gram in rarest))
+            scored = []
+            for path in candidates:
+                track, doc_grams = self.documents[path]
+                shared = len(grams & doc_grams)
+                if shared >= needed:
+                    # How much of the query matched first, then prefer titles without much else in them
+                    scored.append((shared / len(grams), 2 * shared / (len(grams) + len(doc_grams)), path))
+            best = heapq.nlargest(limit, scored)
+            return [{**self.documents[path][0], 'score': score} for score, _, path in best]
+
+    def _add(self, track):
+        grams = trigrams(f"{os.path.splitext(track['name'])[0]} {track.get('artist') or ''}")
+        self.documents[track['path']] = (track, grams)
+        for gram in grams:
+            self.postings.setdefault(gram, set()).add(track['path'])
+
+    def _remove(self, path):
+        _, grams = self.documents.pop(path)
+        for gram in grams:
+            paths = self.postings[gram]
+            paths.discard(path)
+            if not paths:
+                del self.postings[gram]
+
+local_index = LocalSearchIndex(library)
+
+# ITU-R BS.1770 K-weighting at 48 kHz: a high shelf for the head, then the RLB high-pass
+K_WEIGHTING = (
+    ((1.53512485958697, -2.69169618940638, 1.19839281085285), (1.0, -1.69065929318241, 0.73248077421585)),
+    ((1.0, -2.0, 1.0), (1.0, -1.99004745483398, 0.99007225036621)),
+)
+LOUDNESS_RATE = 48000
+REPLAYGAIN_REFERENCE = -18.0  # LUFS, as used by ReplayGain 2.0
+
+def run_decoder(path, rate, channels):
+    """Run ffmpeg to decode the first audio stream to raw float32 PCM; the caller checks the result."""
+    return subprocess.run([settings['ffmpeg_path'], '-v', 'error', '-i', path, '-map', '0:a:0',
+                           '-f', 'f32le', '-ac', str(channels), '-ar', str(rate), '-'], capture_output=True)
+
+def decode_pcm(path, rate=LOUDNESS_RATE):
+    """Decode a file to float32 stereo PCM at `rate`, as an array of shape (samples, 2)."""
+    result = run_decoder(path, rate, 2)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg could not decode {path}: {result.stderr.decode(errors='replace').strip()[-300:]}")
+    return np.frombuffer(result.stdout, dtype=np.float32).reshape(-1, 2)
+
+def integrated_loudness(samples, rate=LOUDNESS_RATE):
+    """Gated integrated loudness in LUFS (EBU R128 / BS.1770), or None for silence.
+
+    The K-weighting is applied in the frequency domain, one 100 ms sub-block at a time, so the whole
+    track is handled by a few array operations instead of a per-sample filter loop."""
+    hop = rate // 10
+    blocks = len(samples) // hop
+    if blocks < 4:
+        return None
+    frames = samples[:blocks * hop].reshape(blocks, hop, 2)
+    spectrum = np.fft.rfft(frames, axis=1)
+    z = np.exp(-2j * np.pi * np.fft.rfftfreq(hop, 1 / rate) / rate)
+    weight = np.ones(len(z))
+    for b, a in K_WEIGHTING:
+        weight *= np.abs(np.polyval(b[::-1], z) / np.polyval(a[::-1], z)) ** 2
+    # Parseval: mean square of each filtered sub-block, summed over both channels
+    power = np.abs(spectrum) ** 2 * weight[None, :, None]
+    power[:, 1:-1 if hop % 2 == 0 else None] *= 2  # rfft keeps one side of the spectrum
+    sub_block_power = power.sum(axis=(1, 2)) / hop ** 2
+    # 400 ms gating blocks with 75% overlap are averages of four consecutive sub-blocks
+    block_power = np.convolve(sub_block_power, np.full(4, 0.25), mode='valid')
+    with np.errstate(divide='ignore'):
+        block_loudness = -0.691 + 10 * np.log10(block_power)
+    gated = block_power[block_loudness > -70]
+    if not len(gated):
+        return None
+    relative_gate = -0.691 + 10 * np.log10(gated.mean()) - 10
+    gated = block_power[block_loudness > max(-70, relative_gate)]
+    return float(-0.691 + 10 * np.log10(gated.mean()))
+
+def write_replaygain_tags(path, loudness, peak):
+    """Add ReplayGain track tags by remuxing the file with stream copy (no re-encode)."""
+    output_format = os.path.splitext(path)[1].lstrip('.').lower()
+    args = ['-i', path, '-map', '0', '-c', 'copy',
+            '-metadata', f"REPLAYGAIN_TRACK_GAIN={REPLAYGAIN_REFERENCE - loudness:.2f} dB",
+            '-metadata', f"REPLAYGAIN_TRACK_PEAK={peak:.6f}"]
+    if OUTPUT_FORMATS[output_format]['muxer'] in ('ipod', 'mp4'):
+        args += ['-movflags', 'use_metadata_tags']  # The MP4 muxers drop tags they do not know otherwise
+    run_ffmpeg([*args, '-f', OUTPUT_FORMATS[output_format]['muxer']], path)
+
+FINGERPRINT_RATE = 11025
+
+def spectral_fingerprint(samples, rate=FINGERPRINT_RATE):
+    """Compact fingerprint of mono PCM: a band-energy profile plus 15 bits per quarter second.
+
+    The profile is the mean log energy in 16 bands between 300 Hz and 3 kHz; it ignores time, so
+    similar songs land in the same bucket however they are trimmed. Each bit says whether one band
+    rose more than its upper neighbour relative to the profile, in a one-second window."""
+    frame = 1024
+    frames = len(samples) // frame
+    if frames < 22:
+        return None, None
+    spectrum = np.abs(np.fft.rfft(samples[:frames * frame].reshape(frames, frame) * np.hanning(frame), axis=1)) ** 2
+    edges = np.searchsorted(np.fft.rfftfreq(frame, 1 / rate), np.geomspace(300, 3000, 17))
+    energy = np.add.reduceat(spectrum, edges, axis=1)[:, :16]  # The last slice (above 3 kHz) is dropped
+    # One-second windows every quarter second, from a running sum over ~93 ms frames
+    per_second = rate // frame
+    totals = np.cumsum(np.vstack([np.zeros(16), energy]), axis=0)
+    starts = np.arange(0, frames - per_second + 1, per_second // 4)
+    windows = np.log10(totals[starts + per_second] - totals[starts] + 1e-10)
+    profile = windows.mean(axis=0)
+    relative = windows - profile
+    bits = (relative[:, :-1] - relative[:, 1:]) > 0
+    packed = (bits * (1 << np.arange(15))).sum(axis=1).astype(np.uint16)
+    return profile.astype(np.float32), packed
+
+def scan_track(path, expected_seconds=None):
+    """Check that a file decodes completely and fingerprint it. Runs in a worker process."""
+    result = run_decoder(path, FINGERPRINT_RATE, 1)
+    errors = result.stderr.decode(errors='replace').strip()
+    samples = np.frombuffer(result.stdout, dtype=np.float32)
+    seconds = len(samples) / FINGERPRINT_RATE
+    status, problem = 'ok', None
+    if result.returncode != 0 or not len(samples):
+        status, problem = 'corrupt', errors.splitlines()[-1] if errors else "no audio could be decoded"
+    elif expected_seconds and seconds < expected_seconds * 0.97 - 1:
+        status, problem = 'truncated', f"{seconds:.0f}s of {expected_seconds:.0f}s decoded"
+    elif errors:
+        status, problem = 'corrupt', errors.splitlines()[-1]
+    profile, bits = spectral_fingerprint(samples) if len(samples) else (None, None)
+    return {'path': path, 'status': status, 'problem': problem, 'seconds': seconds,
+            'profile': profile.tobytes() if profile is not None else None,
+            'bits': bits.tobytes() if bits is not None else None}
+
+@functools.lru_cache(maxsize=None)
+def popcount_table():
+    """Number of set bits in every 16-bit value."""
+    return np.unpackbits(np.arange(1 << 16, dtype='>u2').view(np.uint8)).reshape(-1, 16).sum(axis=1)
+
+def fingerprint_distance(bits_a, bits_b, max_shift=40):
+    """Smallest fraction of differing bits over offsets of up to max_shift quarter seconds (0 is identical, ~0.5 unrelated)."""
+    popcount = popcount_table()
+    best = 1.0
+    for shift in range(-max_shift, max_shift + 1):
+        a, b = (bits_a[shift:], bits_b) if shift >= 0 else (bits_a, bits_b[-shift:])
+        overlap = min(len(a), len(b))
+        if overlap < min(len(bits_a), len(bits_b)) // 2:
+            continue
+        best = min(best, popcount[a[:overlap] ^ b[:overlap]].sum() / (15 * overlap))
+    return best
+
+def find_duplicates(profiles, load_bits, threshold=0.3, min_similarity=0.95, tables=4, hash_bits=16,
+                    compare_all_below=50):
+    """Cluster near-identical songs. `profiles` maps path -> band profile; load_bits(path) gives its bits.
+
+    Random-hyperplane hashes of the profiles pick candidate pairs, so only songs that already sound
+    alike are compared bit by bit. Libraries smaller than compare_all_below compare every pair,
+    since their average profile says too little to centre on."""
+    paths = list(profiles)
+    if len(paths) < 2:
+        return []
+    if len(paths) < compare_all_below:
+        candidates = itertools.combinations(range(len(paths)), 2)
+    else:
+        candidates = duplicate_candidates(np.array([profiles[path] for path in paths]), min_similarity, tables,
+                                          hash_bits)
+    parent = list(range(len(paths)))
+
+    def root(idx):
+        while parent[idx] != idx:
+            parent[idx] = parent[parent[idx]]
+            idx = parent[idx]
+        return idx
+
+    bits = {}
+    for a, b in candidates:
+        if root(a) == root(b):
+            continue
+        for idx in (a, b):
+            if idx not in bits:
+                bits[idx] = load_bits(paths[idx])
+        if fingerprint_distance(bits[a], bits[b]) < threshold:
+            parent[root(a)] = root(b)
+    clusters = {}
+    for idx in range(len(paths)):
+        clusters.setdefault(root(idx), []).append(paths[idx])
+    return [sorted(members) for members in clusters.values() if len(members) > 1]
+
+def duplicate_candidates(vectors, min_similarity, tables, hash_bits):
+    """Index pairs whose band profiles are nearly parallel, found through random-hyperplane hash buckets."""
+    # Centre on the library's average profile, so what is compared is how each song differs from the rest
+    vectors = vectors - vectors.mean(axis=0)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-9
+    planes = np.random.default_rng(0).standard_normal((tables, vectors.shape[1], hash_bits))
+    hashes = ((np.einsum('nd,tdh->tnh', vectors, planes) > 0) * (1 << np.arange(hash_bits))).sum(axis=2)
+    candidates = set()
+    for table in hashes:
+        order = np.argsort(table, kind='stable')
+        bounds = np.flatnonzero(np.diff(table[order])) + 1
+        for members in np.split(order, bounds):
+            # Comparing bits is the slow part, so only pairs whose profiles are nearly parallel go on
+            for start in range(0, len(members), 1024):
+                rows = members[start:start + 1024]
+                similar = vectors[rows] @ vectors[members].T > min_similarity
+                for row, col in zip(*np.nonzero(similar)):
+                    if rows[row] < members[col]:
+                        candidates.add((int(rows[row]), int(members[col])))
+    return sorted(candidates)
+
+def analyze_track(path, write_tags=True):
+    """Measure one file and optionally tag it. Runs in a worker process."""
+    samples = decode_pcm(path)
+    loudness = integrated_loudness(samples)
+    peak = float(np.abs(samples).max()) if len(samples) else 0.0
+    if write_tags and loudness is not None:
+        write_replaygain_tags(path, loudness, peak)
+    return {'path': path, 'loudness': loudness, 'peak': peak}
+
+def local_choice_hint(matches):
+    """Prompt text for picking a library match, if there are any."""
+    return f"'L1'-'L{len(matches)}' to play a song you already have, " if matches else ""
+
+def play_local_match(choice, matches, player, prefetcher):
+    """Play a library match picked as 'L<n>'. Returns False if the choice was something else."""
+    if not (choice.startswith('l') and choice[1:].isdigit() and 1 <= int(choice[1:]) <= len(matches)):
+        return False
+    prefetcher.watch([])
+    player.play([matches[int(choice[1:]) - 1]['path']])
+    control_playback(player)
+    return True
+
+def show_local_matches(query):
+    """Print the library songs matching a search, numbered L1, L2, ... Returns them."""
+    try:
+        matches = local_index.search(query)
+    except OSError:
+        return []  # The download directory is not readable; fall through to the network search
+    if matches:
+        table = Table(title="Already in Your Library", header_style="bold blue")
+        table.add_column("No.", style="bold cyan")
+        table.add_column("Title", style="bold magenta")
+        table.add_column("Artist", style="dim")
+        table.add_column("Duration", style="italic")
+        for idx, track in enumerate(matches, 1):
+            table.add_row(f"L{idx}", track['name'], track.get('artist') or "", format_duration(track['duration']))
+        console.print(table)
+    return matches
+
+class VlcBackend:
+    """Playback through libvlc. Every prepared track gets its own MediaPlayer, so the next one is ready before it is needed."""
+
+    def __init__(self):
+        self._instance = None
+
+    @property
+    def instance(self):
+        if self._instance is None:
+            self._instance = vlc.Instance('--quiet')
+        return self._instance
+
+    def prepare(self, path):
+        """Open and start parsing a track without playing it."""
+        media = self.instance.media_new(path)
+        media.parse_with_options(vlc.MediaParseFlag.local, 0)  # Asynchronous, reads headers ahead of time
+        player = self.instance.media_player_new()
+        player.set_media(media)
+        return player
+
+    def available(self, path):
+        return '://' in path or os.path.exists(path)
+
+    def play(self, player, on_end):
+        # libvlc must not be called back from its own event thread, so on_end only queues a command
+        player.event_manager().event_attach(vlc.EventType.MediaPlayerEndReached, lambda event: on_end())
+        player.play()
+
+    def pause(self, player):
+        player.set_pause(1)
+
+    def resume(self, player):
+        player.set_pause(0)
+
+    def release(self, player):
+        player.stop()
+        player.release()
+
+class PlaybackEngine:
+    """Play queue driven by end-of-track events, preloading the next track for gapless transitions.
+
+    Every public method only queues a command, so the CLI thread never blocks on the player.
+    A missing track is skipped, unless wait_for(path, callback) says it is being downloaded: then
+    playback holds at it until callback() reports that the download finished."""
+
+    def __init__(self, backend, on_track_change=None, wait_for=None):
+        self.backend = backend
+        self.on_track_change = on_track_change
+        self.wait_for = wait_for
+        self.waiting = None  # Track playback is held at until its download lands
+        self.tracks = []
+        self.order = []  # Indexes into tracks, in play order (shuffle rearranges it)
+        self.position = -1
+        self.paused = False
+        self._current = None
+        self._preloaded = None  # (position, handle) of the next track
+        self._generation = 0  # Tells end events of the current track apart from stale ones
+        self._commands = SimpleQueue()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._thread = None
+
+    @property
+    def current_track(self):
+        return self.tracks[self.order[self.position]] if 0 <= self.position < len(self.order) else None
+
+    def upcoming(self, count):
+        """The next `count` tracks in play order. Only safe from on_track_change or the engine thread."""
+        return [self.tracks[idx] for idx in self.order[self.position + 1:self.position + 1 + count]]
+
+    def play(self, tracks, start=0):
+        """Replace the queue with `tracks` and start playing at index `start`."""
+        self._send('load', list(tracks), start)
+
+    def next(self):
+        self._send('next')
+
+    def previous(self):
+        self._send('previous')
+
+    def shuffle(self):
+        """Shuffle the tracks after the current one."""
+        self._send('shuffle')
+
+    def pause(self):
+        self._send('pause')
+
+    def resume(self):
+        self._send('resume')
+
+    def stop(self):
+        self._send('stop')
+
+    def wait_idle(self, timeout=None):
+        """Block until every queued command has been handled (mainly for tests)."""
+        return self._idle.wait(timeout)
+
+    def _send(self, *command):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="playback-engine", daemon=True)
+            self._thread.start()
+        self._idle.clear()
+        self._commands.put(command)
+
+    def _run(self):
+        while True:
+            name, *args = self._commands.get()
+            try:
+                getattr(self, f"_do_{name}")(*args)
+            except Exception as e:
+                notify(f"\n[red]Playback error: {e}[/red]")
+            if self._commands.empty():
+                self._idle.set()
+
+    def _do_load(self, tracks, start):
+        self._do_stop()
+        self.tracks = tracks
+        self.order = list(range(len(tracks)))
+        if tracks:
+            self._start(min(max(start, 0), len(tracks) - 1))
+
+    def _do_next(self):
+        if self.position + 1 < len(self.order):
+            self._start(self.position + 1)
+        else:
+            self._do_stop()
+
+    def _do_previous(self):
+        if self.position >= 0:
+            self._start(max(self.position - 1, 0))
+
+    def _do_ended(self, generation):
+        if generation == self._generation:
+            self._do_next()
+
+    def _do_arrived(self, generation, position):
+        if generation == self._generation and self.waiting is not None:
+            self.waiting = None
+            self._start(position)
+
+    def _do_shuffle(self):
+        upcoming = self.order[self.position + 1:]
+        random.shuffle(upcoming)
+        self.order[self.position + 1:] = upcoming
+        self._drop_preloaded()
+        self._preload()
+
+    def _do_pause(self):
+        if self._current is not None and not self.paused:
+            self.backend.pause(self._current)
+            self.paused = True
+
+    def _do_resume(self):
+        if self._current is not None and self.paused:
+            self.backend.resume(self._current)
+            self.paused = False
+
+    def _do_stop(self):
+        self._generation += 1
+        if self._current is not None:
+            self.backend.release(self._current)
+            self._current = None
+        self._drop_preloaded()
+        self.position = -1
+        self.paused = False
+        self.waiting = None
+
+    def _start(self, position):
+        # Songs that are not downloaded are skipped, unless their download is under way
+        while position < len(self.order) and not self.backend.available(self.tracks[self.order[position]]):
+            track = self.tracks[self.order[position]]
+            generation = self._generation + 1
+            if self.wait_for and self.wait_for(track, lambda: self._send('arrived', generation, position)):
+                self._hold(position, generation)
+                return
+            notify(f"\n[red]Skipping {os.path.basename(track)}: not downloaded yet.[/red]")
+            position += 1
+        if position >= len(self.order):
+            self._do_stop()
+            return
+        if self._current is not None:
+            self.backend.release(self._current)
+        if self._preloaded and self._preloaded[0] == position:
+            handle = self._preloaded[1]
+            self._preloaded = None
+        else:
+            self._drop_preloaded()
+            handle = self.backend.prepare(self.tracks[self.order[position]])
+        self._generation += 1
+        generation = self._generation
+        self.position = position
+        self.paused = False
+        self.waiting = None
+        self._current = handle
+        self.backend.play(handle, lambda: self._send('ended', generation))
+        if self.on_track_change:
+            self.on_track_change(self.current_track)
+        self._preload()
+
+    def _hold(self, position, generation):
+        """Stop at a track whose download has not finished; 'arrived' with this generation starts it."""
+        if self._current is not None:
+            self.backend.release(self._current)
+            self._current = None
+        self._drop_preloaded()
+        self._generation = generation
+        self.position = position
+        self.paused = False
+        self.waiting = self.tracks[self.order[position]]
+        notify(f"\n[yellow]Waiting for {os.path.basename(self.waiting)} to finish downloading...[/yellow]")
+
+    def _preload(self):
+        if self._preloaded is None and self.position + 1 < len(self.order):
+            next_position = self.position + 1
+            if not self.backend.available(self.tracks[self.order[next_position]]):
+                return
+            self._preloaded = (next_position, self.backend.prepare(self.tracks[self.order[next_position]]))
+
+    def _drop_preloaded(self):
+        if self._preloaded is not None:
+            self.backend.release(self._preloaded[1])
+            self._preloaded = None
+
+def announce_track(path):
+    """Print the track the player just moved to."""
+    name = unquote(os.path.basename(path)) if '://' in path else os.path.basename(path)
+    console.print(f"\n[bold green]Now playing: {name}[/bold green]")
+
+def control_playback(player):
+    """Read playback commands until the user stops playback or goes back to the menu."""
+    console.print("[bold yellow]Playing... Press 'p' to pause, 'r' to resume, 'n' for the next song, "
+                  "'b' for the previous one, 's' to shuffle, 'm' to return to the menu while it plays, "
+                  "or 'q' to stop.[/bold yellow]")
+    while True:
+        control = input("Enter your choice (p/r/n/b/s/m/q): ").strip().lower()
+        if control == 'p':
+            player.pause()
+            console.print("[bold yellow]Paused.[/bold yellow]")
+        elif control == 'r':
+            player.resume()
+            console.print("[bold yellow]Resumed.[/bold yellow]")
+        elif control == 'n':
+            player.next()
+        elif control == 'b':
+            player.previous()
+        elif control == 's':
+            player.shuffle()
+            console.print("[bold yellow]Upcoming songs shuffled.[/bold yellow]")
+        elif control == 'm':
+            break
+        elif control == 'q':
+            player.stop()
+            break
+        else:
+            console.print("[red]Invalid option. Please try again.[/red]")
+
+class PlaylistPrefetcher:
+    """Downloads the upcoming songs of the playlist being played that are not on disk yet.
+
+    Prefetch jobs go to the back of the download queue and are speed capped, so they never
+    hold up downloads the user asked for."""
+
+    def __init__(self, queue, lookahead=3, rate_limit=None, priority=30):
+        self.queue = queue
+        self.lookahead = lookahead
+        self.rate_limit = rate_limit
+        self.priority = priority
+        self.entries = {}  # Path -> playlist entry, for the playlist being played
+        self.jobs = {}  # Path -> prefetch job
+        self._resolving = set()
+        self._lock = threading.Lock()
+        self._resolved = threading.Condition(self._lock)  # Notified whenever a path leaves _resolving
+
+    def watch(self, entries):
+        """Switch to a new playlist (an empty list turns prefetching off)."""
+        with self._lock:
+            self.entries = {entry['path']: entry for entry in entries}
+
+    def prefetch(self, paths):
+        """Start background downloads for any of these paths that are missing and not already on their way."""
+        for path in paths:
+            with self._lock:
+                entry = self.entries.get(path)
+                job = self.jobs.get(path)
+                if (entry is None or os.path.exists(path) or path in self._resolving
+                        or (job and job.state in ('queued', 'running'))):
+                    continue
+                self._resolving.add(path)
+            # Finding the video can take a search, so it happens off the player thread
+            threading.Thread(target=self._fetch, args=(entry,), name="playlist-prefetch", daemon=True).start()
+
+    def wait_for(self, path, callback):
+        """Call callback() once the prefetch of `path` has finished, either way.
+
+        Returns False, without calling it, if no prefetch of that path is under way."""
+        with self._lock:
+            job = self.jobs.get(path)
+            if path not in self._resolving and not (job and job.state in ('queued', 'running')):
+                return False
+        threading.Thread(target=self._wait, args=(path, callback), name="prefetch-wait", daemon=True).start()
+        return True
+
+    def _wait(self, path, callback):
+        with self._resolved:
+            self._resolved.wait_for(lambda: path not in self._resolving)
+            job = self.jobs.get(path)
+        if job:
+            job.finished_event.wait()
+        callback()
+
+    def _fetch(self, entry):
+        try:
+            url = entry.get('url')
+            if not url:
+                videos = search_youtube(entry['title'], max_results=1)
+                if not videos:
+                    notify(f"\n[red]Could not find '{entry['title']}' on YouTube.[/red]")
+                    return
+                url = entry['url'] = videos[0][1]
+            output_format = os.path.splitext(entry['path'])[1].lstrip('.').lower()
+            job = make_download_job(url, entry['title'], output_format, '192' if output_format == 'mp3' else None,
+                                    directory=os.path.dirname(entry['path']), priority=self.priority,
+                                    rate_limit=self.rate_limit)
+            with self._lock:
+                self.jobs[entry['path']] = job
+            self.queue.submit(job)
+        except Exception as e:
+            notify(f"\n[red]Could not prefetch '{entry['title']}': {e}[/red]")
+        finally:
+            with self._resolved:
+                self._resolving.discard(entry['path'])
+                self._resolved.notify_all()
+
+def open_shared(path):
+    """Open a file for reading without stopping anyone from renaming or deleting it meanwhile.
+
+    On Windows a handle from open() blocks renames, because it is opened without FILE_SHARE_DELETE."""
+    if os.name != 'nt':
+        return open(path, 'rb')
+    import ctypes
+    import msvcrt
+    kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+    kernel32.CreateFileW.restype = ctypes.c_void_p
+    # GENERIC_READ; FILE_SHARE_READ | FILE_SHARE_WRITE | FILE_SHARE_DELETE; OPEN_EXISTING; FILE_ATTRIBUTE_NORMAL
+    handle = kernel32.CreateFileW(path, 0x80000000, 0x7, None, 3, 0x80, None)
+    if handle in (None, ctypes.c_void_p(-1).value):
+        error = ctypes.get_last_error()
+        raise FileNotFoundError(error, ctypes.FormatError(error), path) if error in (2, 3) else ctypes.WinError(error)
+    return os.fdopen(msvcrt.open_osfhandle(handle, os.O_RDONLY | os.O_BINARY), 'rb')
+
+class StreamProxy:
+    """Local HTTP server that serves files while they are still being written.
+
+    A reader that catches up with the writer waits for more bytes instead of seeing the end of the file.
+    Files are read by path, reopened for every chunk, so the writer stays free to rename them."""
+
+    def __init__(self, poll_interval=0.05, missing_timeout=10.0):
+        self.poll_interval = poll_interval
+        self.missing_timeout = missing_timeout  # Seconds a stream may be absent (between renames) before giving up
+        self._streams = {}
+        self._tokens = itertools.count(1)
+        self._server = None
+        self._lock = threading.Lock()
+
+    def register(self, locate, is_complete, name):
+        """Serve the file at locate() until is_complete() is true and every byte has been sent. Returns its URL.
+
+        locate returns the file's current path, or None while it is being moved."""
+        with self._lock:
+            if self._server is None:
+                self._start()
+            token = str(next(self._tokens))
+            self._streams[token] = (locate, is_complete)
+        return f"http://127.0.0.1:{self._server.server_address[1]}/{token}/{quote(name)}"
+
+    @staticmethod
+    def read_at(path, offset, size=256 * 1024):
+        """Up to `size` bytes from offset, or None if there is no file at path."""
+        try:
+            with open_shared(path) as file:
+                file.seek(offset)
+                return file.read(size)
+        except (FileNotFoundError, TypeError):
+            return None
+
+    def _start(self):
+        proxy = self
+
+        class Handler(http_server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                with proxy._lock:
+                    stream = proxy._streams.pop(self.path.split('/')[1], None)
+                if stream is None:
+                    self.send_error(404)
+                    return
+                locate, is_complete = stream
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/octet-stream')
+                self.end_headers()  # No length: the response ends when the connection closes
+                offset, complete, missing_since = 0, False, None
+                try:
+                    while True:
+                        chunk = proxy.read_at(locate(), offset)
+                        if chunk:
+                            self.wfile.write(chunk)
+                            offset += len(chunk)
+                            continue
+                        if chunk is None:
+                            # Between renames (partial -> final -> cache), or gone for good
+                            missing_since = missing_since or time.time()
+                            if time.time() - missing_since > proxy.missing_timeout:
+                                break
+                        else:
+                            missing_since = None
+                            if complete:
+                                break
+                            # One more read after completion picks up bytes that landed just before it
+                            complete = is_complete()
+                        if not complete:
+                            time.sleep(proxy.poll_interval)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # The player went away (stop or skip)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = http_server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self._server.serve_forever, name="stream-proxy", daemon=True).start()
+
+stream_proxy = StreamProxy()
+
+class StreamingPlayback:
+    """Start playing a download's audio stream once enough of it has arrived, before the job finishes.
+
+    When nothing was streamed (the source was already cached, or the download beat the buffer)
+    the finished file is played instead."""
+
+    def __init__(self, job, player, min_bytes=256 * 1024):
+        self.job = job
+        self.player = player
+        self.min_bytes = min_bytes
+        self.started_at = None
+        self._paths = None  # Where the stream is while fetching, once fetched, and its cache key
+        self._fetched = threading.Event()
+        job.progress_listeners.append(self.on_progress)
+        threading.Thread(target=self._fallback, name="stream-fallback", daemon=True).start()
+
+    @property
+    def time_to_audio(self):
+        """Seconds from queueing the download to the start of playback."""
+        return self.started_at - self.job.created_at if self.started_at else None
+
+    def on_progress(self, status):
+        info = status.get('info_dict') or {}
+        if self.started_at is None:
+            if (status.get('status') == 'downloading' and info.get('vcodec') == 'none'
+                    and (status.get('downloaded_bytes') or 0) >= self.min_bytes and status.get('tmpfilename')):
+                self._paths = (status['tmpfilename'], status.get('filename'), (info.get('id'), info.get('format_id')))
+                self._start(stream_proxy.register(self._locate, self._is_complete, self.job.title))
+        elif status.get('status') in ('finished', 'error') and status.get('filename') == self._paths[1]:
+            self._fetched.set()
+
+    def _locate(self):
+        """The stream's current path: yt-dlp's .part file, then the finished file, then its source cache blob."""
+        part, final, key = self._paths
+        for path in (part, final):
+            if path and os.path.exists(path):
+                return path
+        return source_cache.peek(*key)
+
+    def _is_complete(self):
+        return self._fetched.is_set() or self.job.finished_event.is_set()
+
+    def _start(self, track):
+        self.started_at = time.time()
+        self.player.play([track])
+        notify(f"[dim]Playback started {self.time_to_audio:.1f}s after queueing.[/dim]")
+
+    def _fallback(self):
+        self.job.finished_event.wait()
+        if self.started_at is None and self.job.state == 'done':
+            self._start(self.job.output_path)
+
+def playlist_entry(title, url=None, path=None):
+    """A playlist song: its title, where it is (or will be) saved and, if known, its YouTube URL."""
+    return {'title': title, 'url': url, 'path': path or os.path.join(os.getcwd(), f"{sanitize_title(title)}.mp3")}
+
+class PlaylistStore(SqliteStore):
+    """Playlists kept in SQLite, so adding a song is one small transaction instead of rewriting every playlist.
+
+    Songs are only read when a playlist is listed or played."""
+
+    schema = (
+        'PRAGMA synchronous=FULL',  # Playlists are not a cache, so an edit must survive a power cut
+        'CREATE TABLE IF NOT EXISTS playlists (name TEXT PRIMARY KEY, created_at REAL NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS playlist_songs ('
+        'playlist TEXT NOT NULL, position INTEGER NOT NULL, title TEXT NOT NULL, url TEXT, path TEXT NOT NULL, '
+        'PRIMARY KEY (playlist, position))',
+    )
+
+    def __init__(self, path=PLAYLIST_DB, legacy_file=PLAYLIST_FILE):
+        super().__init__(path)
+        self.legacy_file = legacy_file
+
+    def _setup(self):
+        self._import_legacy_file()
+
+    def names(self):
+        """Playlist names with their song counts, in creation order."""
+        with self._lock:
+            return self.db.execute(
+                'SELECT name, (SELECT COUNT(*) FROM playlist_songs WHERE playlist = name) '
+                'FROM playlists ORDER BY created_at'
+            ).fetchall()
+
+    def exists(self, name):
+        with self._lock:
+            return self.db.execute('SELECT 1 FROM playlists WHERE name = ?', (name,)).fetchone() is not None
+
+    def create(self, name):
+        """Create an empty playlist. Returns False if the name is taken."""
+        with self._lock, self.db:
+            cursor = self.db.execute('INSERT OR IGNORE INTO playlists VALUES (?, ?)', (name, time.time()))
+        return cursor.rowcount == 1
+
+    def append(self, name, entry):
+        """Add a song to the end of a playlist."""
+        with self._lock, self.db:
+            # Looking up the last position walks the primary key index, so this does not grow with the playlist
+            self.db.execute(
+                'INSERT INTO playlist_songs SELECT ?, COALESCE(MAX(position), -1) + 1, ?, ?, ? '
+                'FROM playlist_songs WHERE playlist = ?',
+                (name, entry['title'], entry.get('url'), entry['path'], name)
+            )
+
+    def songs(self, name, limit=None):
+        """The songs of a playlist, in order, as playlist entries."""
+        with self._lock:
+            cursor = self.db.execute(
+                'SELECT title, url, path FROM playlist_songs WHERE playlist = ? ORDER BY position LIMIT ?',
+                (name, -1 if limit is None else limit)
+            )
+            return [playlist_entry(title, url, path) for title, url, path in cursor]
+
+    def _import_legacy_file(self):
+        """Move playlists from the old playlists.json into the database, once."""
+        if not os.path.exists(self.legacy_file):
+            return
+        with open(self.legacy_file, 'r') as file:
+            playlists = json.load(file)
+        with self._conn:
+            for name, songs in playlists.items():
+                if self._conn.execute('INSERT OR IGNORE INTO playlists VALUES (?, ?)', (name, time.time())).rowcount:
+                    self._conn.executemany(
+                        'INSERT INTO playlist_songs VALUES (?, ?, ?, ?, ?)',
+                        # The oldest files only listed file names
+                        [(name, position, *(
+                            (os.path.splitext(song)[0], None, os.path.abspath(song)) if isinstance(song, str)
+                            else (song['title'], song.get('url'), song['path'])
+                        )) for position, song in enumerate(songs)]
+                    )
+        os.replace(self.legacy_file, f"{self.legacy_file}.imported")
+
+def create_playlist(playlists):
+    """Create a new playlist."""
+    name = input("Enter the name of the new playlist: ").strip()
+    if not name:
+        notify("[red]Please enter a name.[/red]")
+    elif not playlists.create(name):
+        notify("[red]Playlist already exists.[/red]")
+    else:
+        notify(f"[bold green]Playlist '{name}' created.[/bold green]")
+
+def add_song_to_playlist(playlists):
+    """Add a downloaded song, a YouTube URL or just a song title to a playlist."""
+    playlist_name = input("Enter the playlist name to add a song: ").strip()
+    if not playlists.exists(playlist_name):
+        notify("[red]Playlist not found.[/red]")
+        return
+    songs = library.tracks()
+    console.print(list_downloaded_songs(songs))
+    song = input("Enter a song number from the list, a YouTube URL, or a song title to download when played: ").strip()
+    if song.isdigit() and 1 <= int(song) <= len(songs):
+        track = songs[int(song) - 1]
+        url = f"https://www.youtube.com/watch?v={track['video_id']}" if track['video_id'] else None
+        entry = playlist_entry(os.path.splitext(track['name'])[0], url, track['path'])
+    elif extract_video_id(song):
+        try:
+            entry = playlist_entry(resolve_video(song)['title'], song)
+        except Exception as e:
+            notify(f"[red]Could not retrieve video details: {e}[/red]")
+            return
+    elif song:
+        entry = playlist_entry(song)
+    else:
+        return
+    playlists.append(playlist_name, entry)
+    notify(f"[bold green]'{entry['title']}' added to playlist '{playlist_name}'.[/bold green]")
+
+def list_playlists(playlists, preview=20):
+    """List all playlists and the first songs of each."""
+    names = playlists.names()
+    if not names:
+        notify("[red]No playlists found.[/red]")
+        return
+
+    for playlist_name, count in names:
+        console.print(f"[bold cyan]{playlist_name}[/bold cyan] [dim]({count} songs)[/dim]")
+        if count:
+            for song in playlists.songs(playlist_name, limit=preview):
+                missing = "" if os.path.exists(song['path']) else " [dim](not downloaded yet)[/dim]"
+                console.print(f"  - {song['title']}{missing}")
+            if count > preview:
+                console.print(f"  [dim]... and {count - preview} more[/dim]")
+        else:
+            console.print("  [dim]No songs in this playlist.[/dim]")
+    unread_output.set()
+
+def play_playlist(playlists, player, prefetcher):
+    """Play a playlist, downloading its missing songs in the background a few tracks ahead."""
+    playlist_name = input("Enter the playlist name to play: ").strip()
+    songs = playlists.songs(playlist_name)
+    if not songs:
+        notify("[red]Playlist not found or empty.[/red]")
+        return
+    prefetcher.watch(songs)
+    # Cover the start of the playlist too; the player waits for those downloads rather than skipping them
+    prefetcher.prefetch([song['path'] for song in songs[:prefetcher.lookahead + 1]])
+    player.play([song['path'] for song in songs])
+    control_playback(player)
+
+def playlist_menu(playlists, player, prefetcher):
+    """Show the playlist options."""
+    console.print("[cyan]1. Create a new playlist[/cyan]")
+    console.print("[cyan]2. Add a song to a playlist[/cyan]")
+    console.print("[cyan]3. List all playlists[/cyan]")
+    console.print("[cyan]4. Play a playlist[/cyan]")
+    choice = input("Enter your choice (1-4, or press Enter to go back): ").strip()
+    if choice == '1':
+        create_playlist(playlists)
+    elif choice == '2':
+        add_song_to_playlist(playlists)
+    elif choice == '3':
+        list_playlists(playlists)
+    elif choice == '4':
+        play_playlist(playlists, player, prefetcher)
+def clear_screen():
+    """Clear the terminal screen, first waiting for the user if there is output they have not read."""
+    if unread_output.is_set():
+        input("\nPress Enter to continue...")
+        unread_output.clear()
+    console.clear()
+
+def main():
+    queue = DownloadQueue(settings['download_workers'], on_finish=report_finished_download, journal=journal)
+    prefetcher = PlaylistPrefetcher(queue, settings['prefetch_lookahead'],
+                                    rate_limit=settings['prefetch_rate_limit_kb'] * 1024 or None)
+    playlists = PlaylistStore()
+
+    def track_changed(path):
+        announce_track(path)
+        prefetcher.prefetch(player.upcoming(prefetcher.lookahead))
+
+    player = PlaybackEngine(VlcBackend(), on_track_change=track_changed, wait_for=prefetcher.wait_for)
+    # Build the local search index off the prompt thread; large libraries take a few seconds
+    threading.Thread(target=local_index.sync, name="local-index", daemon=True).start()
+    if not os.environ.get(NO_RESUME_ENV):
+        resume_unfinished(queue)
+
+    while True:
+        clear_screen()  # Clear screen while keeping the banner
+        display_banner()
+        console.print("\n[bold green]Welcome to the YaYtube CLI[/bold green]")
+        console.print("[cyan]1. Search for a song by name[/cyan]")
+        console.print("[cyan]2. Search for songs by artist[/cyan]")
+        console.print("[cyan]3. Paste a YouTube URL to download[/cyan]")
+        console.print("[cyan]4. List downloaded songs[/cyan]")
+        console.print("[cyan]5. View download queue[/cyan]")
+        console.print("[cyan]6. Playlists[/cyan]")
+        console.print("[cyan]7. Exit[/cyan]")
+        
+        choice = input("Enter your choice (1-7): ").strip()
+        info = None
+
+        if choice == '1':
+            query = input("Enter the song name: ").strip()
+            start_time = time.time()
+            local_matches = show_local_matches(query)
+            results = stream_search(query)
+            try:
+                videos = show_results_live(results, 10)
+            except SearchUnavailable as e:
+                if not local_matches:
+                    notify(f"[red]{e}. Please try again later.[/red]")
+                    continue
+                console.print(f"[red]{e}.[/red]")
+                videos = []
+            runtime = time.time() - start_time
+            if videos or local_matches:
+                console.print(f"\n[bold green]Search completed in {runtime:.2f} seconds.[/bold green] "
+                              f"[dim](cache: {search_cache.hits} hits, {search_cache.misses} misses)[/dim]")
+                while True:
+                    video_choice = input(f"\nEnter the number of the video to download, 'm' for more results, "
+                                         f"{local_choice_hint(local_matches)}or 'c' to cancel: ").strip().lower()
+                    if video_choice != 'm':
+                        break
+                    try:
+                        more = show_results_live(results, 10, start=len(videos) + 1,
+                                                 title=f"Search Results (page {len(videos) // 10 + 1})")
+                    except SearchUnavailable as e:
+                        console.print(f"[red]{e}.[/red]")
+                        continue
+                    if not more:
+                        console.print("[red]No more results.[/red]")
+                    videos += more
+                if play_local_match(video_choice, local_matches, player, prefetcher):
+                    continue
+                if video_choice.isdigit() and 1 <= int(video_choice) <= len(videos):
+                    title, url, _, _ = videos[int(video_choice) - 1]
+                else:
+                    continue
+            else:
+                notify("[red]No results found.[/red]")
+                continue
+
+        elif choice == '2':
+            artist_name = input("Enter the artist name: ").strip()
+            start_time = time.time()
+            local_matches = show_local_matches(artist_name)
+            videos, answered = artist_search(artist_name)
+            runtime = time.time() - start_time
+            if videos or local_matches:
+                console.print(format_search_results(videos))
+                console.print(f"\n[bold green]Search completed in {runtime:.2f} seconds.[/bold green] "
+                              f"[dim]({answered} queries merged; cache: {search_cache.hits} hits, "
+                              f"{search_cache.misses} misses)[/dim]")
+                video_choice = input(f"\nEnter the number of the video to download, "
+                                     f"{local_choice_hint(local_matches)}or 'c' to cancel: ").strip().lower()
+                if play_local_match(video_choice, local_matches, player, prefetcher):
+                    continue
+                if video_choice.isdigit() and 1 <= int(video_choice) <= len(videos):
+                    title, url, _, _ = videos[int(video_choice) - 1]
+                else:
+                    continue
+            elif answered == 0:
+                notify("[red]Search is unavailable right now. Please try again later.[/red]")
+                continue
+            else:
+                notify("[red]No results found.[/red]")
+                continue
+
+        elif choice == '3':
+            url = input("Paste the YouTube URL: ").strip()
+            if is_collection_url(url):
+                targets = ask_output_targets()
+                if targets is None:
+                    continue
+                (output_format, quality), *extra_targets = targets
+                queue_collection(url, queue, output_format, quality, on_error=report_collection_error,
+                                 extra_targets=extra_targets)
+                notify("[bold green]Listing the playlist in the background; its songs are being queued as they "
+                       "are found. Check progress with option 5.[/bold green]")
+                continue
+            video_id = extract_video_id(url, allow_bare=True)
+            if video_id is None:
+                notify("[red]That does not look like a YouTube video URL. Please try again.[/red]")
+                continue
+            url = f"https://www.youtube.com/watch?v={video_id}"
+            try:
+                info = resolve_video(url)
+            except Exception as e:
+                notify(f"[red]Could not retrieve video details: {e}[/red]")
+                continue
+            title = info['title']
+            console.print(f"[bold green]{title}[/bold green] [dim]({info.get('duration_string', '?')})[/dim]")
+        elif choice == '4':
+            clear_screen()
+            display_banner()
+            console.print("[bold green]List of Downloaded Songs:[/bold green]")
+            songs = library.tracks()
+            console.print(list_downloaded_songs(songs))
+            song_choice = input("Enter the number of the song to play (or 'c' to cancel): ").strip()
+            if song_choice.isdigit() and 1 <= int(song_choice) <= len(songs):
+                # Queue the whole library from the chosen song onwards
+                prefetcher.watch([])
+                player.play([song['path'] for song in songs], start=int(song_choice) - 1)
+                control_playback(player)
+            continue
+
+        elif choice == '5':
+            console.print(format_download_queue(queue))
+            stats = queue.stats()
+            console.print(f"[bold green]{stats['running']} running, {stats['queued']} queued, {stats['done']} done, "
+                          f"{stats['failed']} failed - {format_size(stats['bytes'])} at "
+                          f"{format_size(stats['bytes_per_second'])}/s[/bold green]")
+            limit = f" of {format_size(stats['bandwidth_limit'])}/s allowed" if stats['bandwidth_limit'] else ""
+            console.print(f"[dim]Scheduler: {stats['queued']} waiting (oldest {stats['oldest_wait']:.1f}s, "
+                          f"average wait {stats['avg_wait']:.1f}s), {stats['paused']} paused for interactive "
+                          f"downloads, {format_size(stats['current_bytes_per_second'])}/s now{limit}[/dim]")
+            cache_stats = source_cache.stats()
+            console.print(f"[dim]Source cache: {cache_stats['entries']} stream(s), {format_size(cache_stats['bytes'])} of "
+                          f"{format_size(cache_stats['max_bytes'])}, {cache_stats['hits']} hits, "
+                          f"{cache_stats['misses']} misses[/dim]")
+            session_stats = downloader_pool.stats()
+            if session_stats['created']:
+                console.print(f"[dim]Downloader sessions: {session_stats['created']} created, "
+                              f"{session_stats['reused']} reused, {session_stats['idle']} idle, "
+                              f"{session_stats['setup_ms_per_job']:.1f} ms setup per job[/dim]")
+            search_stats = search_client.stats()
+            if search_stats['requests']:
+                console.print(f"[dim]Search backend: {search_stats['requests']} requests, "
+                              f"p50 {search_stats['p50'] * 1000:.0f} ms, p95 {search_stats['p95'] * 1000:.0f} ms, "
+                              f"{search_stats['errors']} errors, {search_stats['hedges']} hedged, "
+                              f"{search_stats['retries']} retried, circuit {search_stats['state']}[/dim]")
+            job_choice = input("Enter the number of a job to cancel (or press Enter to go back): ").strip()
+            if job_choice.isdigit():
+                if queue.cancel(int(job_choice)):
+                    notify(f"[bold yellow]Job {job_choice} cancelled.[/bold yellow]")
+                else:
+                    notify("[red]That job cannot be cancelled.[/red]")
+            continue
+
+        elif choice == '6':
+            playlist_menu(playlists, player, prefetcher)
+            continue
+
+        elif choice == '7':
+            if queue.pending():
+                wait = input(f"{queue.pending()} download(s) still in progress. Wait for them to finish? (y/n): ").strip().lower()
+                if wait == 'y':
+                    queue.join()
+            console.print("[bold yellow]Goodbye![/bold yellow]")
+            break
+        else:
+            notify("[red]Invalid choice. Please try again.[/red]")
+            continue
+
+        targets = ask_output_targets()
+        if targets is None:
+            continue
+        (output_format, quality), *extra_targets = targets
+        job = make_download_job(url, title, output_format, quality, info=info, extra_targets=extra_targets)
+        play_now = input("Play it while it downloads? (y/n): ").strip().lower() == 'y'
+        if play_now:
+            job.priority = 0  # Ahead of everything else in the queue
+            prefetcher.watch([])
+            StreamingPlayback(job, player, settings['stream_start_kb'] * 1024)
+
+        queue.submit(job)
+        notify(f"[bold green]Queued download #{job.id}: {title}. Check progress with option 5.[/bold green]")
+        if play_now:
+            control_playback(player)
+
+def read_batch_items(source):
+    """Yield the non-empty, non-comment lines of a batch file, or of stdin when source is '-'."""
+    stream = sys.stdin if source == '-' else open(source, encoding='utf-8')
+    try:
+        for line in stream:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield line
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+def expand_batch_items(lines, items):
+    """Yield (text, collection_url) pairs, streaming playlist and channel lines out into their videos."""
+    for text in lines:
+        if not is_collection_url(text):
+            yield text, None
+            continue
+        try:
+            for entry in iter_collection_entries(text):
+                yield entry['url'], text
+        except Exception as e:
+            items.append({'input': text, 'status': 'failed', 'error': f"expand: {e}", '_started': time.time(),
+                          'total_seconds': 0.0})
+
+def resolve_batch_item(text):
+    """Turn a batch line (a URL or a search query) into (title, url, info)."""
+    if extract_video_id(text) is None:
+        videos = search_youtube(text, max_results=1)
+        if not videos:
+            raise LookupError("no search results")
+        text = videos[0][1]
+    info = resolve_video(text)
+    return info['title'], info.get('webpage_url') or text, info
+
+def run_batch(source, output_format='mp3', quality='192', directory=None, summary_path=None, extra_targets=()):
+    """Search, resolve and download every line of a batch file without prompting. Returns an exit code."""
+    started = time.time()
+    items = []
+    items_by_job = {}
+    lock = threading.Lock()
+    # Bounds how many lines are being worked on at once so huge inputs are streamed, not buffered
+    in_flight = threading.BoundedSemaphore(settings['download_workers'] * 2 + settings['resolve_workers'])
+
+    def finish(item, status, error=None):
+        item['status'] = status
+        item['error'] = error
+        item['total_seconds'] = round(time.time() - item['_started'], 3)
+        style = 'green' if status == 'done' else 'red'
+        err_console.print(f"[{style}]{status}[/{style}] {item.get('title') or item['input']}"
+                          + (f" [dim]({error})[/dim]" if error else ""))
+        in_flight.release()
+
+    def download_finished(job):
+        with lock:
+            item = items_by_job.pop(job.id)
+        item['queue_wait_seconds'] = round(job.started_at - job.created_at, 3) if job.started_at else None
+        item['download_seconds'] = round(job.elapsed, 3)
+        item['bytes'] = job.bytes_downloaded
+        item['outputs'] = job.outputs
+        if job.state == 'done':
+            record_download(job)
+        finish(item, job.state, job.error)
+
+    queue = DownloadQueue(settings['download_workers'], downloader=functools.partial(download_video, quiet=True),
+                          on_finish=download_finished, journal=journal)
+    targets = [(output_format, quality), *extra_targets]
+
+    def resolve(item):
+        # A rerun of an interrupted batch skips lines that finished and resumes the rest without searching again
+        entry = journal.lookup(item['input'], targets, directory)
+        if entry and entry['state'] == 'done' and all(os.path.exists(path) for path in entry['outputs']):
+            item.update(title=entry['title'], url=entry['url'], output=entry['output_path'], resumed=True,
+                        resolve_seconds=0.0)
+            finish(item, 'done')
+            return
+        try:
+            if entry and entry['state'] in JobJournal.UNFINISHED:
+                job = journal.job(entry)
+                item['title'], item['url'], item['resumed'] = job.title, job.url, True
+            else:
+                item['title'], item['url'], info = resolve_batch_item(item['input'])
+                job = make_download_job(item['url'], item['title'], output_format, quality, info=info,
+                                        directory=directory, extra_targets=extra_targets)
+                job.query = item['input']
+        except Exception as e:
+            item['resolve_seconds'] = round(time.time() - item['_started'], 3)
+            finish(item, 'failed', f"resolve: {e}")
+            return
+        item['resolve_seconds'] = round(time.time() - item['_started'], 3)
+        item['output'] = job.output_path
+        with lock:
+            items_by_job[job.id] = item
+        queue.submit(job)
+
+    with ThreadPoolExecutor(settings['resolve_workers'], thread_name_prefix='batch-resolve') as resolvers:
+        for text, collection in expand_batch_items(read_batch_items(source), items):
+            in_flight.acquire()
+            item = {'input': text, 'status': 'queued', '_started': time.time()}
+            if collection:
+                item['collection'] = collection
+            items.append(item)
+            resolvers.submit(resolve, item)
+    queue.join()
+
+    for item in items:
+        del item['_started']
+    succeeded = sum(1 for item in items if item['status'] == 'done')
+    summary = {
+        'format': output_format,
+        'quality': quality,
+        'total': len(items),
+        'succeeded': succeeded,
+        'failed': len(items) - succeeded,
+        'elapsed_seconds': round(time.time() - started, 3),
+        'items': items,
+    }
+    if summary_path:
+        with open(summary_path, 'w') as file:
+            json.dump(summary, file, indent=4)
+    else:
+        print(json.dumps(summary, indent=4))
+
+    if not items:
+        return 2
+    if succeeded == len(items):
+        return 0
+    return 1 if succeeded else 2
+
+def run_sync(urls, output_format='mp3', quality='192', directory=None, stop_after=None, extra_targets=()):
+    """Download whatever is new in each playlist or channel. Returns an exit code."""
+    failures = []
+    queue = DownloadQueue(settings['download_workers'], downloader=functools.partial(download_video, quiet=True),
+                          on_finish=lambda job: record_download(job) if job.state == 'done' else failures.append(job),
+                          journal=journal)
+    exit_code = 0
+    for url in urls:
+        start_time = time.time()
+        try:
+            stats = sync_collection(url, queue, output_format, quality, directory, stop_after=stop_after,
+                                    extra_targets=extra_targets)
+        except Exception as e:
+            console.print(f"[red]Could not list {url}: {e}[/red]")
+            exit_code = 1
+            continue
+        note = ", stopped at already-synced history" if stats['stopped_early'] else ""
+        console.print(f"[bold green]{url}: listed {stats['listed']}, {stats['skipped']} already synced, "
+                      f"{stats['queued']} new{note} ({time.time() - start_time:.2f} seconds)[/bold green]")
+    queue.join()
+    for job in failures:
+        console.print(f"[red]Download of '{job.title}' failed: {job.error}[/red]")
+    return 1 if failures else exit_code
+
+def job_summary(job):
+    """The public fields of a download job, for the daemon API."""
+    return {'id': job.id, 'title': job.title, 'url': job.url, 'state': 'paused' if job.state == 'running' and job.paused else job.state,
+            'priority': job.priority,
+            'bytes': job.bytes_downloaded, 'elapsed_seconds': round(job.elapsed, 3), 'error': job.error,
+            'outputs': job.outputs or [job.output_path, *(path for path, _ in job.extra_targets)]}
+
+class DaemonAPI:
+    """JSON API over localhost HTTP for a long-running process that keeps the queue, caches and search client warm.
+
+    GET /status, GET /library, GET /search?q=..., POST /submit {"item", "targets"}, POST /cancel {"id"}"""
+
+    def __init__(self, queue, directory=None):
+        self.queue = queue
+        self.directory = directory
+
+    def status(self, params):
+        jobs = sorted(self.queue.jobs.values(), key=lambda job: job.id)
+        return {'stats': self.queue.stats(), 'jobs': [job_summary(job) for job in jobs]}
+
+    def library(self, params):
+        return {'tracks': library.tracks()}
+
+    def search(self, params):
+        query = (params.get('q') or [''])[0]
+        return {'results': [dict(zip(('title', 'url', 'published', 'duration'), video))
+                            for video in search_youtube(query, max_results=int((params.get('n') or ['10'])[0]))]}
+
+    def submit(self, body):
+        targets = parse_targets(body.get('targets') or 'mp3:192')
+        (output_format, quality), *extra_targets = targets
+        item = body['item'].strip()
+        if is_collection_url(item):
+            queue_collection(item, self.queue, output_format, quality, self.directory,
+                             on_error=report_collection_error, extra_targets=extra_targets)
+            return {'collection': item}
+        title, url, info = resolve_batch_item(item)
+        job = make_download_job(url, title, output_format, quality, info=info, directory=self.directory,
+                                priority=int(body.get('priority', 10)), extra_targets=extra_targets)
+        self.queue.submit(job)
+        return {'job': job_summary(job)}
+
+    def cancel(self, body):
+        return {'cancelled': self.queue.cancel(int(body['id']))}
+
+    def make_server(self, port):
+        api = self
+
+        class Handler(http_server.BaseHTTPRequestHandler):
+            def trusted_host(self):
+                # A page on a rebinding DNS name reaches 127.0.0.1 with its own name in Host; refuse it
+                port = self.server.server_address[1]
+                if self.headers.get('Host', '').lower() in (f"127.0.0.1:{port}", f"localhost:{port}"):
+                    return True
+                self.send_json(403, {'error': "unexpected Host header"})
+                return False
+
+            def do_GET(self):
+                if not self.trusted_host():
+                    return
+                url = urlparse(self.path)
+                handler = {'/status': api.status, '/library': api.library, '/search': api.search}.get(url.path)
+                self.respond(handler, parse_qs(url.query))
+
+            def do_POST(self):
+                if not self.trusted_host():
+                    return
+                # Requiring a JSON content type means web pages cannot post here without a CORS preflight
+                if self.headers.get('Content-Type', '').split(';')[0] != 'application/json':
+                    self.send_json(415, {'error': "expected application/json"})
+                    return
+                handler = {'/submit': api.submit, '/cancel': api.cancel}.get(self.path)
+                try:
+                    body = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+                except ValueError:
+                    self.send_json(400, {'error': "invalid JSON"})
+                    return
+                self.respond(handler, body)
+
+            def respond(self, handler, argument):
+                if handler is None:
+                    self.send_json(404, {'error': "unknown endpoint"})
+                    return
+                try:
+                    self.send_json(200, handler(argument))
+                except (KeyError, ValueError, LookupError) as e:
+                    self.send_json(400, {'error': str(e)})
+                except Exception as e:
+                    self.send_json(500, {'error': str(e)})
+
+            def send_json(self, code, payload):
+                data = json.dumps(payload).encode()
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return http_server.ThreadingHTTPServer(('127.0.0.1', port), Handler)
+
+    def serve(self, port):
+        server = self.make_server(port)
+        console.print(f"[bold green]YaYtube daemon listening on http://127.0.0.1:{port} "
+                      f"(Ctrl+C to stop)[/bold green]")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+def run_daemon(port=None, directory=None):
+    """Serve the daemon API until interrupted. Returns an exit code."""
+
+    def download_finished(job):
+        if job.state == 'done':
+            record_download(job)
+        err_console.print(f"[{'green' if job.state == 'done' else 'red'}]{job.state}[/] #{job.id} {job.title}"
+                          + (f" [dim]({job.error})[/dim]" if job.error else ""))
+
+    queue = DownloadQueue(settings['download_workers'], downloader=functools.partial(download_video, quiet=True),
+                          on_finish=download_finished, journal=journal)
+
+    def warm_up():
+        # Pay for the slow imports and the library index now rather than on the first client request
+        for module in (yt_dlp, VideosSearch):
+            try:
+                module._load()
+            except ImportError as e:
+                err_console.print(f"[red]{e}[/red]")
+        local_index.sync()
+
+    threading.Thread(target=warm_up, name="daemon-warm-up", daemon=True).start()
+    resume_unfinished(queue)
+    DaemonAPI(queue, directory).serve(port or settings['daemon_port'])
+    return 0
+
+def run_loudness_analysis(directory=None, workers=None, write_tags=True):
+    """Measure and tag every library track without a stored loudness. Returns an exit code."""
+    try:
+        np.ndarray
+    except ImportError:
+        console.print("[red]Loudness analysis needs NumPy: pip install numpy[/red]")
+        return 2
+    index = LibraryIndex(directory) if directory else library
+    tracks = [track for track in index.tracks() if track['loudness'] is None]
+    skipped = len(index.tracks()) - len(tracks)
+    failures = []
+    start_time = time.time()
+    with ProcessPoolExecutor(workers or os.cpu_count()) as pool:
+        futures = {pool.submit(analyze_track, track['path'], write_tags): track for track in tracks}
+        for future in as_completed(futures):
+            track = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                failures.append(track)
+                console.print(f"[red]{track['name']}: {e}[/red]")
+                continue
+            if result['loudness'] is None:
+                console.print(f"[dim]{track['name']}: silent, left untagged[/dim]")
+                continue
+            index.set_loudness(result['path'], result['loudness'], result['peak'])
+            console.print(f"{track['name']}: {result['loudness']:.1f} LUFS, peak {result['peak']:.3f}, "
+                          f"gain {REPLAYGAIN_REFERENCE - result['loudness']:+.2f} dB")
+    elapsed = time.time() - start_time
+    analyzed = len(tracks) - len(failures)
+    console.print(f"[bold green]Analyzed {analyzed} file(s) in {elapsed:.2f} seconds "
+                  f"({analyzed / elapsed if elapsed > 0 else 0:.1f} files/s); {skipped} already measured, "
+                  f"{len(failures)} failed.[/bold green]")
+    return 1 if failures else 0
+
+def run_library_scan(directory=None, workers=None):
+    """Check every library file for damage and group duplicates. Returns an exit code."""
+    try:
+        np.ndarray
+    except ImportError:
+        console.print("[red]Scanning the library needs NumPy: pip install numpy[/red]")
+        return 2
+    index = LibraryIndex(directory) if directory else library
+    tracks = index.tracks()
+    stale = scan_cache.stale(tracks)
+    start_time = time.time()
+    failures = 0
+    with ProcessPoolExecutor(workers or os.cpu_count()) as pool:
+        futures = {pool.submit(scan_track, track['path'], track['duration']): track for track in stale}
+        for future in as_completed(futures):
+            try:
+                scan_cache.put(futures[future], future.result())
+            except Exception as e:
+                failures += 1
+                console.print(f"[red]{futures[future]['name']}: {e}[/red]")
+    elapsed = time.time() - start_time
+    console.print(f"[bold green]Scanned {len(stale) - failures} changed file(s) in {elapsed:.2f} seconds; "
+                  f"{len(tracks) - len(stale)} unchanged since the last scan.[/bold green]")
+
+    results = scan_cache.results({track['path'] for track in tracks})
+    damaged = [(path, status, problem) for path, (status, problem, _) in results.items() if status != 'ok']
+    if damaged:
+        table = Table(title="Damaged Files", header_style="bold blue")
+        table.add_column("File", style="bold magenta")
+        table.add_column("Problem", style="red")
+        table.add_column("Details", style="dim")
+        for path, status, problem in sorted(damaged):
+            table.add_row(os.path.basename(path), status, problem or "")
+        console.print(table)
+
+    profiles = {path: np.frombuffer(profile, dtype=np.float32)
+                for path, (status, _, profile) in results.items() if status == 'ok' and profile}
+    clusters = find_duplicates(profiles, lambda path: np.frombuffer(scan_cache.bits(path), dtype=np.uint16))
+    if clusters:
+        table = Table(title="Likely Duplicates", header_style="bold blue")
+        table.add_column("No.", style="bold cyan")
+        table.add_column("Files", style="bold magenta")
+        for idx, members in enumerate(clusters, 1):
+            table.add_row(str(idx), "\n".join(os.path.basename(path) for path in members))
+        console.print(table)
+    console.print(f"[bold green]{len(damaged)} damaged file(s), {len(clusters)} group(s) of duplicates.[/bold green]")
+    return 1 if damaged or failures else 0
+
+def benchmark_startup(launches=5, round_trips=20):
+    """Measure time-to-first-prompt and time per menu round-trip of the interactive CLI."""
+    prompt = b"Enter your choice (1-7): "
+
+    def read_until(fd, marker, buffer):
+        while marker not in buffer:
+            chunk = os.read(fd, 4096)
+            if not chunk:
+                raise RuntimeError("CLI exited before showing the prompt")
+            buffer += chunk
+        return buffer[buffer.index(marker) + len(marker):]
+
+    first_prompt, round_trip = [], []
+    for _ in range(launches):
+        start = time.perf_counter()
+        # Resuming the journal would start downloads and hold the first screen on the notice
+        process = subprocess.Popen([sys.executable, os.path.abspath(__file__)],
+                                   stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                   env={**os.environ, NO_RESUME_ENV: '1'})
+        fd = process.stdout.fileno()
+        buffer = read_until(fd, prompt, b"")
+        first_prompt.append(time.perf_counter() - start)
+        for _ in range(round_trips):
+            # Open the download queue view and go straight back to the menu
+            start = time.perf_counter()
+            process.stdin.write(b"5\n\n")
+            process.stdin.flush()
+            buffer = read_until(fd, prompt, buffer)
+            round_trip.append(time.perf_counter() - start)
+        process.stdin.write(b"7\n")
+        process.stdin.flush()
+        process.wait()
+
+    table = Table(title="Startup Benchmark", header_style="bold blue")
+    table.add_column("Measurement", style="bold magenta")
+    table.add_column("Median", style="bold cyan")
+    table.add_column("Min", style="dim")
+    table.add_column("Max", style="dim")
+    for name, samples in (("Time to first prompt", first_prompt), ("Menu round-trip", round_trip)):
+        table.add_row(name, f"{statistics.median(samples) * 1000:.1f} ms",
+                      f"{min(samples) * 1000:.1f} ms", f"{max(samples) * 1000:.1f} ms")
+    console.print(table)
+    return first_prompt, round_trip
+
+def benchmark_sessions(jobs=50):
+    """Compare per-job setup time of a fresh YoutubeDL against a pooled session, with no network involved."""
+    options = {'format': '251', 'outtmpl': os.path.join(settings['source_cache_dir'], 'partial', 'x.webm'),
+               'progress_hooks': [lambda status: None], 'ratelimit': None}
+    profile = {'quiet': True, 'noprogress': True}
+    yt_dlp.YoutubeDL  # Keep the import itself out of the first sample
+    fresh, pooled = [], []
+    for _ in range(jobs):
+        start_time = time.perf_counter()
+        with yt_dlp.YoutubeDL({**profile, **options}):
+            pass
+        fresh.append(time.perf_counter() - start_time)
+    pool = DownloaderPool()
+    for _ in range(jobs):
+        start_time = time.perf_counter()
+        with pool.session(profile, **options):
+            pass
+        pooled.append(time.perf_counter() - start_time)
+    pool.close()
+
+    table = Table(title="Downloader Session Benchmark", header_style="bold blue")
+    table.add_column("Setup per job", style="bold magenta")
+    table.add_column("Median", style="bold cyan")
+    table.add_column("Total", style="dim")
+    for name, samples in (("New YoutubeDL", fresh), ("Pooled session", pooled)):
+        table.add_row(name, f"{statistics.median(samples) * 1000:.2f} ms", f"{sum(samples) * 1000:.0f} ms")
+    console.print(table)
+    console.print(f"[dim]{jobs} jobs; a pooled session also keeps its HTTP connections and cookies, "
+                  f"which this offline measurement does not include[/dim]")
+
+def benchmark_search(requests=200):
+    """Compare plain and resilient searches against a stub backend with injected delay and errors."""
+    backend = StubSearchBackend()
+    plain = LatencyHistogram()
+    for idx in range(requests):
+        start_time = time.perf_counter()
+        try:
+            backend(f"query {idx}")
+        except ConnectionError:
+            plain.record_error()
+            continue
+        plain.record(time.perf_counter() - start_time)
+
+    client = ResilientSearchClient(backend=backend, backoff=0.01, breaker_threshold=requests)
+    resilient = LatencyHistogram()
+    for idx in range(requests):
+        start_time = time.perf_counter()
+        try:
+            client.search(f"query {idx}")
+        except SearchUnavailable:
+            resilient.record_error()
+            continue
+        resilient.record(time.perf_counter() - start_time)
+
+    table = Table(title="Search Backend Benchmark", header_style="bold blue")
+    table.add_column("Client", style="bold magenta")
+    table.add_column("Succeeded", style="bold cyan")
+    for pct in (50, 95, 99):
+        table.add_column(f"p{pct}", style="dim")
+    for name, histogram in (("Plain", plain), ("Hedged + retries", resilient)):
+        table.add_row(name, f"{histogram.total()}/{requests}",
+                      *(f"{histogram.percentile(pct) * 1000:.0f} ms" for pct in (50, 95, 99)))
+    console.print(table)
+    console.print(f"[dim]{client.hedges} hedged requests, {client.retries} retries[/dim]")
+
+def parse_args(argv=None):
+    """Parse command-line options."""
+    parser = argparse.ArgumentParser(description="Search, download and play YouTube songs from the terminal.")
+    parser.add_argument('--benchmark-startup', action='store_true',
+                        help="measure time-to-first-prompt and menu round-trip time, then exit")
+    parser.add_argument('--benchmark-sessions', action='store_true',
+                        help="measure per-job downloader setup time with and without session reuse, then exit")
+    parser.add_argument('--benchmark-search', action='store_true',
+                        help="compare plain and hedged/retried searches against a stub backend, then exit")
+    batch = parser.add_argument_group("batch mode")
+    batch.add_argument('--batch', metavar='FILE',
+                       help="download every search query or URL listed in FILE ('-' reads stdin), without prompts")
+    batch.add_argument('--sync', metavar='URL', nargs='+',
+                       help="download only the videos of these playlists/channels that are not in the archive yet")
+    batch.add_argument('--sync-stop-after', metavar='N', type=int,
+                       help="stop listing after N already-synced videos in a row (default: "
+                            f"{settings['sync_stop_after']} for channels, off for playlists; 0 disables)")
+    batch.add_argument('--format', choices=tuple(OUTPUT_FORMATS), default='mp3', help="output format (default: mp3)")
+    batch.add_argument('--quality', choices=('128', '192', '320'), default='192',
+                       help="mp3 audio quality in kbps (default: 192)")
+    batch.add_argument('--targets', metavar='LIST', type=parse_targets,
+                       help="encode several outputs from one download, e.g. mp3:128,mp3:320,mp4 "
+                            "(overrides --format/--quality)")
+    batch.add_argument('--output-dir', metavar='DIR', help="where to save downloads (default: current directory)")
+    batch.add_argument('--summary', metavar='FILE', help="write the JSON summary to FILE instead of stdout")
+    shared = parser.add_argument_group("shared daemon")
+    shared.add_argument('--daemon', action='store_true',
+                        help="keep one warm process running that other terminals and scripts can use "
+                             "(talk to it with yaytube-client.py)")
+    shared.add_argument('--port', type=int, help=f"daemon port (default: {settings['daemon_port']})")
+    maintenance = parser.add_argument_group("library maintenance")
+    maintenance.add_argument('--analyze-loudness', action='store_true',
+                             help="measure the loudness of new library tracks and write ReplayGain tags "
+                                  "(uses --output-dir as the library when given)")
+    maintenance.add_argument('--scan-library', action='store_true',
+                             help="find damaged or truncated files and duplicate songs (only changed files are re-read)")
+    maintenance.add_argument('--no-tags', action='store_true', help="store loudness measurements without tagging files")
+    maintenance.add_argument('--workers', metavar='N', type=int, help="processes to use (default: one per CPU core)")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.benchmark_startup:
+        benchmark_startup()
+    elif args.benchmark_search:
+        benchmark_search()
+    elif args.benchmark_sessions:
+        benchmark_sessions()
+    elif args.daemon:
+        sys.exit(run_daemon(args.port, args.output_dir))
+    elif args.scan_library:
+        sys.exit(run_library_scan(args.output_dir, args.workers))
+    elif args.analyze_loudness:
+        sys.exit(run_loudness_analysis(args.output_dir, args.workers, write_tags=not args.no_tags))
+    elif args.batch or args.sync:
+        targets = args.targets or parse_targets(f"{args.format}:{args.quality}" if args.format == 'mp3' else args.format)
+        (output_format, quality), *extra_targets = targets
+        if args.batch:
+            sys.exit(run_batch(args.batch, output_format, quality, args.output_dir, args.summary, extra_targets))
+        sys.exit(run_sync(args.sync, output_format, quality, args.output_dir, args.sync_stop_after, extra_targets))
+    else:
+        main()
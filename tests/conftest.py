@@ -0,0 +1,15 @@
+import importlib.util
+import pathlib
+
+import pytest
+
+SCRIPT = pathlib.Path(__file__).resolve().parent.parent / "YAYTUBE-cli.py"
+
+
+@pytest.fixture(scope="session")
+def yt():
+    """YAYTUBE-cli.py loaded as a module; its file name is not importable."""
+    spec = importlib.util.spec_from_file_location("yaytube_cli", SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,41 @@
+import threading
+
+
+class FakeVideosSearch:
+    """Stands in for youtubesearchpython's VideosSearch, counting the pages it is asked for."""
+
+    lock = threading.Lock()
+    fetched = []
+
+    def __init__(self, query, limit):
+        self.query = query
+        self.limit = limit
+        self.page = 1
+        self._fetched()
+
+    def next(self):
+        self.page += 1
+        self._fetched()
+
+    def _fetched(self):
+        with self.lock:
+            self.fetched.append((self.query, self.page))
+
+    def result(self):
+        start = (self.page - 1) * self.limit
+        return {'result': [{'title': f"{self.query} song {idx}",
+                            'link': f"https://www.youtube.com/watch?v={abs(hash((self.query, idx))) % 10 ** 11:011d}",
+                            'publishedTime': "1 year ago", 'duration': "3:00"}
+                           for idx in range(start, start + self.limit)]}
+
+
+def test_follow_up_page_is_chained_on_the_first(yt, tmp_path, monkeypatch):
+    FakeVideosSearch.fetched = []
+    monkeypatch.setattr(yt, 'VideosSearch', FakeVideosSearch)
+    monkeypatch.setattr(yt, 'search_cache', yt.SearchCache(path=str(tmp_path / "cache.db")))
+    videos, answered = yt.artist_search("Queen", max_results=50)
+    assert answered == 3
+    assert sorted(FakeVideosSearch.fetched) == [
+        ("Queen", 1), ("Queen", 2), ("Queen live", 1), ("Queen official audio", 1),
+    ]
+    assert len(videos) == 40
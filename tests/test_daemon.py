@@ -0,0 +1,49 @@
+import http.client
+import json
+import threading
+
+import pytest
+
+
+class IdleQueue:
+    jobs = {}
+
+    def stats(self):
+        return {'queued': 0}
+
+
+@pytest.fixture
+def daemon(yt):
+    server = yt.DaemonAPI(IdleQueue()).make_server(0)
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+def request(port, host, method='GET', path='/status'):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+    connection.putrequest(method, path, skip_host=True)
+    connection.putheader('Host', host)
+    connection.putheader('Content-Type', 'application/json')
+    connection.putheader('Content-Length', '2')
+    connection.endheaders(b'{}' if method == 'POST' else None)
+    response = connection.getresponse()
+    status, body = response.status, json.loads(response.read())
+    connection.close()
+    return status, body
+
+
+@pytest.mark.parametrize("host", ["127.0.0.1:{port}", "localhost:{port}"])
+def test_local_hosts_are_served(daemon, host):
+    status, body = request(daemon, host.format(port=daemon))
+    assert status == 200
+    assert body['jobs'] == []
+
+
+@pytest.mark.parametrize("host", ["evil.example:{port}", "127.0.0.1", "localhost:1"])
+@pytest.mark.parametrize("method,path", [("GET", "/status"), ("POST", "/cancel")])
+def test_other_hosts_are_refused(daemon, host, method, path):
+    status, body = request(daemon, host.format(port=daemon), method, path)
+    assert status == 403
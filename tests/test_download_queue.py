@@ -0,0 +1,139 @@
+import contextlib
+import threading
+
+import pytest
+
+
+class FakeDownloader:
+    """Stands in for download_video: reports progress, and holds jobs listed in `blocked` until released."""
+
+    def __init__(self, chunks=4, chunk_size=1000, limiter=None):
+        self.chunks = chunks
+        self.limiter = limiter  # HostLimiter every stream is fetched under, as fetch_source does
+        self.chunk_size = chunk_size
+        self.started = []
+        self.fetched = []  # Urls in the order they got a host slot
+        self.blocked = {}  # url -> Event that lets the download finish
+        self.running = {}  # url -> Event set once the download has started
+        self.fail = set()
+
+    def block(self, url):
+        self.blocked[url] = threading.Event()
+        self.running[url] = threading.Event()
+        return self.blocked[url]
+
+    def __call__(self, url, output_path, progress_hook=None, on_stage=None, **options):
+        self.started.append(url)
+        if url in self.running:
+            self.running[url].set()
+        with self.limiter.slot('googlevideo.com') if self.limiter else contextlib.nullcontext():
+            self.fetched.append(url)
+            for idx in range(1, self.chunks + 1):
+                if url in self.blocked:
+                    # Keep reporting progress so a cancel is noticed, as yt-dlp does
+                    while not self.blocked[url].wait(0.01):
+                        progress_hook({'status': 'downloading', 'downloaded_bytes': 0, 'filename': output_path})
+                progress_hook({'status': 'downloading', 'downloaded_bytes': idx * self.chunk_size,
+                               'filename': output_path})
+        if on_stage:
+            on_stage('post-processing')
+        if url in self.fail:
+            raise RuntimeError("network down")
+        return [{'path': output_path}]
+
+
+@pytest.fixture
+def downloader():
+    return FakeDownloader()
+
+
+def job(yt, url, priority=10):
+    return yt.DownloadJob(url, f"/tmp/{url}.mp3", priority=priority)
+
+
+def test_jobs_run_in_priority_order(yt, downloader):
+    queue = yt.DownloadQueue(1, downloader=downloader)
+    release = downloader.block('first')
+    queue.submit(job(yt, 'first'))
+    downloader.running['first'].wait(5)
+    for url, priority in (('low', 30), ('high', 0), ('normal', 10), ('normal-later', 10)):
+        queue.submit(job(yt, url, priority))
+    release.set()
+    assert queue.join(5)
+    assert downloader.started == ['first', 'high', 'normal', 'normal-later', 'low']
+
+
+def test_cancel_a_queued_job(yt, downloader):
+    queue = yt.DownloadQueue(1, downloader=downloader)
+    release = downloader.block('first')
+    queue.submit(job(yt, 'first'))
+    downloader.running['first'].wait(5)
+    waiting = queue.submit(job(yt, 'waiting'))
+    assert queue.cancel(waiting.id)
+    assert waiting.state == 'cancelled' and waiting.finished_event.is_set()
+    release.set()
+    assert queue.join(5)
+    assert downloader.started == ['first']
+    assert not queue.cancel(waiting.id)  # Already finished
+
+
+def test_cancel_a_running_job(yt, downloader):
+    finished = []
+    queue = yt.DownloadQueue(1, downloader=downloader, on_finish=finished.append)
+    downloader.block('slow')
+    running = queue.submit(job(yt, 'slow'))
+    downloader.running['slow'].wait(5)
+    assert queue.cancel(running.id)
+    assert queue.join(5)
+    assert running.state == 'cancelled'
+    assert finished == [running]
+
+
+def test_join_times_out_while_a_job_runs(yt, downloader):
+    queue = yt.DownloadQueue(1, downloader=downloader)
+    release = downloader.block('slow')
+    queue.submit(job(yt, 'slow'))
+    assert not queue.join(0.1)
+    release.set()
+    assert queue.join(5)
+
+
+def test_stats_count_states_and_bytes(yt, downloader):
+    downloader.fail.add('broken')
+    queue = yt.DownloadQueue(2, downloader=downloader)
+    done = [queue.submit(job(yt, f'song-{idx}')) for idx in range(3)]
+    failed = queue.submit(job(yt, 'broken'))
+    assert queue.join(5)
+    stats = queue.stats()
+    assert (stats['done'], stats['failed'], stats['queued'], stats['running']) == (3, 1, 0, 0)
+    assert stats['bytes'] == 4 * downloader.chunks * downloader.chunk_size
+    assert all(item.outputs == [{'path': item.output_path}] for item in done)
+    assert failed.error == "network down"
+    assert queue.pending() == 0
+
+
+def test_old_finished_jobs_are_pruned_but_still_counted(yt, downloader):
+    queue = yt.DownloadQueue(1, downloader=downloader, max_history=2)
+    for idx in range(5):
+        queue.submit(job(yt, f'song-{idx}'))
+    assert queue.join(5)
+    assert len(queue.jobs) == 2
+    assert queue.stats()['done'] == 5
+
+
+def test_interactive_job_takes_a_host_slot_from_paused_background_jobs(yt):
+    limiter = yt.HostLimiter(2)
+    downloader = FakeDownloader(limiter=limiter)
+    queue = yt.DownloadQueue(2, downloader=downloader, preempt_priority=5, limiter=limiter)
+    releases = [downloader.block(f'background-{idx}') for idx in range(2)]
+    background = [queue.submit(job(yt, f'background-{idx}', priority=20)) for idx in range(2)]
+    for idx in range(2):
+        downloader.running[f'background-{idx}'].wait(5)
+    wanted = queue.submit(job(yt, 'play-now', priority=0))
+    assert wanted.finished_event.wait(5)
+    assert wanted.state == 'done'
+    assert all(item.state == 'running' for item in background)
+    for release in releases:
+        release.set()
+    assert queue.join(5)
+    assert all(item.state == 'done' and not item.paused for item in background)
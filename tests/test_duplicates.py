@@ -0,0 +1,34 @@
+import numpy as np
+
+
+def song(seed, seconds=30, rate=11025):
+    """A noise 'song' whose spectrum wanders over time, so its fingerprint bits are distinctive."""
+    rng = np.random.default_rng(seed)
+    envelope = np.repeat(rng.uniform(0.2, 1.0, seconds * 4), rate // 4)
+    tone = np.sin(2 * np.pi * rng.uniform(300, 3000) * np.arange(len(envelope)) / rate)
+    return (rng.standard_normal(len(envelope)) * envelope + tone * envelope[::-1]).astype(np.float32)
+
+
+def fingerprints(yt, samples_by_path):
+    profiles, bits = {}, {}
+    for path, samples in samples_by_path.items():
+        profiles[path], bits[path] = yt.spectral_fingerprint(samples)
+    return profiles, bits
+
+
+def test_two_identical_files_cluster(yt):
+    samples = song(1)
+    profiles, bits = fingerprints(yt, {'a.mp3': samples, 'b.mp3': samples.copy()})
+    assert yt.find_duplicates(profiles, bits.__getitem__) == [['a.mp3', 'b.mp3']]
+
+
+def test_two_different_songs_do_not_cluster(yt):
+    profiles, bits = fingerprints(yt, {'a.mp3': song(1), 'b.mp3': song(2)})
+    assert yt.find_duplicates(profiles, bits.__getitem__) == []
+
+
+def test_duplicate_found_in_a_large_library(yt):
+    library = {f'{idx}.mp3': song(idx) for idx in range(60)}
+    library['copy.mp3'] = library['7.mp3'][1024 * 20:]  # Same song with its first ~2 s (whole frames) trimmed
+    profiles, bits = fingerprints(yt, library)
+    assert yt.find_duplicates(profiles, bits.__getitem__) == [['7.mp3', 'copy.mp3']]
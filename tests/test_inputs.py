@@ -0,0 +1,36 @@
+import pytest
+
+
+@pytest.mark.parametrize("url", [
+    "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+    "https://youtu.be/dQw4w9WgXcQ?t=42",
+    "https://music.youtube.com/watch?v=dQw4w9WgXcQ&list=RD",
+])
+def test_extract_video_id_from_urls(yt, url):
+    assert yt.extract_video_id(url) == "dQw4w9WgXcQ"
+
+
+def test_bare_ids_only_when_allowed(yt):
+    assert yt.extract_video_id("dQw4w9WgXcQ") is None
+    assert yt.extract_video_id("dQw4w9WgXcQ", allow_bare=True) == "dQw4w9WgXcQ"
+
+
+@pytest.mark.parametrize("query", ["TaylorSwift", "Linkin-Park"])
+def test_batch_items_shaped_like_ids_are_searched(yt, monkeypatch, query):
+    searched = []
+
+    def search(text, max_results):
+        searched.append(text)
+        return [("Some Song", "https://www.youtube.com/watch?v=dQw4w9WgXcQ")]
+
+    monkeypatch.setattr(yt, 'search_youtube', search)
+    monkeypatch.setattr(yt, 'resolve_video', lambda url: {'title': "Some Song", 'webpage_url': url})
+    title, url, info = yt.resolve_batch_item(query)
+    assert searched == [query]
+    assert url == "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+
+
+def test_stream_hosts_share_the_site_domain(yt):
+    first = yt.stream_host("https://rr1---sn-abc123.googlevideo.com/videoplayback?id=1")
+    second = yt.stream_host("https://rr5---sn-xyz789.googlevideo.com/videoplayback?id=2")
+    assert first == second == "googlevideo.com"
@@ -0,0 +1,113 @@
+import subprocess
+import sys
+
+import pytest
+
+
+@pytest.fixture
+def db(tmp_path):
+    return str(tmp_path / "cache.db")
+
+
+def job(yt, tmp_path, url="https://www.youtube.com/watch?v=dQw4w9WgXcQ", name="song.mp3", query=None):
+    item = yt.DownloadJob(url, str(tmp_path / name), quality='192', title=name)
+    item.query = query
+    return item
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def test_live_owners_keep_their_jobs(yt, tmp_path, db):
+    yt.JobJournal(db).queued(job(yt, tmp_path))
+    assert yt.JobJournal(db).claim_unfinished() == []
+
+
+def test_jobs_of_a_dead_process_are_claimed(yt, tmp_path, db):
+    first = yt.JobJournal(db)
+    first.queued(job(yt, tmp_path))
+    with first.db:
+        first.db.execute('UPDATE journal_owners SET pid = ?', (dead_pid(),))
+    second = yt.JobJournal(db)
+    [entry] = second.claim_unfinished()
+    assert entry['output_path'] == str(tmp_path / "song.mp3")
+    assert entry['owner'] == second.owner
+    assert second.db.execute('SELECT owner FROM job_journal').fetchone() == (second.owner,)
+    # Claimed once: a third process finds nothing left
+    assert yt.JobJournal(db).claim_unfinished() == []
+
+
+def test_jobs_of_a_silent_owner_are_claimed(yt, tmp_path, db):
+    first = yt.JobJournal(db)
+    first.queued(job(yt, tmp_path))
+    with first.db:
+        first.db.execute('UPDATE journal_owners SET heartbeat = 0')
+    assert len(yt.JobJournal(db).claim_unfinished()) == 1
+
+
+def test_released_jobs_are_claimed_at_once(yt, tmp_path, db):
+    first = yt.JobJournal(db)
+    first.queued(job(yt, tmp_path))
+    first.release()
+    assert len(yt.JobJournal(db).claim_unfinished()) == 1
+
+
+def test_finished_jobs_are_not_claimed(yt, tmp_path, db):
+    first = yt.JobJournal(db)
+    item = job(yt, tmp_path)
+    first.queued(item)
+    item.state = 'done'
+    first.finish(item)
+    first.release()
+    assert yt.JobJournal(db).claim_unfinished() == []
+
+
+def test_requeueing_resumes_bytes_and_finished_outputs(yt, tmp_path, db):
+    first = yt.JobJournal(db)
+    item = job(yt, tmp_path)
+    first.queued(item)
+    item.bytes_downloaded = 5000
+    first.stage(item, 'post-processing')
+    first.output_done(item, item.output_path)
+    second = yt.JobJournal(db)
+    assert second.queued(job(yt, tmp_path)) == (5000, [item.output_path])
+    # A different video at the same path starts from scratch
+    assert second.queued(job(yt, tmp_path, url="https://www.youtube.com/watch?v=aaaaaaaaaaa")) == (0, [])
+
+
+def test_lookup_matches_query_targets_and_directory(yt, tmp_path, db):
+    journal = yt.JobJournal(db)
+    item = job(yt, tmp_path, query="never gonna give you up")
+    journal.queued(item)
+    entry = journal.lookup("never gonna give you up", yt.job_targets(item), tmp_path)
+    assert entry['output_path'] == item.output_path
+    assert journal.lookup("never gonna give you up", [('m4a', None)], tmp_path) is None
+    assert journal.lookup("never gonna give you up", yt.job_targets(item), tmp_path / "elsewhere") is None
+
+
+def test_resume_requeues_an_interrupted_job_where_it_stopped(yt, tmp_path, db):
+    first = yt.JobJournal(db)
+    item = job(yt, tmp_path)
+    item.extra_targets = [(str(tmp_path / "song.m4a"), None)]
+    first.queued(item)
+    item.bytes_downloaded = 5000
+    first.stage(item, 'post-processing')
+    first.output_done(item, item.output_path)
+    first.release()
+
+    calls = []
+
+    def downloader(url, output_path, finished_outputs=(), extra_targets=(), **options):
+        calls.append((url, output_path, list(finished_outputs), extra_targets))
+        return []
+
+    queue = yt.DownloadQueue(1, downloader=downloader, journal=yt.JobJournal(db))
+    assert yt.resume_unfinished(queue) == 1
+    assert queue.join(5)
+    assert calls == [(item.url, item.output_path, [item.output_path], [(str(tmp_path / "song.m4a"), None)])]
+    [resumed] = queue.jobs.values()
+    assert resumed.throttled_bytes == 5000  # Already paid for by the interrupted run
+    assert resumed.state == 'done'
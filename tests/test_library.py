@@ -0,0 +1,52 @@
+import os
+
+
+def write_track(index, path, data=b"ID3 fake mp3"):
+    with index.writing(path):
+        with open(f"{path}.part", 'wb') as f:
+            f.write(data)
+        os.replace(f"{path}.part", path)
+
+
+def test_own_writes_do_not_force_a_rescan(yt, tmp_path):
+    library_dir = tmp_path / "music"
+    library_dir.mkdir()
+    index = yt.LibraryIndex(str(library_dir), path=str(tmp_path / "cache.db"))
+    assert index.refresh()
+    write_track(index, str(library_dir / "song.mp3"))
+    assert not index.refresh()
+    assert [track['name'] for track in index.tracks()] == ["song.mp3"]
+
+
+def test_changes_made_before_a_write_still_rescan(yt, tmp_path):
+    library_dir = tmp_path / "music"
+    library_dir.mkdir()
+    index = yt.LibraryIndex(str(library_dir), path=str(tmp_path / "cache.db"))
+    index.refresh()
+    (library_dir / "copied in.mp3").write_bytes(b"ID3 other")
+    write_track(index, str(library_dir / "song.mp3"))
+    assert index.refresh()
+    assert [track['name'] for track in index.tracks()] == ["copied in.mp3", "song.mp3"]
+
+
+class FakeFfmpeg:
+    """Stands in for subprocess.run: writes the output file ffmpeg was asked for."""
+
+    def __call__(self, command, **options):
+        with open(command[-1], 'wb') as f:
+            f.write(b"ID3 encoded")
+        return type('Completed', (), {'returncode': 0, 'stderr': ''})()
+
+
+def test_run_ffmpeg_records_the_output_only_in_the_index_it_is_given(yt, tmp_path, monkeypatch):
+    monkeypatch.setattr(yt.subprocess, 'run', FakeFfmpeg())
+    library_dir = tmp_path / "music"
+    library_dir.mkdir()
+    index = yt.LibraryIndex(str(library_dir), path=str(tmp_path / "cache.db"))
+    index.refresh()
+    yt.run_ffmpeg(['-i', 'source.webm'], str(library_dir / "song.mp3"), index=index)
+    assert not index.refresh()
+    assert [track['name'] for track in index.tracks()] == ["song.mp3"]
+    # As in a loudness worker: the file is rewritten and no index is touched
+    monkeypatch.setattr(yt, 'library', None)
+    yt.run_ffmpeg(['-i', 'song.mp3'], str(library_dir / "song.mp3"))
@@ -0,0 +1,42 @@
+import pytest
+
+
+@pytest.fixture
+def library(yt, tmp_path):
+    music = tmp_path / "music"
+    music.mkdir()
+    for name in ("Bohemian Rhapsody.mp3", "Hotel California.mp3"):
+        (music / name).write_bytes(b"ID3 fake mp3")
+    return yt.LibraryIndex(str(music), path=str(tmp_path / "cache.db"))
+
+
+def names(matches):
+    return [track['name'] for track in matches]
+
+
+def test_downloads_are_indexed_without_reloading_the_library(yt, library, monkeypatch):
+    index = yt.LocalSearchIndex(library)
+    assert names(index.search("bohemian rapsody")) == ["Bohemian Rhapsody.mp3"]
+    monkeypatch.setattr(library, 'tracks', lambda: pytest.fail("reloaded the whole library"))
+    song = f"{library.directory}/Stairway to Heaven.mp3"
+    with library.writing(song):
+        with open(song, 'wb') as f:
+            f.write(b"ID3 fake mp3")
+    library.add(song, artist="Led Zeppelin")
+    assert names(index.search("stairway heaven")) == ["Stairway to Heaven.mp3"]
+    assert names(index.search("led zeppelin")) == ["Stairway to Heaven.mp3"]
+
+
+def test_files_found_by_a_rescan_are_indexed(yt, library):
+    index = yt.LocalSearchIndex(library)
+    index.sync()
+    with open(f"{library.directory}/Wonderwall.mp3", 'wb') as f:
+        f.write(b"ID3 fake mp3")
+    assert names(index.search("wonderwall")) == ["Wonderwall.mp3"]
+
+
+def test_search_does_not_wait_for_the_first_build(yt, library):
+    index = yt.LocalSearchIndex(library)
+    with index._sync_lock:  # Another thread is building the index
+        assert index.search("hotel california") == []
+    assert names(index.search("hotel california")) == ["Hotel California.mp3"]
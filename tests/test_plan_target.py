@@ -0,0 +1,47 @@
+import pytest
+
+# Trimmed from a real yt-dlp format list: a storyboard, the audio-only streams, a muxed
+# 360p mp4, and the 1080p video-only streams in both H.264 and VP9
+FORMATS = [
+    {'format_id': 'sb0', 'ext': 'mhtml', 'vcodec': 'none', 'acodec': 'none'},
+    {'format_id': '139', 'ext': 'm4a', 'vcodec': 'none', 'acodec': 'mp4a.40.5', 'abr': 48.8},
+    {'format_id': '249', 'ext': 'webm', 'vcodec': 'none', 'acodec': 'opus', 'abr': 53.4},
+    {'format_id': '250', 'ext': 'webm', 'vcodec': 'none', 'acodec': 'opus', 'abr': 69.6},
+    {'format_id': '140', 'ext': 'm4a', 'vcodec': 'none', 'acodec': 'mp4a.40.2', 'abr': 129.5},
+    {'format_id': '251', 'ext': 'webm', 'vcodec': 'none', 'acodec': 'opus', 'abr': 135.2},
+    {'format_id': '18', 'ext': 'mp4', 'vcodec': 'avc1.42001E', 'acodec': 'mp4a.40.2', 'height': 360, 'fps': 30,
+     'tbr': 500.1},
+    {'format_id': '137', 'ext': 'mp4', 'vcodec': 'avc1.640028', 'acodec': 'none', 'height': 1080, 'fps': 30,
+     'tbr': 4383.5},
+    {'format_id': '248', 'ext': 'webm', 'vcodec': 'vp9', 'acodec': 'none', 'height': 1080, 'fps': 30,
+     'tbr': 2650.3},
+]
+
+
+@pytest.mark.parametrize("output_format,quality,formats,action,format_ids", [
+    ('m4a', None, FORMATS, 'copy', ['140']),
+    ('m4a', '128', FORMATS, 'transcode', ['251']),
+    ('m4a', '160', FORMATS, 'copy', ['140']),
+    ('mp3', None, FORMATS, 'transcode', ['251']),
+    ('mp3', '320', FORMATS, 'transcode', ['251']),
+    ('opus', None, FORMATS, 'copy', ['251']),
+    ('mp4', None, FORMATS, 'copy', ['137', '140']),
+    ('mp4', None, [f for f in FORMATS if f['format_id'] not in ('137', '139', '140')], 'copy', ['248', '251']),
+    ('mp4', None, [f for f in FORMATS if f['format_id'] not in ('137', '248')] +
+     [{'format_id': '399', 'ext': 'mp4', 'vcodec': 'hev1', 'acodec': 'none', 'height': 1080}], 'transcode',
+     ['399', '251']),
+])
+def test_plan_target(yt, output_format, quality, formats, action, format_ids):
+    plan = yt.plan_target({'formats': formats}, output_format, quality)
+    assert plan['action'] == action
+    assert [f['format_id'] for f in plan['formats']] == format_ids
+
+
+@pytest.mark.parametrize("output_format", ['mp3', 'm4a', 'opus', 'mp4'])
+@pytest.mark.parametrize("info", [{}, {'formats': []}, {'formats': FORMATS[:1]}])
+def test_no_usable_format_list(yt, output_format, info):
+    assert yt.plan_target(info, output_format) is None
+
+
+def test_video_needs_a_video_only_stream(yt):
+    assert yt.plan_target({'formats': [f for f in FORMATS if f['format_id'] not in ('137', '248')]}, 'mp4') is None
@@ -0,0 +1,215 @@
+import random
+import threading
+import time
+
+import pytest
+
+
+class FakePlayerBackend:
+    """Stand-in for the VLC backend: 'plays' each track for a fixed time and records every call."""
+
+    def __init__(self, duration=0.05):
+        self.duration = duration
+        self.events = []
+        self.missing = set()  # Paths that count as not downloaded yet
+
+    def available(self, path):
+        return path not in self.missing
+
+    def prepare(self, path):
+        self.events.append(('prepare', path))
+        return {'path': path, 'timer': None, 'on_end': None}
+
+    def play(self, handle, on_end):
+        self.events.append(('play', handle['path']))
+        handle['on_end'] = on_end
+        self.resume(handle)
+
+    def pause(self, handle):
+        self.events.append(('pause', handle['path']))
+        handle['timer'].cancel()
+
+    def resume(self, handle):
+        handle['timer'] = threading.Timer(self.duration, handle['on_end'])
+        handle['timer'].daemon = True
+        handle['timer'].start()
+
+    def release(self, handle):
+        self.events.append(('release', handle['path']))
+        if handle['timer']:
+            handle['timer'].cancel()
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.time() + timeout
+    while not predicate():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def backend(yt):
+    return FakePlayerBackend(duration=60)  # Long enough that no track ends by itself
+
+
+@pytest.fixture
+def engine(yt, backend):
+    engine = yt.PlaybackEngine(backend)
+    yield engine
+    engine.stop()
+    engine.wait_idle(5)
+
+
+def test_play_starts_the_first_track_and_preloads_the_next(engine, backend):
+    engine.play(['a', 'b', 'c'])
+    assert engine.wait_idle(5)
+    assert backend.events == [('prepare', 'a'), ('play', 'a'), ('prepare', 'b')]
+    assert engine.current_track == 'a'
+
+
+def test_next_plays_the_preloaded_track(engine, backend):
+    engine.play(['a', 'b', 'c'])
+    engine.next()
+    assert engine.wait_idle(5)
+    assert engine.current_track == 'b'
+    # b was prepared once, while a played; c is preloaded now
+    assert backend.events.count(('prepare', 'b')) == 1
+    assert backend.events[-3:] == [('release', 'a'), ('play', 'b'), ('prepare', 'c')]
+
+
+def test_next_after_the_last_track_stops(engine, backend):
+    engine.play(['a', 'b'], start=1)
+    engine.next()
+    assert engine.wait_idle(5)
+    assert engine.current_track is None
+    assert backend.events[-1] == ('release', 'b')
+
+
+def test_previous_goes_back_one_track(engine):
+    engine.play(['a', 'b', 'c'], start=2)
+    engine.previous()
+    assert engine.wait_idle(5)
+    assert engine.current_track == 'b'
+    engine.previous()
+    engine.previous()  # Stays on the first track
+    assert engine.wait_idle(5)
+    assert engine.current_track == 'a'
+
+
+def test_shuffle_keeps_the_current_track_and_preloads_the_new_next_one(engine, backend):
+    random.seed(3)
+    tracks = [str(idx) for idx in range(10)]
+    engine.play(tracks)
+    engine.shuffle()
+    assert engine.wait_idle(5)
+    played = [engine.current_track] + engine.upcoming(9)
+    assert played[0] == '0'
+    assert sorted(played) == sorted(tracks)
+    assert played != tracks
+    assert ('release', '1') in backend.events  # The old preload is dropped
+    assert backend.events[-1] == ('prepare', played[1])
+
+
+def test_end_of_track_advances_to_the_next(yt):
+    backend = FakePlayerBackend(duration=0.05)
+    changes = []
+    engine = yt.PlaybackEngine(backend, on_track_change=changes.append)
+    engine.play(['a', 'b', 'c'])
+    wait_for(lambda: changes == ['a', 'b', 'c'] and engine.current_track is None)
+    assert [event for event in backend.events if event[0] == 'play'] == [('play', 'a'), ('play', 'b'), ('play', 'c')]
+
+
+def test_pause_and_resume(engine, backend):
+    engine.play(['a', 'b'])
+    engine.pause()
+    engine.resume()
+    assert engine.wait_idle(5)
+    assert ('pause', 'a') in backend.events
+    assert not engine.paused
+
+
+def test_tracks_that_are_not_downloaded_are_skipped(engine, backend):
+    backend.missing = {'b'}
+    engine.play(['a', 'b', 'c'])
+    assert engine.wait_idle(5)
+    assert ('prepare', 'b') not in backend.events  # Not preloaded either
+    engine.next()
+    assert engine.wait_idle(5)
+    assert engine.current_track == 'c'
+
+
+class PendingDownloads:
+    """wait_for stand-in: tracks in `pending` are on their way until arrive() is called."""
+
+    def __init__(self, backend, pending):
+        self.backend = backend
+        self.pending = set(pending)
+        self.callbacks = {}
+
+    def __call__(self, path, callback):
+        if path not in self.pending:
+            return False
+        self.callbacks[path] = callback
+        return True
+
+    def arrive(self, path):
+        self.pending.discard(path)
+        self.backend.missing.discard(path)
+        self.callbacks.pop(path)()
+
+
+def test_playback_waits_for_a_track_that_is_downloading(yt, backend):
+    backend.missing = {'a'}
+    downloads = PendingDownloads(backend, ['a'])
+    engine = yt.PlaybackEngine(backend, wait_for=downloads)
+    engine.play(['a', 'b'])
+    assert engine.wait_idle(5)
+    assert engine.waiting == 'a'
+    assert not [event for event in backend.events if event[0] == 'play']
+    downloads.arrive('a')
+    wait_for(lambda: engine.current_track == 'a' and engine.waiting is None and ('play', 'a') in backend.events)
+    engine.stop()
+
+
+def test_next_while_waiting_moves_on(yt, backend):
+    backend.missing = {'a'}
+    downloads = PendingDownloads(backend, ['a'])
+    engine = yt.PlaybackEngine(backend, wait_for=downloads)
+    engine.play(['a', 'b'])
+    engine.next()
+    assert engine.wait_idle(5)
+    assert engine.current_track == 'b' and engine.waiting is None
+    downloads.arrive('a')  # A late arrival does not interrupt b
+    assert engine.wait_idle(5)
+    assert engine.current_track == 'b'
+    engine.stop()
+
+
+def test_failed_download_is_skipped_after_waiting(yt, backend):
+    backend.missing = {'a'}
+    downloads = PendingDownloads(backend, ['a'])
+    engine = yt.PlaybackEngine(backend, wait_for=downloads)
+    engine.play(['a', 'b'])
+    assert engine.wait_idle(5)
+    downloads.pending.discard('a')
+    downloads.callbacks.pop('a')()  # Finished, but the file never appeared
+    wait_for(lambda: engine.current_track == 'b')
+    engine.stop()
+
+
+def test_prefetcher_reports_when_a_prefetch_lands(yt, tmp_path):
+    def downloader(url, output_path, **options):
+        time.sleep(0.1)
+        open(output_path, 'w').close()
+        return []
+
+    queue = yt.DownloadQueue(1, downloader=downloader)
+    prefetcher = yt.PlaylistPrefetcher(queue)
+    song = yt.playlist_entry("Song", url="https://youtu.be/abcdefghijk", path=str(tmp_path / "Song.mp3"))
+    prefetcher.watch([song])
+    assert not prefetcher.wait_for(song['path'], lambda: None)  # Nothing under way yet
+    prefetcher.prefetch([song['path']])
+    landed = threading.Event()
+    assert prefetcher.wait_for(song['path'], landed.set)
+    assert landed.wait(5)
+    assert (tmp_path / "Song.mp3").exists()
@@ -0,0 +1,23 @@
+def last_used(cache, query, limit=5):
+    key = cache.make_key(query, limit)
+    return cache.db.execute('SELECT last_used FROM search_cache WHERE key = ?', (key,)).fetchone()[0]
+
+
+def test_memory_hits_reach_disk_before_eviction(yt, tmp_path):
+    cache = yt.SearchCache(path=str(tmp_path / "cache.db"), max_entries=2)
+    cache.put("first", 5, [("First", "https://www.youtube.com/watch?v=aaaaaaaaaaa")])
+    cache.put("second", 5, [("Second", "https://www.youtube.com/watch?v=bbbbbbbbbbb")])
+    assert cache.get("first", 5)  # Served from memory
+    cache.put("third", 5, [("Third", "https://www.youtube.com/watch?v=ccccccccccc")])
+    keys = {row[0] for row in cache.db.execute('SELECT key FROM search_cache')}
+    assert keys == {cache.make_key("first", 5), cache.make_key("third", 5)}
+
+
+def test_memory_hits_are_flushed_after_the_interval(yt, tmp_path):
+    cache = yt.SearchCache(path=str(tmp_path / "cache.db"))
+    cache.put("song", 5, [("Song", "https://www.youtube.com/watch?v=aaaaaaaaaaa")])
+    with cache.db:
+        cache.db.execute('UPDATE search_cache SET last_used = 0')
+    cache.flush_interval = 0
+    assert cache.get("song", 5)
+    assert last_used(cache, "song") > 0
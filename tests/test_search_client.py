@@ -0,0 +1,107 @@
+import time
+
+import pytest
+
+
+@pytest.fixture
+def stub(yt):
+    return yt.StubSearchBackend(delay=0.01, slow_rate=0.0, error_rate=0.0)
+
+
+def client(yt, backend, **options):
+    options = {'hedge_after': 1.0, 'attempts': 3, 'timeout': 5, 'breaker_threshold': 100, 'breaker_reset': 30,
+               'backoff': 0, **options}
+    return yt.ResilientSearchClient(backend, **options)
+
+
+def test_fast_answers_are_not_hedged(yt, stub):
+    search = client(yt, stub, hedge_after=0.5)
+    assert len(search.search("song", 3)) == 3
+    assert search.hedges == 0
+
+
+def test_hedge_fires_after_hedge_after(yt, stub):
+    stub.slow_rate, stub.slow_delay = 1.0, 0.3
+    search = client(yt, stub, hedge_after=0.05)
+    start = time.perf_counter()
+    search.search("song")
+    assert search.hedges == 1
+    assert time.perf_counter() - start >= 0.3  # Both requests were slow, so the first answer took the slow delay
+
+
+def test_hedged_request_wins_when_the_first_is_slow(yt):
+    class FirstCallSlow(yt.StubSearchBackend):
+        calls = 0
+
+        def __call__(self, *args):
+            self.calls += 1
+            self.slow_rate = 1.0 if self.calls == 1 else 0.0
+            return super().__call__(*args)
+
+    search = client(yt, FirstCallSlow(delay=0.01, slow_delay=2.0, slow_rate=0.0, error_rate=0.0), hedge_after=0.05)
+    start = time.perf_counter()
+    search.search("song")
+    assert search.hedges == 1
+    assert time.perf_counter() - start < 1.0
+
+
+def test_retries_stop_at_attempts(yt, stub):
+    stub.error_rate = 1.0
+    search = client(yt, stub, attempts=3)
+    with pytest.raises(yt.SearchUnavailable, match="injected backend error"):
+        search.search("song")
+    assert search.histogram.errors == 3
+    assert search.retries == 2
+    assert search.state == 'closed'
+
+
+def test_a_retry_can_recover(yt, stub, monkeypatch):
+    stub.error_rate = 0.5
+    draws = iter([0.0, 0.9, 0.9])  # First attempt errors, the second gets through (and is not slow)
+    monkeypatch.setattr(yt.random, 'random', lambda: next(draws))
+    search = client(yt, stub, attempts=3)
+    assert search.search("song")
+    assert search.retries == 1
+
+
+def test_breaker_opens_fails_fast_then_half_opens_and_closes(yt, stub):
+    states = []
+
+    class Recording(type(stub)):
+        def __call__(self, *args):
+            states.append(search.state)
+            return super().__call__(*args)
+
+    backend = Recording(delay=0.01, slow_rate=0.0, error_rate=1.0)
+    search = client(yt, backend, attempts=1, breaker_threshold=2, breaker_reset=0.2)
+    for _ in range(2):
+        with pytest.raises(yt.SearchUnavailable):
+            search.search("song")
+    assert search.state == 'open'
+
+    # Open: fails at once without calling the backend
+    calls = len(states)
+    start = time.perf_counter()
+    with pytest.raises(yt.SearchUnavailable, match="circuit breaker open"):
+        search.search("song")
+    assert time.perf_counter() - start < 0.05
+    assert len(states) == calls
+
+    # After breaker_reset one trial request goes through half-open; success closes the breaker
+    time.sleep(0.25)
+    backend.error_rate = 0.0
+    assert search.search("song")
+    assert states[-1] == 'half-open'
+    assert search.state == 'closed'
+
+
+def test_failed_half_open_trial_reopens_the_breaker(yt, stub):
+    stub.error_rate = 1.0
+    search = client(yt, stub, attempts=3, breaker_threshold=1, breaker_reset=0.1)
+    with pytest.raises(yt.SearchUnavailable):
+        search.search("song")
+    assert search.state == 'open' and search.histogram.errors == 1  # Opening the breaker stops the retries
+    time.sleep(0.15)
+    with pytest.raises(yt.SearchUnavailable, match="injected backend error"):
+        search.search("song")
+    assert search.state == 'open' and search.histogram.errors == 2
@@ -0,0 +1,42 @@
+import os
+import threading
+import time
+
+
+def test_key_locks_serialise_fetches_and_are_dropped(yt, tmp_path):
+    cache = yt.SourceCache(str(tmp_path / "sources"), 1 << 20, path=str(tmp_path / "cache.db"))
+    inside = []
+    overlaps = []
+
+    def fetch():
+        with cache.key_lock("dQw4w9WgXcQ", "251"):
+            inside.append(1)
+            overlaps.append(len(inside))
+            time.sleep(0.02)
+            inside.pop()
+
+    threads = [threading.Thread(target=fetch) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert overlaps == [1, 1, 1, 1]
+    assert cache._key_locks == {}
+
+
+def download(tmp_path, name, size):
+    path = tmp_path / name
+    path.write_bytes(name.encode() * (size // len(name)) + b"x" * (size % len(name)))
+    return str(path)
+
+
+def test_pinned_streams_survive_eviction_until_unpinned(yt, tmp_path):
+    cache = yt.SourceCache(str(tmp_path / "sources"), 100, path=str(tmp_path / "cache.db"))
+    video = cache.put("dQw4w9WgXcQ", "137", download(tmp_path, "video", 90), pin=True)
+    audio = cache.put("dQw4w9WgXcQ", "140", download(tmp_path, "audio", 20), pin=True)
+    assert os.path.exists(video) and os.path.exists(audio)
+    cache.unpin(video)
+    cache.unpin(audio)
+    cache.put("aaaaaaaaaaa", "140", download(tmp_path, "other", 20))
+    assert not os.path.exists(video)
+    assert cache._pins == {}
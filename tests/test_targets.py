@@ -0,0 +1,24 @@
+import pytest
+
+
+def test_parse_targets(yt):
+    assert yt.parse_targets("mp3:128, m4a, opus:96, mp4") == [('mp3', '128'), ('m4a', None), ('opus', '96'), ('mp4', None)]
+    assert yt.parse_targets("mp3") == [('mp3', '192')]
+
+
+@pytest.mark.parametrize("text", ["mp3:abc", "mp3:192k", "m4a:high", "flac", ""])
+def test_parse_targets_rejects_bad_input(yt, text):
+    with pytest.raises(ValueError):
+        yt.parse_targets(text)
+
+
+def test_quality_prompt_asks_again_until_it_gets_a_bitrate(yt, monkeypatch):
+    answers = iter(["mp3", "abc", "320k", "320"])
+    monkeypatch.setattr('builtins.input', lambda prompt="": next(answers))
+    assert yt.ask_output_targets() == [('mp3', '320')]
+
+
+def test_quality_prompt_defaults_to_192(yt, monkeypatch):
+    answers = iter(["mp3", ""])
+    monkeypatch.setattr('builtins.input', lambda prompt="": next(answers))
+    assert yt.ask_output_targets() == [('mp3', '192')]
@@ -0,0 +1,100 @@
+"""Thin client for a running `YAYTUBE-cli.py --daemon`.
+
+Only the standard library is imported, so each command costs little more than starting Python.
+"""
+import os
+import sys
+import json
+import argparse
+import urllib.error
+import urllib.request
+from urllib.parse import quote
+
+CONFIG_FILE = "config.json"
+DEFAULT_PORT = 8765
+
+def daemon_port():
+    """The daemon port from config.json, as YAYTUBE-cli.py reads it."""
+    if os.path.exists(CONFIG_FILE):
+        with open(CONFIG_FILE, "r") as file:
+            return json.load(file).get("daemon_port", DEFAULT_PORT)
+    return DEFAULT_PORT
+
+def daemon_request(port, path, body=None):
+    """Call the daemon API and return the decoded JSON reply."""
+    request = urllib.request.Request(
+        f"http://127.0.0.1:{port}{path}",
+        data=None if body is None else json.dumps(body).encode(),
+        headers={'Content-Type': 'application/json'},
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=120) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as e:
+        raise RuntimeError(json.load(e).get('error', str(e)))
+
+def format_size(num_bytes):
+    """Format a byte count for display."""
+    for unit in ('B', 'KB', 'MB'):
+        if num_bytes < 1024:
+            return f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} GB"
+
+def format_duration(seconds):
+    """Format a duration in seconds as m:ss."""
+    if not seconds:
+        return ""
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes}:{seconds:02d}"
+
+def parse_args(argv=None):
+    """Parse command-line options."""
+    parser = argparse.ArgumentParser(description="Send commands to a running YaYtube daemon.")
+    parser.add_argument('--port', type=int, help="daemon port (default: daemon_port in config.json, or 8765)")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('status', help="show the download queue")
+    submit = commands.add_parser('submit', help="download a URL, a playlist/channel, or the first result of a search")
+    submit.add_argument('item', nargs='+')
+    submit.add_argument('--targets', default='mp3:192', help="output formats, e.g. mp3:320,m4a (default: mp3:192)")
+    submit.add_argument('--priority', type=int, default=10, help="lower numbers download first (default: 10)")
+    cancel = commands.add_parser('cancel', help="cancel a queued or running download")
+    cancel.add_argument('job_id', type=int)
+    commands.add_parser('library', help="list downloaded songs")
+    search = commands.add_parser('search', help="search YouTube through the daemon's warm search client")
+    search.add_argument('query', nargs='+')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    port = args.port or daemon_port()
+    try:
+        if args.command == 'status':
+            reply = daemon_request(port, '/status')
+            for job in reply['jobs']:
+                print(f"#{job['id']:<4} {job['state']:<9} {format_size(job['bytes']):>10}  {job['title']}")
+            stats = reply['stats']
+            print(f"{stats['running']} running, {stats['queued']} queued, {stats['done']} done, {stats['failed']} failed")
+            print(f"{stats['paused']} paused, oldest wait {stats['oldest_wait']:.1f}s, average wait "
+                  f"{stats['avg_wait']:.1f}s, {format_size(stats['current_bytes_per_second'])}/s now")
+        elif args.command == 'submit':
+            reply = daemon_request(port, '/submit', {'item': ' '.join(args.item), 'targets': args.targets,
+                                                     'priority': args.priority})
+            print(f"Queued #{reply['job']['id']}: {reply['job']['title']}" if 'job' in reply
+                  else f"Listing {reply['collection']} in the background")
+        elif args.command == 'cancel':
+            reply = daemon_request(port, '/cancel', {'id': args.job_id})
+            print("Cancelled" if reply['cancelled'] else "That job cannot be cancelled")
+        elif args.command == 'library':
+            for track in daemon_request(port, '/library')['tracks']:
+                print(f"{format_duration(track['duration']):>6}  {track['name']}")
+        elif args.command == 'search':
+            for video in daemon_request(port, f"/search?q={quote(' '.join(args.query))}")['results']:
+                print(f"{video['duration']:>8}  {video['title']}  {video['url']}")
+    except (OSError, RuntimeError) as e:
+        print(f"Daemon request failed: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())